@@ -10,8 +10,10 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+from datetime import timedelta
 from pathlib import Path
 import os
+from celery.schedules import crontab
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -93,6 +95,16 @@ DATABASES = {
     }
 }
 
+# Cache: the Redis already deployed for Celery (tests override it)
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.getenv("CACHE_URL", "redis://redis:6379/1"),
+    }
+}
+# Upper bound on how long a cached response may live
+RESPONSE_CACHE_TIMEOUT = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -179,9 +191,34 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 # File Upload Settings
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB
+# Batch uploads (/api/files/batch-upload/) carry many files per request
+DATA_UPLOAD_MAX_NUMBER_FILES = 1000
 FILE_UPLOAD_PERMISSIONS = 0o644
 FILE_UPLOAD_DIRECTORY_PERMISSIONS = 0o755
 
+# Encrypted files are stored as AES-GCM segments of this many plaintext bytes
+FILE_ENCRYPTION_CHUNK_SIZE = 1048576  # 1MB
+# Compress plaintext before encryption ('zlib', 'lzma' or None).
+# Already compressed formats are detected and stored as is.
+FILE_COMPRESSION = 'zlib'
+FILE_COMPRESSION_LEVEL = None  # codec default
+# Plaintext is compressed in independent windows of this many bytes, so a
+# Range request only decompresses the windows it covers
+# (default: FILE_ENCRYPTION_CHUNK_SIZE)
+FILE_COMPRESSION_WINDOW = None
+# Thread pool that encrypts batch-upload parts in parallel
+# (default: min(32, CPUs + 4))
+FILE_TRANSFER_WORKERS = None
+
+# Asynchronous uploads (/api/ingest/) wait for the ingest worker here as
+# plaintext; must not be under MEDIA_ROOT, which is served in DEBUG
+FILE_STAGING_ROOT = os.path.join(BASE_DIR, 'upload_staging')
+# Jobs without progress for this long are re-queued, up to INGEST_MAX_ATTEMPTS
+# times and for at most INGEST_MAX_AGE_HOURS, then failed
+INGEST_STALE_MINUTES = 30
+INGEST_MAX_ATTEMPTS = 3
+INGEST_MAX_AGE_HOURS = 24
+
 # Create media directory if it doesn't exist
 if not os.path.exists(MEDIA_ROOT):
     os.makedirs(MEDIA_ROOT)
@@ -190,7 +227,9 @@ if not os.path.exists(os.path.join(MEDIA_ROOT, 'encrypted_files')):
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication', 
+        # JWT is primary; DB tokens keep working for already issued clients
+        'file_sharing.authentication.StatelessJWTAuthentication',
+        'rest_framework.authentication.TokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -203,6 +242,18 @@ REST_FRAMEWORK = {
     ],
 }
 
+SIMPLE_JWT = {
+    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=15),
+    'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
+    'TOKEN_OBTAIN_SERIALIZER': 'file_sharing.authentication.ClaimsTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'file_sharing.authentication.RevocationAwareRefreshSerializer',
+}
+
+# Password hashing pool for the async login/register views
+# (defaults: one worker per CPU, eight queued requests per worker)
+PASSWORD_HASHING_WORKERS = None
+PASSWORD_HASHING_MAX_PENDING = None
+
 # Allow registration endpoint to be accessed without authentication
 REST_FRAMEWORK_EXCEPTIONS = {
     'EXCEPTION_HANDLER': 'rest_framework.views.exception_handler'
@@ -257,4 +308,41 @@ if not os.path.exists(os.path.join(MEDIA_ROOT, 'encrypted_files')):
 
 
 CELERY_BROKER_URL ='redis://redis:6379/0'
+# Encryption of asynchronous uploads runs on its own queue/worker
+CELERY_TASK_ROUTES = {
+    'file_sharing.tasks.ingest_file': {'queue': 'ingest'},
+}
+# Periodic jobs, run by `celery -A backend beat`
+CELERY_BEAT_SCHEDULE = {
+    'reconcile-user-stats': {
+        'task': 'file_sharing.tasks.reconcile_user_stats',
+        'schedule': crontab(hour=3, minute=0),
+    },
+    'prune-activity-events': {
+        'task': 'file_sharing.tasks.prune_activity_events',
+        'schedule': crontab(hour=3, minute=30),
+    },
+    'reconcile-storage-usage': {
+        'task': 'file_sharing.tasks.reconcile_storage_usage',
+        'schedule': crontab(hour=3, minute=45),
+    },
+    'recover-ingest-jobs': {
+        'task': 'file_sharing.tasks.recover_ingest_jobs',
+        'schedule': crontab(minute='*/10'),
+    },
+    'expire-upload-sessions': {
+        'task': 'file_sharing.tasks.expire_upload_sessions',
+        'schedule': crontab(minute=40),
+    },
+    # Deletes queue a purge themselves; this catches anything left behind
+    'purge-deleted-files': {
+        'task': 'file_sharing.tasks.purge_deleted_files',
+        'schedule': crontab(minute=15),
+    },
+}
+# Resumable upload sessions with no new chunks for this long are removed
+UPLOAD_SESSION_MAX_AGE_HOURS = 24
+# Activity feed retention
+ACTIVITY_RETENTION_DAYS = 90
+ACTIVITY_MAX_EVENTS_PER_USER = 1000
 AUTH_USER_MODEL = 'file_sharing.User'
\ No newline at end of file
@@ -0,0 +1,61 @@
+"""
+Хранение ленты активности.
+
+ActivityEvent только дописывается, поэтому таблицу ограничивают по
+расписанию: события старше ACTIVITY_RETENTION_DAYS удаляются, а у
+каждого пользователя остаются не больше ACTIVITY_MAX_EVENTS_PER_USER
+последних событий. Удаление идёт пачками, чтобы не держать долгих
+блокировок.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import ActivityEvent
+
+DEFAULT_RETENTION_DAYS = 90
+DEFAULT_MAX_EVENTS_PER_USER = 1000
+
+
+def get_retention_days():
+    return getattr(settings, 'ACTIVITY_RETENTION_DAYS', DEFAULT_RETENTION_DAYS)
+
+
+def get_max_events_per_user():
+    return getattr(settings, 'ACTIVITY_MAX_EVENTS_PER_USER',
+                   DEFAULT_MAX_EVENTS_PER_USER)
+
+
+def _delete_in_batches(queryset, batch_size):
+    deleted = 0
+    while True:
+        ids = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += ActivityEvent.objects.filter(pk__in=ids).delete()[0]
+
+
+def prune_activity(batch_size=1000):
+    """Удаляет устаревшие и лишние события. Возвращает число удалённых."""
+    cutoff = timezone.now() - timedelta(days=get_retention_days())
+    deleted = _delete_in_batches(
+        ActivityEvent.objects.filter(timestamp__lt=cutoff), batch_size)
+
+    limit = get_max_events_per_user()
+    crowded = (ActivityEvent.objects.values('user_id')
+               .annotate(count=Count('id')).filter(count__gt=limit)
+               .values_list('user_id', flat=True))
+    for user_id in crowded:
+        # Самое старое из оставляемых событий, по индексу (user, -timestamp, -id)
+        oldest_kept = (ActivityEvent.objects.filter(user_id=user_id)
+                       .order_by('-timestamp', '-id')
+                       .values('timestamp', 'id')[limit - 1])
+        deleted += _delete_in_batches(
+            ActivityEvent.objects.filter(
+                user_id=user_id, timestamp__lte=oldest_kept['timestamp'])
+            .exclude(timestamp=oldest_kept['timestamp'],
+                     id__gte=oldest_kept['id']),
+            batch_size)
+    return deleted
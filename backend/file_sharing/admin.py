@@ -65,4 +65,39 @@ class CustomUserAdmin(UserAdmin):
 
 admin.site.site_header = _("Панель администратора")
 admin.site.site_title = _("Администрирование")
-admin.site.index_title = _("Добро пожаловать в админ-панель")
\ No newline at end of file
+admin.site.index_title = _("Добро пожаловать в админ-панель")
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'owner', 'size', 'chunk_size', 'created_at')
+    search_fields = ('name', 'owner__username')
+    autocomplete_fields = ('owner',)
+
+
+@admin.register(Blob)
+class BlobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'digest', 'file', 'size', 'ref_count', 'created_at')
+    search_fields = ('digest', 'file')
+
+
+@admin.register(IngestJob)
+class IngestJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'owner', 'size', 'status', 'processed', 'attempts', 'created_at')
+    search_fields = ('name', 'owner__username')
+    list_filter = ('status',)
+    autocomplete_fields = ('owner',)
+
+
+@admin.register(UserStats)
+class UserStatsAdmin(admin.ModelAdmin):
+    list_display = ('user', 'file_count', 'total_bytes', 'share_count', 'download_count', 'updated_at')
+    search_fields = ('user__username', 'user__email')
+    autocomplete_fields = ('user',)
+
+
+@admin.register(ActivityEvent)
+class ActivityEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'event_type', 'file_name', 'other_username', 'timestamp')
+    search_fields = ('user__username', 'file_name', 'other_username')
+    list_filter = ('event_type',)
+    autocomplete_fields = ('user',)
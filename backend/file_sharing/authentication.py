@@ -0,0 +1,158 @@
+"""
+JWT-аутентификация без обращения к базе.
+
+Access-токен несёт id пользователя, поля, которые отдаёт UserSerializer,
+и роль, и пользователь запроса собирается из этих claims, без запроса User и
+Token. Каждый токен несёт версию токенов пользователя (claim ``ver``),
+отзыв увеличивает её: смена пароля, удаление пользователя и изменение
+прав (is_active, is_staff, is_superuser, роль), иначе старые claims
+давали бы прежние права до конца жизни access-токена. Сравнение
+версий строгое: токен, выданный в ту же секунду до отзыва, недействителен,
+а выданный после — действует. Текущая версия хранится:
+
+* в кэше — ключ на пользователя, живёт столько же, сколько access-токен;
+  по нему отсекаются ещё не истёкшие access-токены;
+* в базе (User.token_version) — по ней проверяется refresh-токен,
+  когда по нему выдаётся новый access-токен. Обновление и так читает
+  пользователя из базы и заодно обновляет роль и флаги в claims.
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils.translation import gettext_lazy as _
+from rest_framework import serializers
+from rest_framework.authtoken.models import Token
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from .models import User, UserProfile
+
+
+VERSION_CLAIM = 'ver'
+# Версия удалённого пользователя: недействителен любой его токен
+_ALL_REVOKED = 2 ** 63
+
+
+def _version_key(user_id):
+    return f'jwt:version:{user_id}'
+
+
+def _user_role(user):
+    try:
+        return user.userprofile.role
+    except UserProfile.DoesNotExist:
+        return None
+
+
+# Поля пользователя в claims: всё, что отдаёт UserSerializer
+_USER_CLAIMS = ('username', 'email', 'first_name', 'last_name',
+                'is_staff', 'is_superuser')
+
+
+def add_claims(token, user):
+    for field in _USER_CLAIMS:
+        token[field] = getattr(user, field)
+    token['role'] = _user_role(user)
+    token[VERSION_CLAIM] = user.token_version
+    return token
+
+
+def tokens_for(user):
+    """Пара токенов для ответа на вход и регистрацию."""
+    refresh = add_claims(RefreshToken.for_user(user), user)
+    return {
+        'refresh': str(refresh),
+        'access': str(refresh.access_token),
+    }
+
+
+def revoke_tokens(user):
+    """
+    Отзывает все выданные пользователю токены. Токены, выданные после
+    этого для ``user`` (версия обновляется и в объекте), работают.
+    """
+    with transaction.atomic():
+        updated = User.objects.filter(pk=user.pk).update(
+            token_version=F('token_version') + 1)
+        if updated:
+            user.token_version = version = User.objects.values_list(
+                'token_version', flat=True).get(pk=user.pk)
+        else:
+            # Пользователь уже удалён: строки нет, токены отсекает кэш
+            version = _ALL_REVOKED
+        # Старые токены DRF из базы тоже перестают действовать
+        Token.objects.filter(user_id=user.pk).delete()
+    cache.set(_version_key(user.pk), version,
+              api_settings.ACCESS_TOKEN_LIFETIME.total_seconds())
+
+
+def _is_revoked(token, version):
+    # Токены, выданные до появления claim, имеют версию 0
+    return version is not None and token.get(VERSION_CLAIM, 0) < version
+
+
+def user_from_claims(token):
+    """
+    Несохраняемый User из claims. Профиль подставляется в кэш связи,
+    поэтому ``user.userprofile.role`` тоже не ходит в базу.
+    """
+    user = User(
+        id=token[api_settings.USER_ID_CLAIM],
+        **{field: token[field] for field in _USER_CLAIMS if field in token})
+    user._state.adding = False
+    user._state.db = 'default'
+    role = token.get('role')
+    profile = UserProfile(user=user, role=role) if role else None
+    User.userprofile.related.set_cached_value(user, profile)
+    return user
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    Основная аутентификация API. Вместо пользователя из базы возвращает
+    User, собранный из claims; единственная проверка — ключ отзыва в
+    кэше. Представлениям, которым нужна вся строка (смена пароля,
+    профиль), нужно перечитать пользователя из базы.
+    """
+
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+        user_id = validated_token[api_settings.USER_ID_CLAIM]
+        if _is_revoked(validated_token, cache.get(_version_key(user_id))):
+            raise AuthenticationFailed(_('Token has been revoked'), code='token_revoked')
+        return user_from_claims(validated_token)
+
+
+class RevocationAwareRefreshSerializer(serializers.Serializer):
+    """
+    Обновление access-токена: проверяет, что пользователь существует,
+    активен и не отзывал токены после выдачи refresh-токена, и выдаёт
+    access-токен с актуальными claims.
+    """
+    refresh = serializers.CharField()
+    access = serializers.CharField(read_only=True)
+
+    def validate(self, attrs):
+        refresh = RefreshToken(attrs['refresh'])
+        user = (User.objects.select_related('userprofile')
+                .filter(pk=refresh.get(api_settings.USER_ID_CLAIM)).first())
+        if user is None or not user.is_active:
+            raise AuthenticationFailed(
+                _('No active account found for the given token.'),
+                code='no_active_account')
+        if _is_revoked(refresh, user.token_version):
+            raise AuthenticationFailed(_('Token has been revoked'), code='token_revoked')
+        access = add_claims(AccessToken.for_user(user), user)
+        return {'access': str(access)}
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """/api/token/ выдаёт токены с теми же claims, что и вход."""
+
+    @classmethod
+    def get_token(cls, user):
+        return add_claims(super().get_token(user), user)
@@ -0,0 +1,196 @@
+"""
+Пакетная загрузка: много файлов в одном multipart-запросе.
+
+Тело запроса разбирается последовательно, а каждый файл шифруется своим
+заданием в пуле передачи файлов (см. transfers). Блоки одного файла
+обрабатываются строго по порядку, разные файлы — параллельно: cryptography
+и zlib отпускают GIL на время работы. Пока один файл шифруется, следующий
+уже принимается из сети.
+
+Разбор ждёт, если в пуле скопилось больше MAX_PENDING_BYTES ещё не
+обработанных данных, поэтому память на запрос ограничена, как бы быстро
+ни приходили данные.
+"""
+import hashlib
+import threading
+from collections import deque
+
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+
+from . import encryption, transfers
+from .compression import AdaptiveCompressor
+from .storage import create_blob
+from .upload_handlers import EncryptedUploadedFile
+
+MAX_PENDING_BYTES = 16 * 1024 * 1024
+# Каждое незаконченное задание держит открытый файл в хранилище и
+# занимает столько байт бюджета, так что и открытых файлов не больше
+# MAX_PENDING_BYTES / JOB_COST
+JOB_COST = 64 * 1024
+
+
+class _Budget:
+    """Сколько байт отдано в пул и ещё не обработано."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, amount):
+        with self._condition:
+            # Пустой бюджет пропускает любой блок, иначе большой блок ждал бы вечно
+            while self.used and self.used + amount > self.limit:
+                self._condition.wait()
+            self.used += amount
+
+    def release(self, amount):
+        with self._condition:
+            self.used -= amount
+            self._condition.notify_all()
+
+
+class _EncryptionJob:
+    """
+    Сжатие, шифрование и запись одного файла. Блоки копятся в очереди, и
+    в пуле её разбирает не больше одной задачи за раз, поэтому порядок
+    сохраняется, а ни один поток пула не ждёт другого.
+    """
+
+    def __init__(self, executor, budget, name, content_type, charset):
+        self._executor = executor
+        self._budget = budget
+        self.name = name
+        self.content_type = content_type
+        self.charset = charset
+        self.size = 0
+        self.error = None
+
+        budget.acquire(JOB_COST)
+        self.encryption_key = encryption.generate_key()
+        self._encryptor = encryption.StreamEncryptor(self.encryption_key)
+        self._compressor = AdaptiveCompressor()
+        self._sha256 = hashlib.sha256()
+        self.stored_size = 0
+        self.storage_name, self._destination = create_blob()
+
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._running = False
+        self._finished = threading.Event()
+
+    def feed(self, data, final=False):
+        self._budget.acquire(len(data))
+        with self._lock:
+            self._queue.append((data, final))
+            if self._running:
+                return
+            self._running = True
+        self._executor.submit(self._drain)
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                if not self._queue:
+                    self._running = False
+                    return
+                data, final = self._queue.popleft()
+            try:
+                if self.error is None:
+                    self._process(data, final)
+            except Exception as e:
+                self.error = e
+            finally:
+                self._budget.release(len(data))
+            if final:
+                self._destination.close()
+                self._budget.release(JOB_COST)
+                self._finished.set()
+
+    def _write(self, data):
+        self._destination.write(data)
+        self.stored_size += len(data)
+
+    def _process(self, data, final):
+        self._sha256.update(data)
+        self._write(self._encryptor.update(self._compressor.compress(data)))
+        if final:
+            self._write(self._encryptor.update(self._compressor.flush()))
+            self._write(self._encryptor.finalize())
+
+    def wait(self):
+        self._finished.wait()
+
+    def result(self):
+        """EncryptedUploadedFile, когда файл целиком записан."""
+        self.wait()
+        if self.error is not None:
+            raise self.error
+        return EncryptedUploadedFile(
+            name=self.name,
+            content_type=self.content_type,
+            size=self.size,
+            charset=self.charset,
+            storage_name=self.storage_name,
+            encryption_key=self.encryption_key,
+            stored_size=self.stored_size,
+            checksum=self._sha256.hexdigest(),
+            compression=self._compressor.codec,
+            compression_index=self._compressor.index,
+        )
+
+
+class BatchEncryptingUploadHandler(FileUploadHandler):
+    """
+    Шифрует все части поля ``files`` параллельно. В request.FILES попадают
+    задания; готовые EncryptedUploadedFile возвращает ``results()``.
+    """
+    field_name_to_encrypt = 'files'
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.jobs = []
+        self.job = None
+        self._budget = _Budget(MAX_PENDING_BYTES)
+        self._executor = transfers.get_executor()
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.job = None
+        if field_name != self.field_name_to_encrypt:
+            return
+        self.job = _EncryptionJob(
+            self._executor, self._budget,
+            self.file_name, self.content_type, self.charset)
+        self.jobs.append(self.job)
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.job is None:
+            return raw_data
+        self.job.feed(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if self.job is None:
+            return None
+        job, self.job = self.job, None
+        job.size = file_size
+        job.feed(b'', final=True)
+        return job
+
+    def upload_interrupted(self):
+        if self.job is not None:
+            self.job.feed(b'', final=True)
+            self.job = None
+
+    def results(self):
+        return [job.result() for job in self.jobs]
+
+    def discard(self):
+        """Удаляет всё, что успело записаться в хранилище."""
+        self.upload_interrupted()
+        for job in self.jobs:
+            job.wait()
+            default_storage.delete(job.storage_name)
@@ -0,0 +1,239 @@
+"""
+Сжатие перед шифрованием.
+
+Шифртекст не сжимается, поэтому сжимать можно только открытый текст до
+шифрования. Решение принимается по первому блоку: известные сжатые
+форматы (JPEG, ZIP и офисные документы на его основе, MP4 и т.п.) и
+данные, которые плохо сжимаются на пробе, сохраняются как есть.
+
+Открытый текст сжимается окнами фиксированного размера, и каждое окно —
+отдельный поток zlib/lzma. Длины сжатых окон хранятся в индексе
+(Blob.compression_index), поэтому диапазон распаковывается с начала
+своего окна, а не с начала файла. Подряд идущие потоки окон читаются и
+последовательно, как один.
+"""
+import lzma
+import struct
+import zlib
+
+from django.conf import settings
+
+
+CODECS = ('zlib', 'lzma')
+
+# Сигнатуры форматов, которые уже сжаты
+_SIGNATURES = (
+    b'\xff\xd8\xff',        # JPEG
+    b'\x89PNG',             # PNG
+    b'GIF8',                # GIF
+    b'PK\x03\x04',          # ZIP, docx/xlsx/pptx, jar, apk
+    b'\x1f\x8b',            # gzip
+    b'BZh',                 # bzip2
+    b'\xfd7zXZ',            # xz
+    b'(\xb5/\xfd',          # zstd
+    b'7z\xbc\xaf',          # 7z
+    b'Rar!',                # rar
+    b'OggS',                # ogg
+    b'ID3',                 # mp3
+    b'fLaC',                # flac
+    b'\x1aE\xdf\xa3',       # mkv/webm
+)
+# Пробное сжатие должно сэкономить хотя бы 10%
+_MIN_RATIO = 0.9
+_SAMPLE_SIZE = 64 * 1024
+# Сколько байт распаковывать за раз, чтобы не раздувать память
+_MAX_OUTPUT = 1024 * 1024
+_INDEX_ENTRY = struct.Struct('>I')
+
+
+def get_codec():
+    return getattr(settings, 'FILE_COMPRESSION', None) or ''
+
+
+def get_window():
+    # По умолчанию окно совпадает с сегментом шифрования: диапазон стоит
+    # порядка одного расшифрованного и распакованного сегмента
+    return (getattr(settings, 'FILE_COMPRESSION_WINDOW', None)
+            or getattr(settings, 'FILE_ENCRYPTION_CHUNK_SIZE', 1024 * 1024))
+
+
+def pack_index(window, lengths):
+    return struct.pack(f'>{len(lengths) + 1}I', window, *lengths)
+
+
+def unpack_index(index):
+    """(размер окна, длины сжатых окон) из ``pack_index``."""
+    index = bytes(index)
+    values = struct.unpack(f'>{len(index) // _INDEX_ENTRY.size}I', index)
+    return values[0], values[1:]
+
+
+def is_compressed_format(sample):
+    # MP4/MOV/HEIC: box "ftyp" по смещению 4
+    return sample.startswith(_SIGNATURES) or sample[4:8] == b'ftyp'
+
+
+def worth_compressing(sample):
+    sample = sample[:_SAMPLE_SIZE]
+    if not sample or is_compressed_format(sample):
+        return False
+    return len(zlib.compress(sample, 1)) < len(sample) * _MIN_RATIO
+
+
+def _compressobj(codec):
+    level = getattr(settings, 'FILE_COMPRESSION_LEVEL', None)
+    if codec == 'zlib':
+        return zlib.compressobj(6 if level is None else level)
+    if codec == 'lzma':
+        return lzma.LZMACompressor(preset=1 if level is None else level)
+    raise ValueError(f'Unknown compression codec: {codec}')
+
+
+class AdaptiveCompressor:
+    """
+    Потоковый компрессор, который решает, сжимать ли данные, по первому
+    блоку. Итоговый кодек (или '' — без сжатия) доступен в ``codec``,
+    индекс сжатых окон — в ``index`` (после ``flush()``).
+    """
+
+    def __init__(self, codec=None, window=None):
+        self.preferred = get_codec() if codec is None else codec
+        self.window = window or get_window()
+        self.codec = ''
+        self._compressor = None
+        self._decided = False
+        self._lengths = []
+        self._window_in = 0
+        self._window_out = 0
+
+    @property
+    def index(self):
+        if self._compressor is None:
+            return None
+        return pack_index(self.window, self._lengths)
+
+    def _emit(self, out, data):
+        if data:
+            out.append(data)
+            self._window_out += len(data)
+
+    def _close_window(self, out):
+        self._emit(out, self._compressor.flush())
+        self._lengths.append(self._window_out)
+        self._window_in = self._window_out = 0
+
+    def compress(self, data):
+        if not self._decided:
+            self._decided = True
+            if self.preferred and worth_compressing(bytes(data)):
+                self.codec = self.preferred
+                self._compressor = _compressobj(self.codec)
+        if self._compressor is None:
+            return data
+        out = []
+        view = memoryview(data)
+        while view:
+            take = min(len(view), self.window - self._window_in)
+            self._emit(out, self._compressor.compress(view[:take]))
+            self._window_in += take
+            view = view[take:]
+            if self._window_in == self.window:
+                self._close_window(out)
+                self._compressor = _compressobj(self.codec)
+        return b''.join(out)
+
+    def flush(self):
+        if self._compressor is None:
+            return b''
+        out = []
+        # Пустое окно после последнего полного не записывается
+        if self._window_in or not self._lengths:
+            self._close_window(out)
+        return b''.join(out)
+
+
+def compress_stream(chunks, compressor):
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    tail = compressor.flush()
+    if tail:
+        yield tail
+
+
+def _decompressobj(codec):
+    if codec == 'zlib':
+        return zlib.decompressobj()
+    if codec == 'lzma':
+        return lzma.LZMADecompressor()
+    raise ValueError(f'Unknown compression codec: {codec}')
+
+
+def decompress_stream(codec, chunks):
+    """
+    Распаковывает подряд идущие сжатые потоки кусками не больше
+    _MAX_OUTPUT байт.
+    """
+    decompressor = _decompressobj(codec)
+    for chunk in chunks:
+        data = chunk
+        while True:
+            if decompressor.eof:
+                # Следующее окно — новый поток
+                data = decompressor.unused_data + data
+                decompressor = _decompressobj(codec)
+                if not data:
+                    break
+            output = decompressor.decompress(data, _MAX_OUTPUT)
+            if output:
+                yield output
+            if codec == 'zlib':
+                data = decompressor.unconsumed_tail
+                if not data and not decompressor.eof:
+                    break
+            else:
+                data = b''
+                if decompressor.needs_input and not decompressor.eof:
+                    break
+    if codec == 'zlib':
+        yield decompressor.flush()
+
+
+class DecompressingReader:
+    """
+    Интерфейс ContainerReader поверх сжатого содержимого. Диапазон
+    распаковывается с начала первого окна, которое он задевает; у файлов
+    без индекса (сжатых одним потоком) — с начала файла.
+    """
+
+    def __init__(self, reader, codec, size, index=None):
+        self.reader = reader
+        self.codec = codec
+        self.size = size
+        self.window = None
+        if index:
+            self.window, lengths = unpack_index(index)
+            self._offsets = [0]
+            for length in lengths:
+                self._offsets.append(self._offsets[-1] + length)
+
+    def iter_range(self, start, stop):
+        if stop <= start:
+            return
+        if self.window:
+            first = start // self.window
+            last = min((stop - 1) // self.window, len(self._offsets) - 2)
+            offset = first * self.window
+            compressed = self.reader.iter_range(
+                self._offsets[first], self._offsets[last + 1])
+        else:
+            offset = 0
+            compressed = self.reader.iter_range(0, self.reader.size)
+        for data in decompress_stream(self.codec, compressed):
+            end = offset + len(data)
+            if end > start:
+                yield data[max(start - offset, 0):stop - offset]
+            offset = end
+            if offset >= stop:
+                return
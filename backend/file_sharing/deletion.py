@@ -0,0 +1,101 @@
+"""
+Удаление файлов в два этапа.
+
+Запрос на удаление только ставит File.deleted_at одним UPDATE: файлы
+сразу пропадают из списков (File.objects их не видит), а счётчики
+дашборда, квота и кэш ответов обновляются здесь же. Строки, ссылки на Blob и
+содержимое в хранилище убирает задача purge_deleted_files — пачками,
+с удалением файлов из хранилища после коммита каждой пачки.
+"""
+import logging
+from collections import Counter
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from . import quota, response_cache
+from .models import File, FileShare, UserStats
+from .storage import release_blobs
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+
+def soft_delete_files(file_ids):
+    """
+    Помечает файлы удалёнными и ставит в очередь их очистку.
+    Возвращает id файлов, которые были помечены этим вызовом.
+    """
+    from .tasks import purge_deleted_files
+
+    with transaction.atomic():
+        files = list(File.objects.select_for_update()
+                     .filter(pk__in=file_ids).values('pk', 'owner_id', 'size'))
+        deleted = [row['pk'] for row in files]
+        if not deleted:
+            return []
+        File.objects.filter(pk__in=deleted).update(deleted_at=timezone.now())
+
+        # Шары удалённых файлов остаются до очистки, но в счётчиках их уже нет
+        deltas = {}
+        for row in files:
+            delta = deltas.setdefault(row['owner_id'], Counter())
+            delta['file_count'] -= 1
+            delta['total_bytes'] -= row['size'] or 0
+        shares = (FileShare.objects.filter(file_id__in=deleted)
+                  .values('file__owner_id')
+                  .annotate(count=Count('id'),
+                            downloads=Count('id', filter=Q(downloaded=True))))
+        for row in shares:
+            delta = deltas[row['file__owner_id']]
+            delta['share_count'] -= row['count']
+            delta['download_count'] -= row['downloads']
+        for owner_id, delta in deltas.items():
+            UserStats.objects.add(owner_id, **delta)
+            quota.release(owner_id, -delta['total_bytes'])
+
+        recipients = (FileShare.objects.filter(file_id__in=deleted)
+                      .values_list('shared_with_id', flat=True).distinct())
+        response_cache.bump(*deltas, *recipients, all_files=True)
+        transaction.on_commit(purge_deleted_files.delay)
+    return deleted
+
+
+def _purge_batch(batch_size):
+    """Одна пачка очистки: (сколько файлов удалено, что удалить из хранилища)."""
+    with transaction.atomic():
+        # skip_locked: параллельные задачи очистки берут разные пачки
+        rows = list(File.all_objects.select_for_update(skip_locked=True)
+                    .filter(deleted_at__isnull=False).order_by('deleted_at')
+                    .values_list('pk', 'blob_id', 'file')[:batch_size])
+        if not rows:
+            return 0, []
+        ids = [pk for pk, _, _ in rows]
+        # Ссылки на Blob снимаются здесь одним запросом, а не сигналом
+        # release_file_blob на каждую строку
+        File.all_objects.filter(pk__in=ids).update(blob=None)
+        names = release_blobs(Counter(
+            blob_id for _, blob_id, _ in rows if blob_id))
+        # У старых файлов без Blob содержимое своё
+        names += [name for _, blob_id, name in rows if not blob_id and name]
+        File.all_objects.filter(pk__in=ids).delete()
+    return len(ids), names
+
+
+def purge_deleted_files(batch_size=BATCH_SIZE):
+    """Окончательно удаляет помеченные файлы; возвращает их число."""
+    purged = 0
+    while True:
+        count, names = _purge_batch(batch_size)
+        if not count:
+            return purged
+        for name in names:
+            try:
+                default_storage.delete(name)
+            except OSError:
+                # Файл найдёт и удалит команда find_orphan_blobs
+                logger.error(f"Could not delete {name} from storage", exc_info=True)
+        purged += count
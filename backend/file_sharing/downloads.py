@@ -0,0 +1,173 @@
+import re
+import uuid
+
+from django.core.files.storage import default_storage
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date, parse_http_date_safe
+
+from . import encryption
+from .compression import DecompressingReader
+
+
+# Больше диапазонов в одном запросе не обслуживаем, отдаём файл целиком
+MAX_RANGES = 16
+# str.isdigit() пропускает и не-ASCII цифры вроде «²», которые int() не читает
+_DIGITS = re.compile(r'[0-9]+')
+
+
+class _BytesReader:
+    """Тот же интерфейс, что у ContainerReader, для расшифрованных Fernet-файлов."""
+
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data)
+
+    def iter_range(self, start, stop):
+        if stop > start:
+            yield self.data[start:stop]
+
+
+def parse_range_header(header, size):
+    """
+    Разбирает заголовок Range в список полуинтервалов (start, stop).
+
+    None — заголовок не поддерживается или записан с ошибкой, и его нужно
+    игнорировать; пустой список — ни один диапазон не попадает в файл.
+    """
+    units, _, spec = header.partition('=')
+    if units.strip().lower() != 'bytes':
+        return None
+    ranges = []
+    for part in spec.split(','):
+        first, sep, last = part.strip().partition('-')
+        if not sep or not (first or last) \
+                or (first and not _DIGITS.fullmatch(first)) \
+                or (last and not _DIGITS.fullmatch(last)):
+            return None
+        if not first:
+            # Суффикс: последние N байт
+            if int(last) > 0 and size > 0:
+                ranges.append((max(size - int(last), 0), size))
+            continue
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start < size:
+            stop = int(last) + 1 if last else size
+            ranges.append((start, min(stop, size)))
+    if len(ranges) > MAX_RANGES:
+        return None
+    return ranges
+
+
+def _etag(file_obj):
+    return f'"{file_obj.pk}-{int(file_obj.updated_at.timestamp())}"'
+
+
+def _if_range_matches(request, file_obj):
+    value = request.headers.get('If-Range')
+    if not value:
+        return True
+    if value.startswith('"'):
+        return value == _etag(file_obj)
+    if value.startswith('W/'):
+        return False
+    date = parse_http_date_safe(value)
+    return date is not None and date == int(file_obj.updated_at.timestamp())
+
+
+def _iter_closing(stored, chunks):
+    try:
+        yield from chunks
+    finally:
+        stored.close()
+
+
+def _iter_multipart(reader, ranges, boundary, part_headers):
+    for (start, stop), headers in zip(ranges, part_headers):
+        yield headers
+        yield from reader.iter_range(start, stop)
+        yield b'\r\n'
+    yield f'--{boundary}--\r\n'.encode()
+
+
+def open_reader(file_obj, stored):
+    header = stored.read(encryption.HEADER_SIZE)
+    if not encryption.is_container(header):
+        # Fernet-токен расшифровывается только целиком
+        return _BytesReader(encryption.decrypt(
+            header + stored.read(), file_obj.encryption_key))
+    reader = encryption.ContainerReader(
+        stored, file_obj.encryption_key, stored.size)
+    if file_obj.compression:
+        # Размер распакованного содержимого известен только из Blob
+        reader = DecompressingReader(
+            reader, file_obj.compression, file_obj.blob.size,
+            file_obj.blob.compression_index)
+    return reader
+
+
+def file_response(request, file_obj):
+    """
+    Ответ с расшифрованным содержимым файла с поддержкой Range/If-Range.
+
+    Контейнер читается и расшифровывается по одному сегменту, и только те
+    сегменты, которые покрывают запрошенные диапазоны, поэтому память на
+    скачивание не зависит от размера файла. Итератор синхронный: под WSGI
+    сервер забирает очередной сегмент, когда отправил предыдущий.
+    """
+    stored = default_storage.open(file_obj.file.name, 'rb')
+
+    try:
+        reader = open_reader(file_obj, stored)
+        size = reader.size
+
+        ranges = None
+        if 'Range' in request.headers and _if_range_matches(request, file_obj):
+            ranges = parse_range_header(request.headers['Range'], size)
+
+        if ranges == []:
+            stored.close()
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+        if not ranges:
+            response = StreamingHttpResponse(
+                _iter_closing(stored, reader.iter_range(0, size)),
+                content_type='application/octet-stream')
+            response['Content-Length'] = size
+        elif len(ranges) == 1:
+            start, stop = ranges[0]
+            response = StreamingHttpResponse(
+                _iter_closing(stored, reader.iter_range(start, stop)),
+                status=206, content_type='application/octet-stream')
+            response['Content-Length'] = stop - start
+            response['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+        else:
+            boundary = uuid.uuid4().hex
+            part_headers = [
+                (f'--{boundary}\r\n'
+                 f'Content-Type: application/octet-stream\r\n'
+                 f'Content-Range: bytes {start}-{stop - 1}/{size}\r\n'
+                 f'\r\n').encode()
+                for start, stop in ranges
+            ]
+            length = sum(len(h) + stop - start + 2
+                         for h, (start, stop) in zip(part_headers, ranges))
+            length += len(f'--{boundary}--\r\n')
+            response = StreamingHttpResponse(
+                _iter_closing(stored, _iter_multipart(
+                    reader, ranges, boundary, part_headers)),
+                status=206,
+                content_type=f'multipart/byteranges; boundary={boundary}')
+            response['Content-Length'] = length
+    except Exception:
+        stored.close()
+        raise
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = _etag(file_obj)
+    response['Last-Modified'] = http_date(file_obj.updated_at.timestamp())
+    response['Content-Disposition'] = f'attachment; filename="{file_obj.name}"'
+    return response
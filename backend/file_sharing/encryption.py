@@ -0,0 +1,259 @@
+"""
+Binary container for encrypted files.
+
+Layout: a 16 byte header followed by segments. Every segment is one
+chunk of plaintext encrypted with AES-256-GCM (ciphertext + 16 byte tag),
+so segment ``i`` always starts at ``HEADER_SIZE + i * (chunk_size + TAG_SIZE)``
+and can be decrypted on its own.
+
+Header: magic (4) | version (1) | chunk size (4, big endian) | nonce prefix (7).
+Segment nonce: nonce prefix (7) | segment index (4) | last segment flag (1).
+The header is passed as associated data to every segment, and the last
+segment flag protects against truncation.
+
+Files written before the container existed are whole-file Fernet tokens;
+they are recognised by the missing magic and still decrypt.
+"""
+import base64
+import hashlib
+import os
+import struct
+
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.conf import settings
+from django.core.files.base import File as DjangoFile
+
+from .compression import AdaptiveCompressor, compress_stream
+
+
+MAGIC = b'\x89FSC'
+VERSION = 1
+HEADER = struct.Struct('>4sBI7s')
+HEADER_SIZE = HEADER.size
+NONCE_PREFIX_SIZE = 7
+TAG_SIZE = 16
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+def get_chunk_size():
+    return getattr(settings, 'FILE_ENCRYPTION_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+
+
+def generate_key():
+    """Ключ AES-256 в том же виде, что и ключ Fernet (urlsafe base64)."""
+    return base64.urlsafe_b64encode(os.urandom(32)).decode()
+
+
+def _decode_key(key):
+    if isinstance(key, str):
+        key = key.encode()
+    return base64.urlsafe_b64decode(key)
+
+
+def is_container(data):
+    return data[:len(MAGIC)] == MAGIC
+
+
+def parse_header(header):
+    if len(header) < HEADER_SIZE or not is_container(header):
+        raise InvalidToken
+    magic, version, chunk_size, nonce_prefix = HEADER.unpack(
+        header[:HEADER_SIZE])
+    if version != VERSION or chunk_size <= 0:
+        raise InvalidToken
+    return chunk_size, nonce_prefix
+
+
+def segment_count(plaintext_size, chunk_size):
+    # Пустой файл всё равно состоит из одного (пустого) сегмента
+    return max(1, -(-plaintext_size // chunk_size))
+
+
+def encrypted_size(plaintext_size, chunk_size):
+    return (HEADER_SIZE + plaintext_size
+            + segment_count(plaintext_size, chunk_size) * TAG_SIZE)
+
+
+def plaintext_size(stored_size, chunk_size):
+    """Размер открытого текста по размеру контейнера на диске."""
+    body = stored_size - HEADER_SIZE
+    segments = max(1, -(-body // (chunk_size + TAG_SIZE)))
+    return body - segments * TAG_SIZE
+
+
+class _SegmentCipher:
+    def __init__(self, key, header):
+        self.header = bytes(header[:HEADER_SIZE])
+        self.chunk_size, self._nonce_prefix = parse_header(self.header)
+        self.segment_size = self.chunk_size + TAG_SIZE
+        self._aead = AESGCM(_decode_key(key))
+
+    def _nonce(self, index, final):
+        return self._nonce_prefix + struct.pack('>IB', index, int(final))
+
+
+class StreamEncryptor(_SegmentCipher):
+    """
+    Incremental encryptor: feed plaintext with ``update`` and collect the
+    returned bytes, then append ``finalize()``. The header is the first
+    thing returned.
+    """
+
+    def __init__(self, key, chunk_size=None, header=None):
+        if header is None:
+            header = HEADER.pack(
+                MAGIC, VERSION, chunk_size or get_chunk_size(),
+                os.urandom(NONCE_PREFIX_SIZE))
+        super().__init__(key, header)
+        self._buffer = bytearray()
+        self._index = 0
+        self._header_sent = False
+
+    def encrypt_segment(self, index, data, final):
+        return self._aead.encrypt(
+            self._nonce(index, final), bytes(data), self.header)
+
+    def _take_header(self):
+        if self._header_sent:
+            return b''
+        self._header_sent = True
+        return self.header
+
+    def update(self, data):
+        self._buffer += data
+        out = [self._take_header()]
+        # Последний полный чанк придерживаем: он может оказаться финальным
+        while len(self._buffer) > self.chunk_size:
+            out.append(self.encrypt_segment(
+                self._index, self._buffer[:self.chunk_size], final=False))
+            del self._buffer[:self.chunk_size]
+            self._index += 1
+        return b''.join(out)
+
+    def finalize(self):
+        out = self._take_header() + self.encrypt_segment(
+            self._index, self._buffer, final=True)
+        self._buffer = bytearray()
+        return out
+
+
+class StreamDecryptor(_SegmentCipher):
+
+    def decrypt_segment(self, index, data, final):
+        try:
+            return self._aead.decrypt(
+                self._nonce(index, final), bytes(data), self.header)
+        except InvalidTag:
+            raise InvalidToken
+
+
+def encrypt_stream(key, chunks, chunk_size=None):
+    """Шифрует итератор байтовых кусков, отдавая контейнер по частям."""
+    encryptor = StreamEncryptor(key, chunk_size)
+    for chunk in chunks:
+        data = encryptor.update(chunk)
+        if data:
+            yield data
+    yield encryptor.finalize()
+
+
+def iter_decrypt(fileobj, key):
+    """Читает контейнер из файлового объекта и отдаёт открытый текст по сегментам."""
+    decryptor = StreamDecryptor(key, fileobj.read(HEADER_SIZE))
+    index = 0
+    segment = fileobj.read(decryptor.segment_size)
+    while True:
+        following = fileobj.read(decryptor.segment_size)
+        yield decryptor.decrypt_segment(index, segment, final=not following)
+        if not following:
+            return
+        segment = following
+        index += 1
+
+
+class ContainerReader:
+    """
+    Произвольный доступ к открытому тексту контейнера: читаются и
+    расшифровываются только сегменты, покрывающие запрошенный диапазон.
+    """
+
+    def __init__(self, fileobj, key, stored_size):
+        fileobj.seek(0)
+        self.fileobj = fileobj
+        self.decryptor = StreamDecryptor(key, fileobj.read(HEADER_SIZE))
+        self.chunk_size = self.decryptor.chunk_size
+        self.size = plaintext_size(stored_size, self.chunk_size)
+        self._segments = segment_count(self.size, self.chunk_size)
+
+    def iter_range(self, start, stop):
+        """Отдаёт байты открытого текста [start, stop)."""
+        if stop <= start:
+            return
+        chunk_size = self.chunk_size
+        first, last = start // chunk_size, (stop - 1) // chunk_size
+        self.fileobj.seek(HEADER_SIZE + first * self.decryptor.segment_size)
+        for index in range(first, last + 1):
+            plain = self.decryptor.decrypt_segment(
+                index, self.fileobj.read(self.decryptor.segment_size),
+                final=index == self._segments - 1)
+            offset = index * chunk_size
+            yield plain[max(start - offset, 0):stop - offset]
+
+
+def decrypt(data, key):
+    """Расшифровывает содержимое целиком, определяя формат по заголовку."""
+    if not is_container(data):
+        return Fernet(key.encode() if isinstance(key, str) else key).decrypt(data)
+    decryptor = StreamDecryptor(key, data)
+    body = memoryview(data)[HEADER_SIZE:]
+    size = decryptor.segment_size
+    count = max(1, -(-len(body) // size))
+    return b''.join(
+        decryptor.decrypt_segment(
+            i, body[i * size:(i + 1) * size], final=i == count - 1)
+        for i in range(count))
+
+
+class EncryptedContent(DjangoFile):
+    """
+    Обёртка над загруженным файлом для ``Storage.save``: хранилище читает
+    ``chunks()`` и получает уже сжатый (если это имеет смысл) и
+    зашифрованный контейнер, поэтому открытый текст целиком в память не
+    попадает.
+    """
+
+    def __init__(self, source, key, chunk_size=None):
+        super().__init__(source, getattr(source, 'name', None))
+        self.key = key
+        self.encryption_chunk_size = chunk_size
+        self.sha256 = hashlib.sha256()
+        self.compressor = AdaptiveCompressor()
+        self.stored_size = 0
+
+    @property
+    def compression(self):
+        return self.compressor.codec
+
+    @property
+    def compression_index(self):
+        return self.compressor.index
+
+    @property
+    def checksum(self):
+        """SHA-256 открытого текста; готов после того, как прочитан ``chunks()``."""
+        return self.sha256.hexdigest()
+
+    def _hashed(self, chunks):
+        for chunk in chunks:
+            self.sha256.update(chunk)
+            yield chunk
+
+    def chunks(self, chunk_size=None):
+        for data in encrypt_stream(
+                self.key,
+                compress_stream(self._hashed(self.file.chunks()), self.compressor),
+                self.encryption_chunk_size):
+            self.stored_size += len(data)
+            yield data
@@ -0,0 +1,28 @@
+"""
+Последствия создания файлов: счётчики дашборда (UserStats), событие
+загрузки в ленте активности и поколения кэша ответов.
+
+Один файл их получает через сигнал post_save (signals), пачка из
+storage.save_uploads — напрямую: bulk_create сигналов не шлёт. Обе
+дороги вызывают ``files_created``, поэтому не расходятся.
+"""
+from . import response_cache
+from .models import ActivityEvent, UserStats
+
+
+def files_created(owner_id, files):
+    """
+    Учитывает новые файлы ``owner_id`` в той же транзакции, что и их
+    создание. Запросов — по одному на пачку, сколько бы файлов в ней ни было.
+    """
+    if not files:
+        return
+    UserStats.objects.add(
+        owner_id, file_count=len(files),
+        total_bytes=sum(file_obj.size or 0 for file_obj in files))
+    ActivityEvent.objects.bulk_create([
+        ActivityEvent(user_id=owner_id, event_type='upload',
+                      file_name=file_obj.name, timestamp=file_obj.created_at)
+        for file_obj in files
+    ])
+    response_cache.bump(owner_id, all_files=True)
@@ -0,0 +1,125 @@
+"""
+Фильтры списков по параметрам запроса.
+
+Все фильтры ложатся на индексированные колонки (владелец, дата создания)
+или сужают выборку, которую уже ограничил индекс, поэтому сочетаются с
+постраничным выводом по курсору. Параметры: ``owner`` (id владельца),
+``name`` (начало имени), ``created_after`` (включительно),
+``created_before`` (не включительно), ``is_encrypted``.
+"""
+import datetime
+import re
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+
+_BOOLEANS = {'true': True, '1': True, 'false': False, '0': False}
+# Только ASCII: isdigit() верно и для «²», на котором int() падает
+_DIGITS = re.compile(r'[0-9]+')
+# Больше не помещается в bigint: база на таком сравнении падает
+BIGINT_MAX = 2 ** 63 - 1
+
+
+def parse_uint(value):
+    """Целое из ASCII-цифр от 0 до BIGINT_MAX или None."""
+    if not _DIGITS.fullmatch(value) or len(value.lstrip('0')) > 19:
+        return None
+    number = int(value)
+    return number if number <= BIGINT_MAX else None
+
+
+def _parse_bool(name, value):
+    try:
+        return _BOOLEANS[value.lower()]
+    except KeyError:
+        raise ValidationError({name: 'Expected true or false'})
+
+
+def _parse_int(name, value):
+    number = parse_uint(value)
+    if number is None:
+        raise ValidationError({name: 'Expected an integer id'})
+    return number
+
+
+def _parse_moment(name, value, next_day=False):
+    """
+    Дата или дата со временем. Дата без времени — это полночь того же
+    дня, а для верхней границы (``next_day``) — полночь следующего,
+    чтобы день попадал в выборку целиком. Сравнение идёт с самой колонкой,
+    без приведения к дате, иначе индекс не используется.
+    """
+    try:
+        day = parse_date(value)
+        if day is not None:
+            if next_day:
+                day += datetime.timedelta(days=1)
+            moment = datetime.datetime.combine(day, datetime.time.min)
+        else:
+            moment = parse_datetime(value)
+            if moment is None:
+                raise ValueError
+    except ValueError:
+        raise ValidationError({name: 'Expected an ISO 8601 date or datetime'})
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def _parse_start(name, value):
+    return _parse_moment(name, value)
+
+
+def _parse_end(name, value):
+    return _parse_moment(name, value, next_day=True)
+
+
+def _parse_str(name, value):
+    return value
+
+
+class QueryParamFilter(BaseFilterBackend):
+    """
+    Фильтр по словарю ``{параметр: (lookup, парсер)}``. Неверное значение
+    параметра — ошибка 400, а не пустой или нефильтрованный список.
+    """
+    params = {}
+
+    def filter_queryset(self, request, queryset, view):
+        filters = {}
+        for param, (lookup, parse) in self.params.items():
+            value = request.query_params.get(param)
+            if value not in (None, ''):
+                filters[lookup] = parse(param, value)
+        return queryset.filter(**filters)
+
+
+class FileFilter(QueryParamFilter):
+    params = {
+        'owner': ('owner_id', _parse_int),
+        'name': ('name__startswith', _parse_str),
+        'created_after': ('created_at__gte', _parse_start),
+        'created_before': ('created_at__lt', _parse_end),
+        'is_encrypted': ('is_encrypted', _parse_bool),
+    }
+
+
+class FileShareFilter(QueryParamFilter):
+    params = {
+        'owner': ('file__owner_id', _parse_int),
+        'name': ('file__name__startswith', _parse_str),
+        'created_after': ('created_at__gte', _parse_start),
+        'created_before': ('created_at__lt', _parse_end),
+        'is_encrypted': ('file__is_encrypted', _parse_bool),
+    }
+
+
+class UserFilter(QueryParamFilter):
+    params = {
+        'name': ('username__startswith', _parse_str),
+        'created_after': ('date_joined__gte', _parse_start),
+        'created_before': ('date_joined__lt', _parse_end),
+    }
@@ -0,0 +1,128 @@
+"""
+Пул для хеширования паролей.
+
+PBKDF2 занимает сотни миллисекунд процессора на каждый вход и
+регистрацию. В асинхронных представлениях хеширование уходит в
+отдельный ограниченный пул потоков (hashlib отпускает GIL на время
+PBKDF2), а цикл событий продолжает обслуживать остальные запросы.
+Очередь к пулу ограничена: если она заполнена, запрос сразу получает
+503 вместо того, чтобы ждать за сотнями других входов.
+
+В пул передаются только вычисления над строками, без обращений к базе:
+у потоков пула своё соединение, и держать его открытым незачем.
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+
+class HashingOverloaded(Exception):
+    pass
+
+
+def get_workers():
+    return getattr(settings, 'PASSWORD_HASHING_WORKERS', None) or os.cpu_count() or 1
+
+
+def get_max_pending():
+    return getattr(settings, 'PASSWORD_HASHING_MAX_PENDING', None) or get_workers() * 8
+
+
+class _Timing:
+    """Число, сумма и максимум — достаточно для среднего и выбросов."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total / self.count * 1000, 2) if self.count else 0,
+            'max_ms': round(self.max * 1000, 2),
+        }
+
+
+class HashingPool:
+
+    def __init__(self, workers, max_pending):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='password-hashing')
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait = _Timing()
+        self.run_time = _Timing()
+
+    def _call(self, submitted, func, args, kwargs):
+        started = time.monotonic()
+        with self._lock:
+            self.running += 1
+            self.wait.add(started - submitted)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+                self.run_time.add(time.monotonic() - started)
+
+    async def run(self, func, *args, **kwargs):
+        """Выполняет ``func`` в пуле; HashingOverloaded, если очередь полна."""
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HashingOverloaded
+            self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, self._call, time.monotonic(), func, args, kwargs)
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'pending': self.pending,
+                'queued': self.pending - self.running,
+                'running': self.running,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'queue_wait': self.wait.as_dict(),
+                'hash_time': self.run_time.as_dict(),
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = HashingPool(get_workers(), get_max_pending())
+    return _pool
+
+
+async def run_hashing(func, *args, **kwargs):
+    return await get_pool().run(func, *args, **kwargs)
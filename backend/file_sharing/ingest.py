@@ -0,0 +1,99 @@
+"""
+Временное хранилище асинхронных загрузок и восстановление зависших задач.
+
+Файл ждёт шифрования открытым текстом, поэтому лежит не в MEDIA_ROOT
+(его раздаёт static() при DEBUG), а в FILE_STAGING_ROOT под случайным
+именем, не связанным с id задачи. Файл удаляется, когда задача
+закончилась успехом или ошибкой.
+
+Задача, которую не взял ни один воркер (сообщение потерялось) или
+воркер которой упал, ставится в очередь заново; после
+INGEST_MAX_ATTEMPTS попыток или INGEST_MAX_AGE_HOURS она помечается
+ошибкой, и файл удаляется.
+"""
+import logging
+import os
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils import timezone
+
+from .models import IngestJob
+
+logger = logging.getLogger(__name__)
+
+ACTIVE = ('pending', 'processing')
+
+
+def staging_storage():
+    return FileSystemStorage(
+        location=settings.FILE_STAGING_ROOT,
+        file_permissions_mode=0o600,
+        directory_permissions_mode=0o700)
+
+
+def stage(uploaded):
+    """Сохраняет загруженный файл до шифрования; возвращает путь."""
+    return staging_storage().save(uuid.uuid4().hex, uploaded)
+
+
+def discard(path):
+    if path:
+        staging_storage().delete(path)
+
+
+def recover_jobs():
+    """
+    Перезапускает задачи без движения дольше INGEST_STALE_MINUTES (прогресс
+    обновляет updated_at) и удаляет файлы без активной задачи.
+    Возвращает (перезапущено, помечено ошибкой).
+    """
+    from .tasks import ingest_file
+
+    now = timezone.now()
+    stale_before = now - timedelta(minutes=settings.INGEST_STALE_MINUTES)
+    expired_before = now - timedelta(hours=settings.INGEST_MAX_AGE_HOURS)
+    retried, failed = [], []
+    with transaction.atomic():
+        # Воркер, который ещё работает, держит строку при завершении:
+        # skip_locked не даёт сбросить задачу у него из-под рук
+        jobs = list(IngestJob.objects.select_for_update(skip_locked=True)
+                    .filter(status__in=ACTIVE, updated_at__lt=stale_before)
+                    .only('pk', 'attempts', 'created_at', 'staging_path'))
+        for job in jobs:
+            if job.attempts >= settings.INGEST_MAX_ATTEMPTS \
+                    or job.created_at < expired_before:
+                failed.append(job)
+            else:
+                retried.append(job)
+        IngestJob.objects.filter(pk__in=[job.pk for job in failed]).update(
+            status='failed', error='Upload was not processed in time',
+            updated_at=now)
+        IngestJob.objects.filter(pk__in=[job.pk for job in retried]).update(
+            status='pending', updated_at=now)
+
+        def requeue():
+            for job in retried:
+                ingest_file.delay(str(job.pk))
+            for job in failed:
+                discard(job.staging_path)
+        transaction.on_commit(requeue)
+
+    _remove_orphans(stale_before)
+    return len(retried), len(failed)
+
+
+def _remove_orphans(older_than):
+    """Файлы, на которые не ссылается ни одна активная задача."""
+    storage = staging_storage()
+    if not os.path.isdir(storage.location):
+        return
+    active = set(IngestJob.objects.filter(
+        status__in=ACTIVE).values_list('staging_path', flat=True))
+    for name in storage.listdir('')[1]:
+        if name not in active and storage.get_modified_time(name) < older_than:
+            logger.warning(f"Removing orphaned staged upload {name}")
+            storage.delete(name)
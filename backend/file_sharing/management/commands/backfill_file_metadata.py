@@ -0,0 +1,71 @@
+import hashlib
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from file_sharing import response_cache
+from file_sharing.downloads import open_reader
+from file_sharing.models import Blob, File
+
+
+class Command(BaseCommand):
+    help = ("Заполняет размер открытого текста, размер в хранилище и SHA-256 "
+            "для файлов, загруженных до появления этих колонок")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Сколько файлов обновлять за один проход')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        updated = failed = 0
+        last_pk = 0
+
+        # Идём по первичному ключу, чтобы не держать весь набор в памяти
+        # и не зацикливаться на файлах, которые не удалось прочитать
+        while True:
+            batch = list(
+                File.objects.filter(stored_size__isnull=True, pk__gt=last_pk)
+                .select_related('blob').order_by('pk')[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            done = []
+            for file_obj in batch:
+                try:
+                    self._fill(file_obj)
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(self.style.ERROR(
+                        f"Не удалось обработать {file_obj.file.name}: {e}"))
+                    continue
+                done.append(file_obj)
+
+            File.objects.bulk_update(done, ['size', 'stored_size', 'checksum'])
+            blobs = [f.blob for f in done
+                     if f.blob is not None and f.blob.stored_size is None]
+            for blob in blobs:
+                blob.stored_size = default_storage.size(blob.file.name)
+            Blob.objects.bulk_update(blobs, ['stored_size'])
+
+            updated += len(done)
+            self.stdout.write(f"Обновлено файлов: {updated}")
+
+        if updated:
+            # bulk_update идёт мимо сигналов, сбрасываем кэш ответов целиком
+            response_cache.bump_all()
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово: обновлено {updated}, ошибок {failed}."))
+
+    def _fill(self, file_obj):
+        sha256 = hashlib.sha256()
+        size = 0
+        with default_storage.open(file_obj.file.name, 'rb') as stored:
+            file_obj.stored_size = stored.size
+            reader = open_reader(file_obj, stored)
+            for data in reader.iter_range(0, reader.size):
+                sha256.update(data)
+                size += len(data)
+        file_obj.size = size
+        file_obj.checksum = sha256.hexdigest()
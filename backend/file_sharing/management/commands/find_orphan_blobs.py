@@ -0,0 +1,112 @@
+import heapq
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models.functions import Collate
+from django.utils import timezone
+
+from file_sharing.models import Blob, File
+from file_sharing.storage import BLOB_DIR
+
+
+def iter_storage(directory):
+    """
+    Имена файлов в хранилище под ``directory`` в порядке сортировки строк.
+    Папка сортируется как «имя/»: тогда обход в глубину даёт тот же
+    порядок, что сортировка полных путей. В памяти только одна папка на
+    каждый уровень вложенности.
+    """
+    dirs, files = default_storage.listdir(directory)
+    entries = [(f'{name}/', True) for name in dirs]
+    entries += [(name, False) for name in files]
+    for key, is_dir in sorted(entries):
+        if is_dir:
+            yield from iter_storage(f'{directory}/{key[:-1]}')
+        else:
+            yield f'{directory}/{key}'
+
+
+# Побайтовое сравнение строк в базе: в SQLite оно по умолчанию (BINARY)
+_BYTE_COLLATIONS = {
+    'postgresql': 'C',
+    'mysql': 'utf8mb4_bin',
+}
+
+
+def _referenced_names(manager, batch_size):
+    names = (manager.filter(file__startswith=f'{BLOB_DIR}/')
+             .values_list('file', flat=True))
+    collation = _BYTE_COLLATIONS.get(connection.vendor)
+    if collation:
+        names = names.order_by(Collate('file', collation))
+    elif connection.vendor == 'sqlite':
+        names = names.order_by('file')
+    else:
+        # Порядок базы неизвестен: сортируем здесь, ценой памяти
+        return iter(sorted(names.iterator(chunk_size=batch_size)))
+    return names.iterator(chunk_size=batch_size)
+
+
+def is_referenced(name):
+    return (Blob.objects.filter(file=name).exists()
+            or File.all_objects.filter(file=name).exists())
+
+
+def iter_referenced(batch_size):
+    """Имена, на которые ссылаются Blob и File, в том же порядке (побайтно)."""
+    streams = [
+        _referenced_names(manager, batch_size)
+        # Помеченные удалёнными File держат содержимое до очистки
+        for manager in (Blob.objects, File.all_objects)
+    ]
+    previous = None
+    for name in heapq.merge(*streams):
+        if name != previous:
+            yield name
+            previous = name
+
+
+class Command(BaseCommand):
+    help = ("Ищет в хранилище зашифрованные файлы, на которые не ссылается "
+            "ни один Blob и ни один File, и при --delete удаляет их")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete', action='store_true',
+                            help='Удалять найденные файлы (иначе только вывести)')
+        parser.add_argument('--min-age', type=float, default=24,
+                            help='Не трогать файлы моложе стольких часов: '
+                                 'загрузки пишут файл раньше записи в базе')
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help='Сколько имён читать из базы за раз')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['min_age'])
+        referenced = iter_referenced(options['batch_size'])
+        current = next(referenced, None)
+        checked = orphaned = deleted = 0
+
+        # Оба потока отсортированы одинаково: слияние за один проход
+        for name in iter_storage(BLOB_DIR):
+            checked += 1
+            while current is not None and current < name:
+                current = next(referenced, None)
+            if current == name:
+                continue
+            if default_storage.get_modified_time(name) > cutoff:
+                continue
+            if options['delete'] and is_referenced(name):
+                # Ссылка появилась после того, как прочитали её поток
+                # (например, shard_blobs переложил файл под это имя)
+                continue
+            orphaned += 1
+            if options['delete']:
+                default_storage.delete(name)
+                deleted += 1
+            else:
+                self.stdout.write(name)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Проверено файлов: {checked}, без ссылок: {orphaned}, "
+            f"удалено: {deleted}."))
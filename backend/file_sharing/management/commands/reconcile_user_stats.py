@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from file_sharing.stats import reconcile_user_stats
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает счётчики дашборда по данным и исправляет расхождения"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Сколько пользователей сверять за один проход')
+
+    def handle(self, *args, **options):
+        fixed = reconcile_user_stats(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово: исправлено строк статистики: {fixed}."))
@@ -0,0 +1,73 @@
+import re
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from file_sharing import response_cache
+from file_sharing.models import Blob, File
+from file_sharing.storage import SHARDED_BLOB_RE, blob_name, copy_blob
+
+
+class Command(BaseCommand):
+    help = ("Переносит зашифрованные файлы в шардированную раскладку "
+            "encrypted_files/ab/cd/<uuid> без остановки сервиса")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Сколько файлов переносить за один проход')
+        parser.add_argument('--sleep', type=float, default=1.0,
+                            help='Пауза между проходами, секунд')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Остановиться после стольких файлов')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        limit = options['limit']
+        sharded = re.compile(SHARDED_BLOB_RE)
+        moved = failed = 0
+        last_pk = 0
+
+        while limit is None or moved < limit:
+            # Проход по первичному ключу: каждый запрос читает одну пачку
+            # строк, а не всю таблицу с regex и сортировкой
+            rows = list(File.all_objects.filter(pk__gt=last_pk).order_by('pk')
+                        .values_list('pk', 'file')[:batch_size])
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+            old_names = list(dict.fromkeys(
+                name for _, name in rows if not sharded.match(name)))
+            if limit is not None:
+                old_names = old_names[:limit - moved]
+            if not old_names:
+                continue
+
+            # Сначала новая копия (ссылка), потом запись в базе, и только
+            # после коммита удаление старого имени: скачивания не ломаются
+            renamed = {}
+            for old_name in old_names:
+                try:
+                    renamed[old_name] = copy_blob(old_name, blob_name())
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(self.style.ERROR(
+                        f"Не удалось перенести {old_name}: {e}"))
+
+            with transaction.atomic():
+                for old_name, new_name in renamed.items():
+                    File.all_objects.filter(file=old_name).update(file=new_name)
+                    Blob.objects.filter(file=old_name).update(file=new_name)
+                transaction.on_commit(
+                    lambda names=list(renamed): [
+                        default_storage.delete(name) for name in names])
+                # Путь файла есть в ответах API, а update() мимо сигналов
+                response_cache.bump_all()
+
+            moved += len(renamed)
+            self.stdout.write(f"Перенесено файлов: {moved}")
+            time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово: перенесено {moved}, ошибок {failed}."))
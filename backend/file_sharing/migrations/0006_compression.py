@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_sharing', '0005_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='compression',
+            field=models.CharField(blank=True, choices=[('', 'Без сжатия'), ('zlib', 'zlib'), ('lzma', 'lzma')], default='', max_length=10, verbose_name='Сжатие'),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='compression',
+            field=models.CharField(blank=True, choices=[('', 'Без сжатия'), ('zlib', 'zlib'), ('lzma', 'lzma')], default='', max_length=10, verbose_name='Сжатие'),
+        ),
+    ]
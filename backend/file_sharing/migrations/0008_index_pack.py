@@ -0,0 +1,55 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY не блокирует запись в большие таблицы,
+    # но не работает внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ('file_sharing', '0007_ingest_job'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='file',
+            index=models.Index(fields=['owner', '-created_at'], name='file_owner_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='fileshare',
+            index=models.Index(fields=['file', '-created_at'], name='share_file_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='fileshare',
+            index=models.Index(condition=models.Q(('downloaded', True)), fields=['file', '-downloaded_at'], name='share_file_downloaded_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='fileshare',
+            index=models.Index(fields=['shared_with', '-created_at'], name='share_recipient_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='fileshare',
+            index=models.Index(fields=['access_token'], name='share_access_token_idx'),
+        ),
+        # Одиночные индексы по FK стали префиксами составных
+        migrations.AlterField(
+            model_name='file',
+            name='owner',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Владелец'),
+        ),
+        migrations.AlterField(
+            model_name='fileshare',
+            name='file',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='file_sharing.file', verbose_name='Файл'),
+        ),
+        migrations.AlterField(
+            model_name='fileshare',
+            name='shared_with',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Кому предоставлен'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_sharing', '0008_index_pack'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='stored_size',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='Размер в хранилище (байт)'),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='checksum',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='SHA-256'),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='stored_size',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='Размер в хранилище (байт)'),
+        ),
+    ]
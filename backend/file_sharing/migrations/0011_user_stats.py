@@ -0,0 +1,31 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:46
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_sharing', '0010_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+                ('file_count', models.PositiveIntegerField(default=0, verbose_name='Файлов')),
+                ('total_bytes', models.BigIntegerField(default=0, verbose_name='Объём файлов (байт)')),
+                ('share_count', models.PositiveIntegerField(default=0, verbose_name='Предоставлено доступов')),
+                ('download_count', models.PositiveIntegerField(default=0, verbose_name='Скачиваний')),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата обновления')),
+            ],
+            options={
+                'verbose_name': 'Статистика пользователя',
+                'verbose_name_plural': 'Статистика пользователей',
+            },
+        ),
+    ]
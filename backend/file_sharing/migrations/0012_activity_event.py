@@ -0,0 +1,76 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:48
+
+import datetime
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Лента заполняется событиями за последние дни, чтобы дашборд не
+# опустел сразу после обновления
+BACKFILL_DAYS = 7
+BATCH_SIZE = 1000
+
+
+def backfill_events(apps, schema_editor):
+    ActivityEvent = apps.get_model('file_sharing', 'ActivityEvent')
+    File = apps.get_model('file_sharing', 'File')
+    FileShare = apps.get_model('file_sharing', 'FileShare')
+    since = django.utils.timezone.now() - datetime.timedelta(days=BACKFILL_DAYS)
+
+    def events():
+        for file in File.objects.filter(created_at__gte=since).iterator():
+            yield ActivityEvent(
+                user_id=file.owner_id, event_type='upload',
+                file_name=file.name, timestamp=file.created_at)
+        shares = FileShare.objects.select_related('file', 'shared_with')
+        for share in shares.filter(created_at__gte=since).iterator():
+            yield ActivityEvent(
+                user_id=share.file.owner_id, event_type='share',
+                file_name=share.file.name,
+                other_username=share.shared_with.username,
+                timestamp=share.created_at)
+        for share in shares.filter(
+                downloaded=True, downloaded_at__gte=since).iterator():
+            yield ActivityEvent(
+                user_id=share.file.owner_id, event_type='download',
+                file_name=share.file.name,
+                other_username=share.shared_with.username,
+                timestamp=share.downloaded_at)
+
+    batch = []
+    for event in events():
+        batch.append(event)
+        if len(batch) >= BATCH_SIZE:
+            ActivityEvent.objects.bulk_create(batch)
+            batch = []
+    ActivityEvent.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_sharing', '0011_user_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_type', models.CharField(choices=[('upload', 'Загрузка'), ('share', 'Предоставление доступа'), ('download', 'Скачивание')], max_length=10, verbose_name='Тип')),
+                ('file_name', models.CharField(max_length=255, verbose_name='Название файла')),
+                ('other_username', models.CharField(blank=True, default='', max_length=150, verbose_name='Второй пользователь')),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Время')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='activity_events', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Событие',
+                'verbose_name_plural': 'События',
+                'indexes': [models.Index(fields=['user', '-timestamp', '-id'], name='activity_user_time_idx'), models.Index(fields=['timestamp'], name='activity_time_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_events, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.1 on 2026-10-18 00:03
+
+import file_sharing.models
+from django.db import migrations, models
+from django.db.models import Count, Q
+from django.utils.crypto import get_random_string
+
+
+BATCH_SIZE = 1000
+
+
+def fill_access_tokens(apps, schema_editor):
+    """Пустые и повторяющиеся токены заменяются новыми до уникального индекса."""
+    FileShare = apps.get_model('file_sharing', 'FileShare')
+    duplicates = (FileShare.objects.values('access_token')
+                  .annotate(shares=Count('id')).filter(shares__gt=1)
+                  .values('access_token'))
+    pks = list(FileShare.objects.filter(
+        Q(access_token='') | Q(access_token__in=duplicates),
+    ).values_list('pk', flat=True))
+    for start in range(0, len(pks), BATCH_SIZE):
+        shares = [FileShare(pk=pk, access_token=get_random_string(32))
+                  for pk in pks[start:start + BATCH_SIZE]]
+        FileShare.objects.bulk_update(shares, ['access_token'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_sharing', '0013_user_token_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_access_tokens, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='fileshare',
+            name='share_access_token_idx',
+        ),
+        migrations.AlterField(
+            model_name='fileshare',
+            name='access_token',
+            field=models.CharField(default=file_sharing.models.generate_access_token, max_length=255, verbose_name='Токен доступа'),
+        ),
+        migrations.AddConstraint(
+            model_name='fileshare',
+            constraint=models.UniqueConstraint(fields=('access_token',), name='share_access_token_uniq'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.1 on 2026-10-18 00:06
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min
+
+
+def merge_duplicate_shares(apps, schema_editor):
+    """
+    Из повторных шар (file, shared_with) остаётся самая ранняя; если файл
+    скачивали по любой из них, она получает последнюю дату скачивания.
+    Счётчики UserStats после этого поправит reconcile_user_stats.
+    """
+    FileShare = apps.get_model('file_sharing', 'FileShare')
+    duplicates = (FileShare.objects.values('file_id', 'shared_with_id')
+                  .annotate(shares=Count('id'), keep=Min('id'),
+                            downloaded_at=Max('downloaded_at'))
+                  .filter(shares__gt=1))
+    for row in duplicates.iterator():
+        pair = FileShare.objects.filter(
+            file_id=row['file_id'], shared_with_id=row['shared_with_id'])
+        downloaded = pair.filter(downloaded=True).exists()
+        pair.exclude(pk=row['keep']).delete()
+        if downloaded:
+            pair.update(downloaded=True, downloaded_at=row['downloaded_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_sharing', '0014_share_access_token_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_shares, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='fileshare',
+            constraint=models.UniqueConstraint(fields=('file', 'shared_with'), name='share_file_recipient_uniq'),
+        ),
+    ]
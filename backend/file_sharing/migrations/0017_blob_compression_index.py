@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 00:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_sharing', '0016_file_soft_delete'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='compression_index',
+            field=models.BinaryField(blank=True, null=True, verbose_name='Индекс сжатых окон'),
+        ),
+    ]
@@ -1,10 +1,15 @@
 import uuid
+from datetime import timedelta
 
 from django.db import models
+from django.db.models.functions import Greatest
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
+from django.utils.crypto import get_random_string
 from django.utils.translation import gettext_lazy as _
 
+from . import response_cache
+
 
 class User(AbstractUser):
     email = models.EmailField(unique=True, verbose_name='Электронная почта')
@@ -14,20 +19,78 @@ class User(AbstractUser):
         max_length=30, default='', blank=True, verbose_name='Имя')
     last_name = models.CharField(
         max_length=30, default='', blank=True, verbose_name='Фамилия')
+    # JWT с меньшей версией недействительны (см. authentication)
+    token_version = models.PositiveIntegerField(
+        default=0, verbose_name='Версия токенов')
 
     class Meta:
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
+        indexes = [
+            # Постраничный список пользователей для администратора
+            models.Index(fields=['-date_joined', '-id'],
+                         name='user_joined_idx'),
+        ]
 
     def __str__(self):
         return self.email
 
 
+COMPRESSION_CHOICES = (
+    ('', 'Без сжатия'),
+    ('zlib', 'zlib'),
+    ('lzma', 'lzma'),
+)
+
+
+class Blob(models.Model):
+    """
+    Зашифрованное содержимое в хранилище. Одинаковые файлы (по хешу
+    открытого текста) хранятся один раз, File ссылаются на Blob, а
+    ref_count считает эти ссылки.
+    """
+    digest = models.CharField(
+        max_length=64, unique=True, verbose_name='Хеш содержимого')
+    file = models.FileField(upload_to='encrypted_files/', verbose_name='Файл')
+    encryption_key = models.CharField(
+        max_length=255, verbose_name='Ключ шифрования')
+    size = models.BigIntegerField(verbose_name='Размер (байт)')
+    stored_size = models.BigIntegerField(
+        null=True, blank=True, verbose_name='Размер в хранилище (байт)')
+    compression = models.CharField(
+        max_length=10, choices=COMPRESSION_CHOICES, default='', blank=True,
+        verbose_name='Сжатие')
+    # Длины сжатых окон (compression.pack_index); у файлов, сжатых до
+    # появления окон, пусто
+    compression_index = models.BinaryField(
+        null=True, blank=True, verbose_name='Индекс сжатых окон')
+    ref_count = models.PositiveIntegerField(
+        default=0, verbose_name='Число ссылок')
+    created_at = models.DateTimeField(
+        auto_now_add=True, verbose_name='Дата создания')
+
+    class Meta:
+        verbose_name = 'Содержимое файла'
+        verbose_name_plural = 'Содержимое файлов'
+
+    def __str__(self):
+        return self.digest
+
+
+class LiveFileManager(models.Manager):
+    """Файлы без отметки об удалении; все строки — в File.all_objects."""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 class File(models.Model):
     name = models.CharField(max_length=255, verbose_name='Название файла')
     file = models.FileField(upload_to='encrypted_files/', verbose_name='Файл')
+    # Индекс по owner покрывает составной file_owner_created_idx
     owner = models.ForeignKey(
-        User, on_delete=models.CASCADE, verbose_name='Владелец')
+        User, on_delete=models.CASCADE, db_index=False,
+        verbose_name='Владелец')
     is_encrypted = models.BooleanField(default=True, verbose_name='Зашифрован')
     encryption_key = models.CharField(
         max_length=255, verbose_name='Ключ шифрования')
@@ -35,29 +98,67 @@ class File(models.Model):
         auto_now_add=True, verbose_name='Дата создания')
     updated_at = models.DateTimeField(
         auto_now=True, verbose_name='Дата обновления')
+    # Метаданные заполняются при загрузке, чтобы списки не обращались
+    # к хранилищу: size — размер открытого текста, stored_size — размер
+    # зашифрованного файла, checksum — SHA-256 открытого текста
     size = models.BigIntegerField(
         null=True, blank=True, verbose_name='Размер файла (байт)')
+    stored_size = models.BigIntegerField(
+        null=True, blank=True, verbose_name='Размер в хранилище (байт)')
+    checksum = models.CharField(
+        max_length=64, blank=True, default='', verbose_name='SHA-256')
+    blob = models.ForeignKey(
+        Blob, null=True, blank=True, on_delete=models.PROTECT,
+        related_name='files', verbose_name='Содержимое')
+    compression = models.CharField(
+        max_length=10, choices=COMPRESSION_CHOICES, default='', blank=True,
+        verbose_name='Сжатие')
+    # Удалённый файл пропадает из списков сразу, а строку и содержимое в
+    # хранилище убирает фоновая очистка (см. deletion)
+    deleted_at = models.DateTimeField(
+        null=True, blank=True, verbose_name='Дата удаления')
+
+    objects = LiveFileManager()
+    all_objects = models.Manager()
 
     class Meta:
         verbose_name = 'Файл'
         verbose_name_plural = 'Файлы'
-
-    def save(self, *args, **kwargs):
-        if self.file:
-            self.size = self.file.size
-        super().save(*args, **kwargs)
+        indexes = [
+            # Списки файлов и недавние загрузки владельца
+            models.Index(fields=['owner', '-created_at'],
+                         name='file_owner_created_idx'),
+            # Список всех файлов для персонала и менеджеров
+            models.Index(fields=['-created_at', '-id'],
+                         name='file_created_idx'),
+            # Очередь на окончательное удаление
+            models.Index(fields=['deleted_at'],
+                         condition=models.Q(deleted_at__isnull=False),
+                         name='file_deleted_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
 
+def generate_access_token():
+    return get_random_string(32)
+
+
 class FileShare(models.Model):
+    # Повторные скачивания сдвигают downloaded_at не чаще, чем раз в этот
+    # интервал: иначе популярный файл писал бы одну строку на каждый запрос
+    DOWNLOAD_TOUCH_INTERVAL = timedelta(minutes=1)
+
+    # Индексы по file и shared_with покрываются составными индексами ниже
     file = models.ForeignKey(
-        File, on_delete=models.CASCADE, verbose_name='Файл')
+        File, on_delete=models.CASCADE, db_index=False, verbose_name='Файл')
     shared_with = models.ForeignKey(
-        User, on_delete=models.CASCADE, verbose_name='Кому предоставлен')
+        User, on_delete=models.CASCADE, db_index=False,
+        verbose_name='Кому предоставлен')
     access_token = models.CharField(
-        max_length=255, default='', verbose_name='Токен доступа')
+        max_length=255, default=generate_access_token,
+        verbose_name='Токен доступа')
     created_at = models.DateTimeField(
         default=timezone.now, verbose_name='Дата создания')
     downloaded = models.BooleanField(default=False, verbose_name='Загружен')
@@ -67,14 +168,59 @@ class FileShare(models.Model):
     class Meta:
         verbose_name = 'Общий доступ к файлу'
         verbose_name_plural = 'Общие доступы к файлам'
+        indexes = [
+            # Недавние шары файлов владельца (через file__owner)
+            models.Index(fields=['file', '-created_at'],
+                         name='share_file_created_idx'),
+            # Скачивания: только скачанные строки
+            models.Index(fields=['file', '-downloaded_at'],
+                         condition=models.Q(downloaded=True),
+                         name='share_file_downloaded_idx'),
+            # Список файлов, расшаренных пользователю
+            models.Index(fields=['shared_with', '-created_at'],
+                         name='share_recipient_created_idx'),
+        ]
+        constraints = [
+            # Один файл одному пользователю расшаривается один раз
+            models.UniqueConstraint(fields=['file', 'shared_with'],
+                                    name='share_file_recipient_uniq'),
+            # По токену шара ищется при скачивании без входа
+            models.UniqueConstraint(fields=['access_token'],
+                                    name='share_access_token_uniq'),
+        ]
 
     def __str__(self):
         return f"{self.file.name} → {self.shared_with.username}"
 
     def mark_as_downloaded(self):
+        """
+        Отмечает скачивание условными UPDATE без чтения строки. Первое
+        скачивание переводит downloaded в True ровно в одном из
+        параллельных запросов, и только он считает скачивание в статистике
+        и ленте. Остальные обновляют downloaded_at, если отметка старше
+        DOWNLOAD_TOUCH_INTERVAL, а иначе не пишут (и не ждут блокировку
+        строки) вовсе.
+        """
+        now = timezone.now()
+        shares = FileShare.objects.filter(pk=self.pk)
+        first_download = shares.filter(downloaded=False).update(
+            downloaded=True, downloaded_at=now)
+        touched = first_download or shares.filter(
+            downloaded_at__lt=now - self.DOWNLOAD_TOUCH_INTERVAL,
+        ).update(downloaded_at=now)
+        if not touched:
+            return
         self.downloaded = True
-        self.downloaded_at = timezone.now()
-        self.save()
+        self.downloaded_at = now
+        # UPDATE проходит мимо сигналов: кэш ответов сбрасываем сами
+        response_cache.bump(self.file.owner_id, self.shared_with_id)
+        if first_download:
+            UserStats.objects.add(self.file.owner_id, download_count=1)
+            ActivityEvent.objects.create(
+                user_id=self.file.owner_id, event_type='download',
+                file_name=self.file.name,
+                other_username=self.shared_with.username,
+                timestamp=now)
 
 
 class UserProfile(models.Model):
@@ -123,3 +269,191 @@ class PasswordResetToken(models.Model):
 
     def is_expired(self):
         return timezone.now() > self.created_at + timezone.timedelta(hours=1)
+
+
+class UploadSession(models.Model):
+    id = models.UUIDField(
+        primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(
+        User, on_delete=models.CASCADE, verbose_name='Владелец')
+    name = models.CharField(max_length=255, verbose_name='Название файла')
+    size = models.BigIntegerField(verbose_name='Размер файла (байт)')
+    chunk_size = models.PositiveIntegerField(verbose_name='Размер части (байт)')
+    # Заголовок контейнера (с префиксом nonce): части шифруются сразу при
+    # получении и при завершении только склеиваются
+    header = models.BinaryField(verbose_name='Заголовок контейнера')
+    encryption_key = models.CharField(
+        max_length=255, verbose_name='Ключ шифрования')
+    created_at = models.DateTimeField(
+        auto_now_add=True, verbose_name='Дата создания')
+    updated_at = models.DateTimeField(
+        auto_now=True, verbose_name='Дата обновления')
+
+    class Meta:
+        verbose_name = 'Сессия загрузки'
+        verbose_name_plural = 'Сессии загрузки'
+
+    def __str__(self):
+        return f"{self.name} ({self.owner.username})"
+
+    @property
+    def chunk_count(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    def expected_chunk_length(self, index):
+        if index < self.chunk_count - 1:
+            return self.chunk_size
+        return self.size - self.chunk_size * (self.chunk_count - 1)
+
+
+class UploadChunk(models.Model):
+    session = models.ForeignKey(
+        UploadSession, on_delete=models.CASCADE, related_name='chunks',
+        verbose_name='Сессия загрузки')
+    index = models.PositiveIntegerField(verbose_name='Номер части')
+    path = models.CharField(max_length=255, verbose_name='Путь в хранилище')
+    created_at = models.DateTimeField(
+        auto_now_add=True, verbose_name='Дата создания')
+
+    class Meta:
+        verbose_name = 'Часть загрузки'
+        verbose_name_plural = 'Части загрузки'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['session', 'index'], name='unique_upload_chunk'),
+        ]
+
+
+class IngestJob(models.Model):
+    """Асинхронная загрузка: файл ждёт шифрования в Celery."""
+    STATUS_CHOICES = (
+        ('pending', 'В очереди'),
+        ('processing', 'Обрабатывается'),
+        ('done', 'Готово'),
+        ('failed', 'Ошибка'),
+    )
+    id = models.UUIDField(
+        primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(
+        User, on_delete=models.CASCADE, verbose_name='Владелец')
+    name = models.CharField(max_length=255, verbose_name='Название файла')
+    size = models.BigIntegerField(verbose_name='Размер файла (байт)')
+    staging_path = models.CharField(
+        max_length=255, verbose_name='Путь во временном хранилище')
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default='pending',
+        verbose_name='Статус')
+    processed = models.BigIntegerField(
+        default=0, verbose_name='Обработано (байт)')
+    attempts = models.PositiveSmallIntegerField(
+        default=0, verbose_name='Попыток обработки')
+    file = models.ForeignKey(
+        File, null=True, blank=True, on_delete=models.SET_NULL,
+        verbose_name='Файл')
+    error = models.TextField(blank=True, verbose_name='Ошибка')
+    created_at = models.DateTimeField(
+        auto_now_add=True, verbose_name='Дата создания')
+    updated_at = models.DateTimeField(
+        auto_now=True, verbose_name='Дата обновления')
+
+    class Meta:
+        verbose_name = 'Фоновая загрузка'
+        verbose_name_plural = 'Фоновые загрузки'
+
+    def __str__(self):
+        return f"{self.name} ({self.get_status_display()})"
+
+
+class UserStatsManager(models.Manager):
+
+    def add(self, user_id, **deltas):
+        """
+        Атомарно прибавляет ``deltas`` к счётчикам одним UPDATE с F().
+        Строку не создаёт: если её ещё нет, счётчики посчитает с нуля
+        первый же запрос статистики (см. stats.get_user_stats).
+
+        Пока строка создаётся, изменения данных могут в подсчёт не попасть,
+        и счётчик окажется меньше настоящего. Вычитание поэтому не уходит
+        ниже нуля: иначе ограничение PositiveIntegerField сорвало бы само
+        удаление. Расхождение исправит reconcile_user_stats.
+        """
+        values = {
+            name: (models.F(name) + delta if delta > 0
+                   else Greatest(models.F(name) + delta, 0))
+            for name, delta in deltas.items() if delta}
+        if values:
+            self.filter(user_id=user_id).update(
+                updated_at=timezone.now(), **values)
+
+
+class UserStats(models.Model):
+    """Счётчики для дашборда, которые обновляются вместе с данными."""
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True,
+        related_name='stats', verbose_name='Пользователь')
+    file_count = models.PositiveIntegerField(
+        default=0, verbose_name='Файлов')
+    total_bytes = models.BigIntegerField(
+        default=0, verbose_name='Объём файлов (байт)')
+    share_count = models.PositiveIntegerField(
+        default=0, verbose_name='Предоставлено доступов')
+    download_count = models.PositiveIntegerField(
+        default=0, verbose_name='Скачиваний')
+    updated_at = models.DateTimeField(
+        default=timezone.now, verbose_name='Дата обновления')
+
+    objects = UserStatsManager()
+
+    class Meta:
+        verbose_name = 'Статистика пользователя'
+        verbose_name_plural = 'Статистика пользователей'
+
+    def __str__(self):
+        return f"{self.user} ({self.file_count} файлов)"
+
+
+class ActivityEvent(models.Model):
+    """
+    Запись ленты активности владельца файла. Пишется в момент действия,
+    а имя файла и второго пользователя копируются в строку, поэтому лента
+    читается одним запросом по индексу (user, -timestamp) без JOIN и
+    переживает удаление файла.
+    """
+    TYPE_CHOICES = (
+        ('upload', 'Загрузка'),
+        ('share', 'Предоставление доступа'),
+        ('download', 'Скачивание'),
+    )
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, db_index=False,
+        related_name='activity_events', verbose_name='Пользователь')
+    event_type = models.CharField(
+        max_length=10, choices=TYPE_CHOICES, verbose_name='Тип')
+    file_name = models.CharField(max_length=255, verbose_name='Название файла')
+    other_username = models.CharField(
+        max_length=150, blank=True, default='',
+        verbose_name='Второй пользователь')
+    timestamp = models.DateTimeField(
+        default=timezone.now, verbose_name='Время')
+
+    class Meta:
+        verbose_name = 'Событие'
+        verbose_name_plural = 'События'
+        indexes = [
+            models.Index(fields=['user', '-timestamp', '-id'],
+                         name='activity_user_time_idx'),
+            # Удаление событий старше срока хранения
+            models.Index(fields=['timestamp'], name='activity_time_idx'),
+        ]
+
+    def __str__(self):
+        return self.description
+
+    @property
+    def description(self):
+        if self.event_type == 'upload':
+            return f'Загружен файл: {self.file_name}'
+        if self.event_type == 'share':
+            return (f'Файл {self.file_name} предоставлен пользователю '
+                    f'{self.other_username}')
+        return f'Файл {self.file_name} скачан пользователем {self.other_username}'
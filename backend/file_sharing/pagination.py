@@ -0,0 +1,133 @@
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .filters import BIGINT_MAX, parse_uint
+
+
+class KeysetPagination(BasePagination):
+    """
+    Постраничный вывод по ключу (дата, id) в порядке убывания.
+
+    Курсор хранит дату и id последней строки страницы, и следующая
+    страница выбирается условием ``(дата, id) < (курсор)`` по составному
+    индексу. В отличие от CursorPagination из DRF здесь нет OFFSET даже
+    при одинаковых датах, поэтому дальние страницы стоят столько же,
+    сколько первая. Формат ответа тот же: next, previous, results.
+    """
+    ordering_field = 'created_at'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        size = parse_uint(
+            request.query_params.get(self.page_size_query_param, ''))
+        if size:
+            return min(size, self.max_page_size)
+        return self.page_size
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            position = parse_datetime(data['p'])
+            if position is None:
+                raise ValueError
+            pk = int(data['id'])
+            if not 0 <= pk <= BIGINT_MAX:
+                raise ValueError
+            return position, pk, bool(data.get('r'))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, row, reverse):
+        data = {'p': getattr(row, self.ordering_field).isoformat(), 'id': row.pk}
+        if reverse:
+            data['r'] = 1
+        encoded = base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, encoded)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        field = self.ordering_field
+
+        reverse = False
+        if cursor is None:
+            queryset = queryset.order_by(f'-{field}', '-pk')
+        else:
+            position, pk, reverse = cursor
+            # Лишнее условие по одной дате помогает планировщику взять
+            # диапазон индекса, а не фильтровать всё по OR
+            if reverse:
+                queryset = queryset.filter(
+                    Q(**{f'{field}__gt': position})
+                    | Q(**{field: position, 'pk__gt': pk}),
+                    **{f'{field}__gte': position},
+                ).order_by(field, 'pk')
+            else:
+                queryset = queryset.filter(
+                    Q(**{f'{field}__lt': position})
+                    | Q(**{field: position, 'pk__lt': pk}),
+                    **{f'{field}__lte': position},
+                ).order_by(f'-{field}', '-pk')
+
+        rows = list(queryset[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        self.page = rows
+        return rows
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class DateJoinedKeysetPagination(KeysetPagination):
+    ordering_field = 'date_joined'
+
+
+class TimestampKeysetPagination(KeysetPagination):
+    ordering_field = 'timestamp'
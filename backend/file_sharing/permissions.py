@@ -1,5 +1,7 @@
 from rest_framework import permissions
 
+from .principals import is_manager
+
 
 class CanDeleteUser(permissions.BasePermission):
     """
@@ -48,16 +50,13 @@ class CanDeleteFile(permissions.BasePermission):
             return True  # может всё
 
         # Персонал ("manager" в userprofile.role)
-        try:
-            if hasattr(user, "userprofile") and user.userprofile.role == "manager":
-                # не может удалять файлы админов и других сотрудников
-                if file_owner.is_staff:
-                    return False
-                if hasattr(file_owner, "userprofile") and file_owner.userprofile.role == "manager" and file_owner.id != user.id:
-                    return False
-                return True
-        except Exception:
-            pass
+        if is_manager(user):
+            # не может удалять файлы админов и других сотрудников
+            if file_owner.is_staff:
+                return False
+            if is_manager(file_owner) and file_owner.id != user.id:
+                return False
+            return True
 
         # Обычный пользователь — только свои файлы
         return file_owner.id == user.id
@@ -0,0 +1,64 @@
+"""
+Роли пользователей без ленивых запросов.
+
+Роль хранится в UserProfile, и ``user.userprofile.role`` на каждом
+объекте — отдельный запрос (и DoesNotExist, если профиля нет). Здесь
+роль читается один раз и запоминается на самом объекте пользователя:
+
+* у автора запроса — при первом обращении (для JWT роль уже есть в
+  claims, см. authentication.user_from_claims);
+* у пользователей в ответе — одним запросом на весь список через
+  resolve_roles (его вызывает RoleResolvingListSerializer).
+"""
+from .models import User, UserProfile
+
+ROLE_ADMIN = 'admin'
+ROLE_MANAGER = 'manager'
+ROLE_USER = 'user'
+
+_ROLE_ATTR = '_principal_role'
+
+
+def _profile_role(user):
+    if User.userprofile.is_cached(user):
+        profile = User.userprofile.related.get_cached_value(user)
+        return profile.role if profile is not None else None
+    return (UserProfile.objects.filter(user_id=user.pk)
+            .values_list('role', flat=True).first())
+
+
+def get_role(user):
+    """Роль пользователя или None, если профиля нет."""
+    if user is None or not getattr(user, 'is_authenticated', False):
+        return None
+    if not hasattr(user, _ROLE_ATTR):
+        setattr(user, _ROLE_ATTR, _profile_role(user))
+    return getattr(user, _ROLE_ATTR)
+
+
+def resolve_roles(users):
+    """Заполняет роли для всех пользователей одним запросом."""
+    pending = {}
+    for user in users:
+        if user is None or hasattr(user, _ROLE_ATTR):
+            continue
+        if User.userprofile.is_cached(user):
+            get_role(user)
+        else:
+            pending.setdefault(user.pk, []).append(user)
+    if not pending:
+        return
+    roles = dict(UserProfile.objects.filter(user_id__in=pending)
+                 .values_list('user_id', 'role'))
+    for user_id, same_user in pending.items():
+        for user in same_user:
+            setattr(user, _ROLE_ATTR, roles.get(user_id))
+
+
+def is_manager(user):
+    return get_role(user) == ROLE_MANAGER
+
+
+def sees_all_files(user):
+    """Админы (is_staff) и менеджеры видят файлы всех пользователей."""
+    return bool(user.is_staff) or is_manager(user)
@@ -0,0 +1,117 @@
+"""
+Квота на объём файлов пользователя (UserProfile.storage_used / storage_limit).
+
+storage_used меняется вместе с данными одним UPDATE с F(): при создании
+File — условным, который не даёт выйти за лимит даже параллельным
+загрузкам, при удалении — безусловным. SUM(size) по файлам не считается
+ни при загрузке, ни при проверке; его считает только ночная сверка
+reconcile_storage_usage.
+
+До приёма тела загрузки объём проверяется по заявленному размеру
+(Content-Length или размер сессии), чтобы не шифровать файл, который
+всё равно не поместится.
+"""
+import logging
+
+from django.db import transaction
+from django.db.models import F, Sum
+
+from .models import File, UserProfile
+
+logger = logging.getLogger(__name__)
+
+# Multipart-тело больше самого файла на заголовки частей и границы
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class QuotaExceeded(Exception):
+
+    def __init__(self, used, limit, requested):
+        self.used = used
+        self.limit = limit
+        self.requested = requested
+        super().__init__(
+            f'Storage quota exceeded: {used} of {limit} bytes used, '
+            f'{requested} more requested')
+
+
+def check_quota(user_id, incoming):
+    """
+    Проверка по заявленному размеру, до приёма данных. Пользователи без
+    профиля квоты не имеют.
+    """
+    row = (UserProfile.objects.filter(user_id=user_id)
+           .values_list('storage_used', 'storage_limit').first())
+    if row is not None and row[0] + incoming > row[1]:
+        raise QuotaExceeded(row[0], row[1], incoming)
+
+
+def check_request(request, user_id):
+    """check_quota по Content-Length multipart-запроса."""
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return
+    check_quota(user_id, max(length - MULTIPART_OVERHEAD, 0))
+
+
+def charge(user_id, size):
+    """
+    Прибавляет ``size`` к storage_used, если он помещается в лимит.
+    Строка профиля блокируется до конца транзакции, поэтому вызывать
+    нужно в той же транзакции, что и создание File.
+    """
+    if not size:
+        return
+    charged = UserProfile.objects.filter(
+        user_id=user_id, storage_used__lte=F('storage_limit') - size,
+    ).update(storage_used=F('storage_used') + size)
+    if charged:
+        return
+    row = (UserProfile.objects.filter(user_id=user_id)
+           .values_list('storage_used', 'storage_limit').first())
+    if row is not None:
+        raise QuotaExceeded(row[0], row[1], size)
+
+
+def release(user_id, size):
+    if size:
+        UserProfile.objects.filter(user_id=user_id).update(
+            storage_used=F('storage_used') - size)
+
+
+def reconcile_storage_usage(batch_size=500):
+    """
+    Пересчитывает storage_used по файлам пачками профилей и исправляет
+    разошедшиеся. Профили пачки блокируются на время пересчёта: загрузка,
+    которая уже изменила storage_used, но ещё не закоммитила File, держит
+    ту же блокировку, так что сумма и счётчик не разъедутся.
+    Возвращает число исправленных профилей.
+    """
+    fixed = 0
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            profiles = list(
+                UserProfile.objects.select_for_update()
+                .filter(pk__gt=last_pk).order_by('pk')
+                .only('pk', 'user_id', 'storage_used')[:batch_size])
+            if not profiles:
+                break
+            last_pk = profiles[-1].pk
+            actual = dict(
+                File.objects.filter(owner_id__in=[p.user_id for p in profiles])
+                .values('owner_id').annotate(used=Sum('size'))
+                .values_list('owner_id', 'used'))
+            drifted = []
+            for profile in profiles:
+                used = actual.get(profile.user_id) or 0
+                if profile.storage_used != used:
+                    logger.warning(
+                        f"Storage usage drift for user {profile.user_id}: "
+                        f"stored {profile.storage_used}, actual {used}")
+                    profile.storage_used = used
+                    drifted.append(profile)
+            UserProfile.objects.bulk_update(drifted, ['storage_used'])
+        fixed += len(drifted)
+    return fixed
@@ -0,0 +1,108 @@
+"""
+Кэш ответов с версиями.
+
+Ключ ответа включает номера поколений данных, которые в него попали:
+поколение пользователя (его файлы, шары, скачивания и имена владельцев
+расшаренных ему файлов), поколение всех файлов и поколение всех
+пользователей (только для списков персонала) и общую эпоху. Запись данных увеличивает нужные
+поколения, и старые ключи просто перестают читаться и истекают по
+RESPONSE_CACHE_TIMEOUT — удалять их не нужно.
+
+Поколения увеличиваются после коммита: иначе параллельный запрос мог бы
+положить ещё старые данные под уже новый ключ.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+DEFAULT_TIMEOUT = 300
+
+EPOCH = 'gen:epoch'
+ALL_FILES = 'gen:files'
+ALL_USERS = 'gen:users'
+
+
+def user_generation_key(user_id):
+    return f'gen:user:{user_id}'
+
+
+def get_timeout():
+    return getattr(settings, 'RESPONSE_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+
+
+def _initial_generation():
+    # Если счётчик вытеснили из кэша, он начинается не с нуля, а с
+    # текущего времени, чтобы не совпасть со старыми ключами
+    return time.time_ns() // 1000
+
+
+def _generations(names):
+    generations = cache.get_many(names)
+    missing = [name for name in names if name not in generations]
+    if missing:
+        for name in missing:
+            cache.add(name, _initial_generation(), timeout=None)
+        generations.update(cache.get_many(missing))
+    return generations
+
+
+def _bump(keys):
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            if not cache.add(key, _initial_generation(), timeout=None):
+                cache.incr(key)
+
+
+def bump(*user_ids, all_files=False, all_users=False):
+    """Сбрасывает кэш пользователей (и общих списков) после коммита."""
+    keys = {user_generation_key(user_id) for user_id in user_ids if user_id}
+    if all_files:
+        keys.add(ALL_FILES)
+    if all_users:
+        keys.add(ALL_USERS)
+    if keys:
+        transaction.on_commit(lambda: _bump(sorted(keys)))
+
+
+def bump_all():
+    """Сбрасывает весь кэш ответов: для массовых правок мимо сигналов."""
+    transaction.on_commit(lambda: _bump([EPOCH]))
+
+
+def response_key(request, namespace, all_files=False, all_users=False):
+    names = [EPOCH, user_generation_key(request.user.pk)]
+    if all_files:
+        names.append(ALL_FILES)
+    if all_users:
+        names.append(ALL_USERS)
+    generations = _generations(names)
+    parts = [f'{name}={generations.get(name)}' for name in names]
+    parts.append(request.get_full_path())
+    digest = hashlib.sha256('|'.join(parts).encode()).hexdigest()
+    return f'response:{namespace}:{request.user.pk}:{digest}'
+
+
+def cached_response(request, namespace, compute, all_files=False,
+                    all_users=False):
+    """
+    Отдаёт закэшированный ответ или вызывает ``compute()`` и кэширует его
+    данные, если ответ успешный. ``all_files`` и ``all_users`` — ответ
+    зависит от файлов и профилей всех пользователей (списки персонала).
+    """
+    key = response_key(request, namespace, all_files, all_users)
+    data = cache.get(key)
+    if data is not None:
+        response = Response(data)
+        response['X-Cache'] = 'HIT'
+        return response
+    response = compute()
+    if response.status_code == 200:
+        cache.set(key, response.data, get_timeout())
+        response['X-Cache'] = 'MISS'
+    return response
@@ -1,12 +1,27 @@
 from rest_framework import serializers
 
-from django.utils import timezone
-from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models.manager import BaseManager
 
+from . import encryption
 from .models import *
+from .principals import get_role, resolve_roles
+from .storage import blob_name, create_file, register_blob
 
-import os
-from cryptography.fernet import Fernet
+
+class RoleResolvingListSerializer(serializers.ListSerializer):
+    """
+    Перед выводом списка читает роли всех пользователей из него одним
+    запросом; каких пользователей брать, говорит ``principals()`` дочернего
+    сериализатора.
+    """
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, BaseManager) else data)
+        resolve_roles(
+            user for item in items for user in self.child.principals(item))
+        return super().to_representation(items)
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -17,26 +32,27 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ('id', 'username', 'email', 'first_name',
                   'last_name', 'is_staff', 'is_superuser', 'role')
         read_only_fields = ('id',)
+        list_serializer_class = RoleResolvingListSerializer
+
+    def principals(self, obj):
+        return [obj]
 
     def get_role(self, obj):
-        try:
-            return obj.userprofile.role
-        except Exception:
-            return None
+        return get_role(obj)
 
 class FileSerializer(serializers.ModelSerializer):
     owner = UserSerializer(read_only=True)
-    file_size = serializers.SerializerMethodField()
+    # Размер берётся из базы, а не из хранилища
+    file_size = serializers.IntegerField(source='size', read_only=True)
 
     class Meta:
         model = File
         fields = ('id', 'name', 'file', 'owner', 'created_at', 'updated_at', 'is_encrypted', 'file_size')
         read_only_fields = ('id', 'owner', 'created_at', 'updated_at')
+        list_serializer_class = RoleResolvingListSerializer
 
-    def get_file_size(self, obj):
-        if obj.file and hasattr(obj.file, 'size'):
-            return obj.file.size
-        return None
+    def principals(self, obj):
+        return [obj.owner]
 
 
 
@@ -48,6 +64,37 @@ class FileShareSerializer(serializers.ModelSerializer):
         model = FileShare
         fields = ('id', 'file', 'shared_with', 'created_at', 'downloaded', 'downloaded_at', 'access_token')
         read_only_fields = ('id', 'created_at', 'downloaded', 'downloaded_at', 'access_token')
+        list_serializer_class = RoleResolvingListSerializer
+
+    def principals(self, obj):
+        return [obj.file.owner, obj.shared_with]
+
+class BulkShareSerializer(serializers.Serializer):
+    """Файлы и получатели для /api/files/bulk-share/; шарится каждая пара."""
+    MAX_PAIRS = 10000
+
+    files = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False, max_length=1000)
+    usernames = serializers.ListField(
+        child=serializers.CharField(), allow_empty=False, max_length=1000)
+
+    def validate(self, data):
+        # Повторы в запросе не нужны, порядок сохраняем для ответа
+        data['files'] = list(dict.fromkeys(data['files']))
+        data['usernames'] = list(dict.fromkeys(data['usernames']))
+        if len(data['files']) * len(data['usernames']) > self.MAX_PAIRS:
+            raise serializers.ValidationError(
+                f"No more than {self.MAX_PAIRS} file/user pairs per request")
+        return data
+
+
+class BulkDeleteSerializer(serializers.Serializer):
+    files = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False, max_length=1000)
+
+    def validate_files(self, value):
+        return list(dict.fromkeys(value))
+
 
 class UserProfileSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
@@ -60,13 +107,16 @@ class UserProfileSerializer(serializers.ModelSerializer):
 class EncryptedFileSerializer(serializers.ModelSerializer):
     file = serializers.FileField()
     owner = UserSerializer(read_only=True)
-    size = serializers.IntegerField()
 
     class Meta:
         model = File
-        fields = ('id', 'name', 'file', 'owner', 'created_at', 'updated_at', 'is_encrypted','size')
-
+        fields = ('id', 'name', 'file', 'owner', 'created_at', 'updated_at', 'is_encrypted',
+                  'size', 'stored_size', 'checksum')
+        read_only_fields = ('size', 'stored_size', 'checksum')
+        list_serializer_class = RoleResolvingListSerializer
 
+    def principals(self, obj):
+        return [obj.owner]
 
     def create(self, validated_data):
         file = validated_data.pop('file', None)
@@ -74,31 +124,59 @@ class EncryptedFileSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("No file provided")
 
         # Generate encryption key
-        key = Fernet.generate_key()
-        f = Fernet(key)
+        key = encryption.generate_key()
 
-        # Read and encrypt file content
-        file_content = file.read()
-        encrypted_data = f.encrypt(file_content)
+        # Save encrypted file
+        content = encryption.EncryptedContent(file, key)
+        path = default_storage.save(blob_name(), content)
 
-        # Create unique filename
-        timestamp = timezone.now().strftime('%Y%m%d_%H%M%S')
-        safe_filename = f"{timestamp}_{file.name}"
-        encrypted_file_path = os.path.join('encrypted_files', safe_filename)
-        full_path = os.path.join(settings.MEDIA_ROOT, encrypted_file_path)
+        # Create file record (identical content is stored only once)
+        try:
+            with transaction.atomic():
+                blob = register_blob(
+                    path, key, file.size, content.checksum,
+                    content.compression, content.stored_size,
+                    content.compression_index)
+                return create_file(
+                    self.context['request'].user, file.name, blob,
+                    content.checksum)
+        except Exception:
+            default_storage.delete(path)
+            raise
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    chunk_count = serializers.IntegerField(read_only=True)
+    received_chunks = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadSession
+        fields = ('id', 'name', 'size', 'chunk_size', 'chunk_count',
+                  'received_chunks', 'created_at', 'updated_at')
+        read_only_fields = ('id', 'chunk_size', 'created_at', 'updated_at')
+
+    def get_received_chunks(self, obj):
+        return sorted(c.index for c in obj.chunks.all())
+
+    def validate_size(self, value):
+        if value < 0:
+            raise serializers.ValidationError("Size must not be negative")
+        return value
+
+
+class IngestJobSerializer(serializers.ModelSerializer):
+    progress = serializers.SerializerMethodField()
+
+    class Meta:
+        model = IngestJob
+        fields = ('id', 'name', 'size', 'status', 'processed', 'progress',
+                  'file', 'error', 'created_at', 'updated_at')
+        read_only_fields = fields
+
+    def get_progress(self, obj):
+        if obj.status == 'done' or not obj.size:
+            return 100 if obj.status == 'done' else 0
+        return min(100, obj.processed * 100 // obj.size)
 
-        # Save encrypted file
-        with open(full_path, 'wb') as f:
-            f.write(encrypted_data)
-
-        # Create file record
-        return File.objects.create(
-            name=file.name,
-            file=encrypted_file_path,
-            is_encrypted=True,
-            owner=self.context['request'].user,
-            **validated_data
-        )
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
@@ -115,6 +193,25 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         validated_data.pop('password_confirm')
-        user = User.objects.create_user(**validated_data)
+        password_hash = validated_data.pop('password_hash', None)
+        if password_hash is None:
+            user = User.objects.create_user(**validated_data)
+        else:
+            # Пароль уже захеширован в пуле (см. hashing), повторно не хешируем
+            validated_data.pop('password')
+            user = User(
+                username=User.normalize_username(validated_data.pop('username')),
+                email=User.objects.normalize_email(validated_data.pop('email')),
+                password=password_hash,
+                **validated_data)
+            user.save()
         UserProfile.objects.create(user=user,role='user')
-        return user 
\ No newline at end of file
+        return user 
+
+class ActivityEventSerializer(serializers.ModelSerializer):
+    type = serializers.CharField(source='event_type', read_only=True)
+
+    class Meta:
+        model = ActivityEvent
+        fields = ('id', 'type', 'description', 'file_name', 'other_username', 'timestamp')
+        read_only_fields = fields
@@ -0,0 +1,92 @@
+"""
+Массовая выдача доступа к файлам.
+
+Шары пишутся через bulk_create(ignore_conflicts=True): пары, которые уже
+есть (или которые параллельно создал другой запрос), пропускает
+уникальное ограничение (file, shared_with). bulk_create не вызывает
+сигналы, поэтому счётчики, лента и кэш ответов обновляются здесь, по
+одному запросу на всю пачку, а не на каждую шару.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import response_cache
+from .models import ActivityEvent, FileShare, UserStats
+
+BATCH_SIZE = 1000
+
+SHARE_CREATED = 'created'
+SHARE_EXISTS = 'exists'
+FILE_NOT_FOUND = 'file_not_found'
+USER_NOT_FOUND = 'user_not_found'
+
+
+def _insert(shares):
+    """Вставляет пачку и возвращает те шары, которые действительно созданы."""
+    FileShare.objects.bulk_create(shares, ignore_conflicts=True)
+    # Токены случайные и уникальные: по ним видно, чьи строки вставлены
+    created = set(FileShare.objects.filter(
+        access_token__in=[share.access_token for share in shares],
+    ).values_list('access_token', flat=True))
+    return [share for share in shares if share.access_token in created]
+
+
+def _record(created):
+    owners = Counter(share.file.owner_id for share in created)
+    for owner_id, count in owners.items():
+        UserStats.objects.add(owner_id, share_count=count)
+    ActivityEvent.objects.bulk_create([
+        ActivityEvent(
+            user_id=share.file.owner_id, event_type='share',
+            file_name=share.file.name,
+            other_username=share.shared_with.username,
+            timestamp=share.created_at)
+        for share in created
+    ], batch_size=BATCH_SIZE)
+    response_cache.bump(
+        *owners, *{share.shared_with_id for share in created})
+
+
+def share_files(files, recipients):
+    """
+    Выдаёт каждому из ``recipients`` доступ к каждому из ``files``.
+    Возвращает множество созданных пар (file_id, user_id); остальные пары
+    уже были расшарены.
+    """
+    existing = set(FileShare.objects.filter(
+        file__in=files, shared_with__in=recipients,
+    ).values_list('file_id', 'shared_with_id'))
+    now = timezone.now()
+    pending = [
+        FileShare(file=file, shared_with=user, created_at=now)
+        for file in files for user in recipients
+        if (file.pk, user.pk) not in existing
+    ]
+    created = []
+    with transaction.atomic():
+        for start in range(0, len(pending), BATCH_SIZE):
+            created += _insert(pending[start:start + BATCH_SIZE])
+        _record(created)
+    return {(share.file_id, share.shared_with_id) for share in created}
+
+
+def share_results(file_ids, usernames, files, recipients, created):
+    """Результат по каждой запрошенной паре (файл, имя пользователя)."""
+    found_files = {file.pk for file in files}
+    users = {user.username: user.pk for user in recipients}
+    results = []
+    for file_id in file_ids:
+        for username in usernames:
+            if file_id not in found_files:
+                result = FILE_NOT_FOUND
+            elif username not in users:
+                result = USER_NOT_FOUND
+            elif (file_id, users[username]) in created:
+                result = SHARE_CREATED
+            else:
+                result = SHARE_EXISTS
+            results.append(
+                {'file': file_id, 'username': username, 'status': result})
+    return results
@@ -0,0 +1,159 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import quota, response_cache
+from .authentication import revoke_tokens
+from .file_events import files_created
+from .models import ActivityEvent, File, FileShare, User, UserProfile, UserStats
+from .storage import release_blob
+
+
+@receiver(post_delete, sender=File)
+def release_file_blob(sender, instance, **kwargs):
+    # Срабатывает и при каскадном удалении вместе с пользователем
+    if instance.blob_id:
+        release_blob(instance.blob_id)
+
+
+# Новый файл: счётчики, лента и кэш ответов — в file_events, общем с
+# массовой загрузкой (storage.save_uploads)
+
+@receiver(post_save, sender=File)
+def record_created_file(sender, instance, created, **kwargs):
+    if created:
+        files_created(instance.owner_id, [instance])
+
+
+# Счётчики дашборда (UserStats) меняются в той же транзакции, что и данные
+
+@receiver(post_delete, sender=File)
+def count_deleted_file(sender, instance, **kwargs):
+    if instance.deleted_at is not None:
+        # Уже вычтен при пометке об удалении (deletion.soft_delete_files)
+        return
+    UserStats.objects.add(
+        instance.owner_id, file_count=-1, total_bytes=-(instance.size or 0))
+    # Квота списывается при создании в storage.create_file, а не сигналом
+    quota.release(instance.owner_id, instance.size)
+
+
+@receiver(post_save, sender=FileShare)
+def count_created_share(sender, instance, created, **kwargs):
+    if created:
+        UserStats.objects.add(
+            instance.file.owner_id, share_count=1,
+            download_count=int(instance.downloaded))
+
+
+@receiver(post_delete, sender=FileShare)
+def count_deleted_share(sender, instance, **kwargs):
+    # При каскадном удалении файла шары удаляются раньше него,
+    # так что владельца ещё можно прочитать. Шары файлов, помеченных
+    # удалёнными, из счётчиков уже вычтены: File.objects их не видит
+    owner_id = (File.objects.filter(pk=instance.file_id)
+                .values_list('owner_id', flat=True).first())
+    if owner_id is not None:
+        UserStats.objects.add(
+            owner_id, share_count=-1, download_count=-int(instance.downloaded))
+
+
+# Лента активности пишется в момент действия (скачивание — в mark_as_downloaded)
+
+@receiver(post_save, sender=FileShare)
+def log_share(sender, instance, created, **kwargs):
+    if created:
+        ActivityEvent.objects.create(
+            user_id=instance.file.owner_id, event_type='share',
+            file_name=instance.file.name,
+            other_username=instance.shared_with.username,
+            timestamp=instance.created_at)
+
+
+# Версии кэша ответов: запись увеличивает поколения тех, чьи ответы
+# она меняет (см. response_cache)
+
+@receiver(post_save, sender=File)
+@receiver(post_delete, sender=File)
+def invalidate_file(sender, instance, created=False, **kwargs):
+    if created:
+        # Уже учтено в files_created
+        return
+    recipients = []
+    if kwargs['signal'] is post_save:
+        # Файл виден получателям во вложенном виде в их списке шар
+        recipients = FileShare.objects.filter(
+            file=instance).values_list('shared_with_id', flat=True)
+    response_cache.bump(instance.owner_id, *recipients, all_files=True)
+
+
+@receiver(post_save, sender=FileShare)
+@receiver(post_delete, sender=FileShare)
+def invalidate_share(sender, instance, **kwargs):
+    owner_id = (File.objects.filter(pk=instance.file_id)
+                .values_list('owner_id', flat=True).first())
+    response_cache.bump(owner_id, instance.shared_with_id)
+
+
+# Вход в систему обновляет только last_login, это на ответы не влияет
+_NOT_SERIALIZED = {'last_login', 'password'}
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def invalidate_user(sender, instance, update_fields=None, created=False,
+                    **kwargs):
+    if update_fields and set(update_fields) <= _NOT_SERIALIZED:
+        return
+    if sender is User and created:
+        # Нового пользователя ещё нет ни в одном закэшированном ответе
+        return
+    user_id = instance.pk if sender is User else instance.user_id
+    # Имя и роль видны в списках шар у другой стороны каждой шары
+    peers = set(FileShare.objects.filter(file__owner_id=user_id)
+                .values_list('shared_with_id', flat=True))
+    peers.update(FileShare.objects.filter(shared_with_id=user_id)
+                 .values_list('file__owner_id', flat=True))
+    response_cache.bump(user_id, *peers, all_users=True)
+
+
+# Права в claims access-токена: их изменение отзывает выданные токены
+_PRIVILEGE_FIELDS = {
+    User: ('is_active', 'is_staff', 'is_superuser'),
+    UserProfile: ('role',),
+}
+
+
+@receiver(pre_save, sender=User)
+@receiver(pre_save, sender=UserProfile)
+def note_privilege_change(sender, instance, update_fields=None, **kwargs):
+    fields = _PRIVILEGE_FIELDS[sender]
+    instance._privileges_changed = False
+    if instance._state.adding or (
+            update_fields is not None and not set(update_fields) & set(fields)):
+        return
+    old = sender.objects.filter(pk=instance.pk).values(*fields).first()
+    instance._privileges_changed = old is not None and any(
+        old[field] != getattr(instance, field) for field in fields)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=UserProfile)
+def revoke_on_privilege_change(sender, instance, **kwargs):
+    if getattr(instance, '_privileges_changed', False):
+        instance._privileges_changed = False
+        revoke_tokens(instance if sender is User else instance.user)
+
+
+@receiver(post_delete, sender=UserProfile)
+def revoke_on_profile_delete(sender, instance, **kwargs):
+    # Без профиля роли нет; при удалении пользователя профиль удаляется
+    # раньше него, и отзыв ниже всё равно произойдёт
+    revoke_tokens(User(pk=instance.user_id))
+
+
+@receiver(post_delete, sender=User)
+def revoke_deleted_user_tokens(sender, instance, **kwargs):
+    # Access-токены удалённого пользователя отсекаются по ключу в кэше,
+    # refresh-токены — тем, что пользователя больше нет в базе
+    revoke_tokens(instance)
@@ -0,0 +1,90 @@
+"""
+Статистика для дашборда.
+
+Счётчики в UserStats меняются вместе с данными (сигналы в signals.py и
+mark_as_downloaded), поэтому дашборд читает одну строку по первичному
+ключу. Если счётчики разошлись с данными (ручные правки, bulk-операции
+мимо сигналов), их исправляет reconcile_user_stats, который запускается
+по расписанию.
+"""
+import logging
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Q, Sum
+
+from . import response_cache
+from .models import File, FileShare, User, UserStats
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = ('file_count', 'total_bytes', 'share_count', 'download_count')
+
+
+def count_user_stats(user_ids):
+    """Счётчики, посчитанные по самим данным: {user_id: {счётчик: значение}}."""
+    stats = {user_id: dict.fromkeys(COUNTERS, 0) for user_id in user_ids}
+    files = (File.objects.filter(owner_id__in=user_ids)
+             .values('owner_id')
+             .annotate(count=Count('id'), size=Sum('size')))
+    for row in files:
+        stats[row['owner_id']].update(
+            file_count=row['count'], total_bytes=row['size'] or 0)
+    shares = (FileShare.objects.filter(file__owner_id__in=user_ids,
+                                       file__deleted_at__isnull=True)
+              .values('file__owner_id')
+              .annotate(count=Count('id'),
+                        downloads=Count('id', filter=Q(downloaded=True))))
+    for row in shares:
+        stats[row['file__owner_id']].update(
+            share_count=row['count'], download_count=row['downloads'])
+    return stats
+
+
+def get_user_stats(user):
+    """Строка статистики; при первом обращении считается по данным."""
+    try:
+        return UserStats.objects.get(pk=user.pk)
+    except UserStats.DoesNotExist:
+        pass
+    try:
+        with transaction.atomic():
+            return UserStats.objects.create(
+                user_id=user.pk, **count_user_stats([user.pk])[user.pk])
+    except IntegrityError:
+        # Параллельный запрос успел создать строку
+        return UserStats.objects.get(pk=user.pk)
+
+
+def reconcile_user_stats(batch_size=500):
+    """
+    Пересчитывает счётчики всех пользователей пачками по первичному ключу
+    и исправляет разошедшиеся. Возвращает число исправленных строк.
+    """
+    fixed = 0
+    last_pk = 0
+    while True:
+        user_ids = list(User.objects.filter(pk__gt=last_pk).order_by('pk')
+                        .values_list('pk', flat=True)[:batch_size])
+        if not user_ids:
+            break
+        last_pk = user_ids[-1]
+
+        actual = count_user_stats(user_ids)
+        stored = {row['user_id']: row for row in UserStats.objects.filter(
+            user_id__in=user_ids).values('user_id', *COUNTERS)}
+        drifted = []
+        for user_id, counters in actual.items():
+            row = stored.get(user_id)
+            if row is not None and all(row[k] == v for k, v in counters.items()):
+                continue
+            if row is not None:
+                logger.warning(f"User stats drift for user {user_id}: "
+                               f"stored {row}, actual {counters}")
+            drifted.append(UserStats(user_id=user_id, **counters))
+
+        UserStats.objects.bulk_create(
+            drifted, update_conflicts=True, unique_fields=['user'],
+            update_fields=[*COUNTERS, 'updated_at'])
+        response_cache.bump(*(row.user_id for row in drifted))
+        fixed += len(drifted)
+    return fixed
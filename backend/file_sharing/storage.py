@@ -0,0 +1,257 @@
+import os
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import models, transaction
+from django.db.models import F
+from django.utils.crypto import salted_hmac
+
+from . import quota
+from .file_events import files_created
+from .models import Blob, File
+
+
+BLOB_DIR = 'encrypted_files'
+# encrypted_files/ab/cd/<uuid>: два уровня по 256 папок, имя не зависит
+# от названия файла пользователя
+SHARDED_BLOB_RE = r'^encrypted_files/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{32}$'
+
+
+def blob_name():
+    """Новое имя, под которым зашифрованный файл кладётся в хранилище."""
+    opaque = uuid.uuid4().hex
+    return '/'.join((BLOB_DIR, opaque[:2], opaque[2:4], opaque))
+
+
+def create_blob():
+    """
+    Создаёт пустой файл в хранилище и открывает его на запись, чтобы писать
+    шифртекст по мере поступления. Как и FileSystemStorage._save, файл
+    создаётся с O_EXCL.
+    Возвращает (имя в хранилище, файловый объект).
+    """
+    while True:
+        name = blob_name()
+        path = default_storage.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL
+                         | getattr(os, 'O_BINARY', 0), 0o666)
+        except FileExistsError:
+            continue
+        if settings.FILE_UPLOAD_PERMISSIONS is not None:
+            os.chmod(path, settings.FILE_UPLOAD_PERMISSIONS)
+        return name, os.fdopen(fd, 'wb')
+
+
+def blob_digest(checksum):
+    """
+    Ключ дедупликации по SHA-256 открытого текста. HMAC с SECRET_KEY, чтобы
+    по базе нельзя было проверить, хранится ли у нас файл с известным хешем.
+    """
+    return salted_hmac(
+        'file_sharing.blob', checksum, algorithm='sha256').hexdigest()
+
+
+def _delete_on_commit(name):
+    transaction.on_commit(lambda: default_storage.delete(name))
+
+
+def register_blob(storage_name, encryption_key, size, checksum,
+                  compression='', stored_size=None, compression_index=None):
+    """
+    Регистрирует только что записанный шифртекст и берёт на него ссылку.
+    Если такое содержимое уже хранится, новая копия удаляется и
+    возвращается существующий Blob.
+    """
+    with transaction.atomic():
+        blob, created = Blob.objects.select_for_update().get_or_create(
+            digest=blob_digest(checksum),
+            defaults={
+                'file': storage_name,
+                'encryption_key': encryption_key,
+                'size': size,
+                'compression': compression,
+                'compression_index': compression_index,
+                'stored_size': stored_size,
+            })
+        if not created:
+            _delete_on_commit(storage_name)
+        Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+    return blob
+
+
+def register_blobs(uploads):
+    """
+    register_blob для пачки загрузок: новые Blob вставляются одним
+    bulk_create, ссылки на все Blob берутся одним UPDATE. Возвращает Blob
+    для каждой загрузки в том же порядке.
+    """
+    digests = [blob_digest(upload.checksum) for upload in uploads]
+    candidates = {}
+    for digest, upload in zip(digests, uploads):
+        candidates.setdefault(digest, Blob(
+            digest=digest,
+            file=upload.storage_name,
+            encryption_key=upload.encryption_key,
+            size=upload.size,
+            compression=upload.compression,
+            compression_index=upload.compression_index,
+            stored_size=upload.stored_size,
+        ))
+    with transaction.atomic():
+        blobs = {}
+        while len(blobs) < len(candidates):
+            # Повтор нужен, только если чужой release_blob удалил Blob
+            # между вставкой и блокировкой
+            missing = [blob for digest, blob in candidates.items()
+                       if digest not in blobs]
+            Blob.objects.bulk_create(missing, ignore_conflicts=True)
+            blobs.update((blob.digest, blob) for blob in
+                         Blob.objects.select_for_update().filter(
+                             digest__in=[blob.digest for blob in missing]))
+        references = Counter(digests)
+        Blob.objects.filter(pk__in=[blob.pk for blob in blobs.values()]).update(
+            ref_count=F('ref_count') + models.Case(
+                *(models.When(pk=blobs[digest].pk, then=count)
+                  for digest, count in references.items()),
+                output_field=models.PositiveIntegerField()))
+        for digest, upload in zip(digests, uploads):
+            if blobs[digest].file.name != upload.storage_name:
+                _delete_on_commit(upload.storage_name)
+    return [blobs[digest] for digest in digests]
+
+
+def find_blob(checksum):
+    return Blob.objects.filter(digest=blob_digest(checksum)).first()
+
+
+def acquire_blob(blob):
+    Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+
+
+def release_blob(blob_id):
+    """Снимает ссылку; содержимое без ссылок удаляется из хранилища."""
+    with transaction.atomic():
+        Blob.objects.filter(pk=blob_id).update(ref_count=F('ref_count') - 1)
+        blob = (Blob.objects.select_for_update()
+                .filter(pk=blob_id, ref_count=0).first())
+        if blob:
+            _delete_on_commit(blob.file.name)
+            blob.delete()
+
+
+def build_file(owner, name, blob, checksum):
+    """Несохранённый File для содержимого, на которое уже взята ссылка."""
+    return File(
+        name=name,
+        file=blob.file.name,
+        blob=blob,
+        size=blob.size,
+        stored_size=blob.stored_size,
+        checksum=checksum,
+        owner=owner,
+        is_encrypted=True,
+        encryption_key=blob.encryption_key,
+        compression=blob.compression,
+    )
+
+
+def release_blobs(references):
+    """
+    release_blob для многих Blob сразу: ``references`` — {blob_id: сколько
+    ссылок снять}. Blob без ссылок удаляются, а имена их содержимого в
+    хранилище возвращаются: удалять файлы нужно после коммита.
+    """
+    if not references:
+        return []
+    with transaction.atomic():
+        Blob.objects.filter(pk__in=references).update(
+            ref_count=F('ref_count') - models.Case(
+                *(models.When(pk=blob_id, then=count)
+                  for blob_id, count in references.items()),
+                output_field=models.PositiveIntegerField()))
+        unused = list(Blob.objects.select_for_update()
+                      .filter(pk__in=references, ref_count=0)
+                      .values_list('pk', 'file'))
+        Blob.objects.filter(pk__in=[pk for pk, _ in unused]).delete()
+    return [name for _, name in unused]
+
+
+def create_file(owner, name, blob, checksum):
+    """
+    Запись File для содержимого, на которое уже взята ссылка. Размер
+    списывается с квоты владельца в той же транзакции (QuotaExceeded,
+    если не помещается).
+    """
+    file_obj = build_file(owner, name, blob, checksum)
+    with transaction.atomic():
+        quota.charge(owner.pk, file_obj.size)
+        file_obj.save(force_insert=True)
+    return file_obj
+
+
+def save_upload(owner, uploaded):
+    """
+    File для загрузки, которую EncryptingUploadHandler уже зашифровал в
+    хранилище. Если запись не удалась, шифртекст удаляется.
+    """
+    try:
+        with transaction.atomic():
+            blob = register_blob(
+                uploaded.storage_name, uploaded.encryption_key,
+                uploaded.size, uploaded.checksum, uploaded.compression,
+                uploaded.stored_size, uploaded.compression_index)
+            return create_file(owner, uploaded.name, blob, uploaded.checksum)
+    except Exception:
+        default_storage.delete(uploaded.storage_name)
+        raise
+
+
+def save_uploads(owner, uploads):
+    """
+    save_upload для пачки загрузок: Blob и File пишутся массовыми
+    запросами. bulk_create проходит мимо сигналов, поэтому их работу
+    делает files_created, та же, что у сигнала на один файл.
+    """
+    try:
+        with transaction.atomic():
+            quota.charge(owner.pk, sum(upload.size for upload in uploads))
+            blobs = register_blobs(uploads)
+            files = File.objects.bulk_create([
+                build_file(owner, upload.name, blob, upload.checksum)
+                for upload, blob in zip(uploads, blobs)
+            ])
+            files_created(owner.pk, files)
+    except Exception:
+        for upload in uploads:
+            default_storage.delete(upload.storage_name)
+        raise
+    return files
+
+
+def copy_blob(old_name, new_name):
+    """
+    Кладёт содержимое old_name под именем new_name. В локальном хранилище
+    это жёсткая ссылка, без копирования данных. У ссылки время изменения
+    обновляется: со старым временем find_orphan_blobs, пока новое имя не
+    записано в базу, счёл бы её давно брошенной.
+    """
+    try:
+        source = default_storage.path(old_name)
+        target = default_storage.path(new_name)
+    except NotImplementedError:
+        source = target = None
+    if source:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.link(source, target)
+        except OSError:
+            pass
+        else:
+            os.utime(target)
+            return new_name
+    with default_storage.open(old_name, 'rb') as content:
+        return default_storage.save(new_name, content)
@@ -1,6 +1,24 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import File as DjangoFile
+from django.core.files.storage import default_storage
 from django.core.mail import send_mail
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
 from celery import shared_task
 
+from . import activity, deletion, encryption, ingest, quota, stats, uploads
+from .models import IngestJob
+from .storage import blob_name, create_file, register_blob
+
+logger = logging.getLogger(__name__)
+
+# Как часто (в байтах) сохранять прогресс фоновой загрузки
+INGEST_PROGRESS_STEP = 8 * 1024 * 1024
+
 
 @shared_task
 def send_email_task(subject, message, from_email, recipient_list):
@@ -14,3 +32,123 @@ def send_email_task(subject, message, from_email, recipient_list):
         print(f"Error sending email: {e}")
         return False
 
+
+class _ProgressFile(DjangoFile):
+    """Отдаёт куски исходного файла и периодически пишет прогресс в задачу."""
+
+    def __init__(self, source, job):
+        super().__init__(source, job.name)
+        self.job = job
+
+    def chunks(self, chunk_size=None):
+        processed = reported = 0
+        for chunk in self.file.chunks(chunk_size):
+            processed += len(chunk)
+            if processed - reported >= INGEST_PROGRESS_STEP:
+                IngestJob.objects.filter(pk=self.job.pk).update(
+                    processed=processed, updated_at=timezone.now())
+                reported = processed
+            yield chunk
+
+
+@shared_task
+def ingest_file(job_id):
+    """
+    Шифрует файл, сохранённый во временное хранилище асинхронной загрузкой,
+    и создаёт для него File. Выполняется в отдельной очереди ``ingest``.
+    Зависшие задачи перезапускает recover_ingest_jobs.
+    """
+    updated = IngestJob.objects.filter(pk=job_id, status='pending').update(
+        status='processing', attempts=F('attempts') + 1,
+        updated_at=timezone.now())
+    if not updated:
+        return
+    job = IngestJob.objects.get(pk=job_id)
+
+    def still_ours():
+        # Пока шифровали, задачу могли перезапустить или пометить ошибкой
+        return IngestJob.objects.select_for_update().filter(
+            pk=job.pk, status='processing', attempts=job.attempts).exists()
+
+    path = None
+    try:
+        key = encryption.generate_key()
+        with ingest.staging_storage().open(job.staging_path, 'rb') as staged:
+            content = encryption.EncryptedContent(
+                _ProgressFile(staged, job), key)
+            path = default_storage.save(blob_name(), content)
+        with transaction.atomic():
+            if not still_ours():
+                logger.warning(f"Upload {job_id} was taken over, dropping attempt")
+                default_storage.delete(path)
+                return
+            blob = register_blob(
+                path, key, job.size, content.checksum, content.compression,
+                content.stored_size, content.compression_index)
+            job.file = create_file(job.owner, job.name, blob, content.checksum)
+            job.status = 'done'
+            job.processed = job.size
+            job.save(update_fields=['file', 'status', 'processed', 'updated_at'])
+    except Exception as e:
+        logger.error(f"Error ingesting upload {job_id}: {str(e)}", exc_info=True)
+        if path:
+            default_storage.delete(path)
+        with transaction.atomic():
+            if not still_ours():
+                return
+            job.status = 'failed'
+            job.error = str(e)
+            job.save(update_fields=['status', 'error', 'updated_at'])
+    ingest.discard(job.staging_path)
+
+
+@shared_task
+def reconcile_user_stats():
+    """Ночная сверка счётчиков дашборда с данными."""
+    fixed = stats.reconcile_user_stats()
+    logger.info(f"Reconciled user stats, fixed {fixed} rows")
+    return fixed
+
+
+@shared_task
+def reconcile_storage_usage():
+    """Ночная сверка UserProfile.storage_used с размерами файлов."""
+    fixed = quota.reconcile_storage_usage()
+    logger.info(f"Reconciled storage usage, fixed {fixed} profiles")
+    return fixed
+
+
+@shared_task
+def prune_activity_events():
+    """Ночная очистка ленты активности."""
+    deleted = activity.prune_activity()
+    logger.info(f"Pruned {deleted} activity events")
+    return deleted
+
+
+@shared_task
+def purge_deleted_files():
+    """
+    Окончательно удаляет файлы, помеченные удалёнными, и их содержимое в
+    хранилище. Запускается после каждого удаления и по расписанию.
+    """
+    purged = deletion.purge_deleted_files()
+    logger.info(f"Purged {purged} deleted files")
+    return purged
+
+
+@shared_task
+def expire_upload_sessions():
+    """Удаляет брошенные сессии возобновляемой загрузки и их части."""
+    expired = uploads.expire_sessions(
+        timedelta(hours=settings.UPLOAD_SESSION_MAX_AGE_HOURS))
+    logger.info(f"Expired {expired} upload sessions")
+    return expired
+
+
+@shared_task
+def recover_ingest_jobs():
+    """Перезапуск зависших фоновых загрузок и очистка временного хранилища."""
+    retried, failed = ingest.recover_jobs()
+    logger.info(f"Re-queued {retried} ingest jobs, failed {failed}")
+    return retried, failed
@@ -1,3 +1,1875 @@
-from django.test import TestCase
+import base64
+import hashlib
+import json
+import os
+import random
+import shutil
+import tempfile
+import uuid
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+from wsgiref.util import setup_testing_defaults
 
-# Create your tests here.
+from cryptography.fernet import Fernet, InvalidToken
+from django.contrib.auth.models import update_last_login
+from django.contrib.auth.signals import user_login_failed
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.db.models import Q
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http.multipartparser import MultiPartParser
+from django.core.servers.basehttp import get_internal_wsgi_application
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections
+from django.test import Client, TestCase, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.test import APIClient
+
+from . import (
+    batch_uploads, compression, deletion, downloads, encryption, hashing, ingest,
+    quota, uploads)
+from .authentication import tokens_for
+from .downloads import open_reader
+from .upload_handlers import EncryptingUploadHandler
+from .activity import prune_activity
+from .models import (
+    ActivityEvent, Blob, File, FileShare, IngestJob, UploadChunk, UploadSession,
+    User, UserProfile, UserStats)
+from .principals import get_role, is_manager, sees_all_files
+from .serializers import UserSerializer
+from .stats import get_user_stats, reconcile_user_stats
+from .storage import SHARDED_BLOB_RE
+from .tasks import ingest_file
+
+# Тесты не зависят от Redis: кэш в памяти процесса на весь модуль
+_local_cache = override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+})
+
+
+def setUpModule():
+    _local_cache.enable()
+
+
+def tearDownModule():
+    _local_cache.disable()
+
+
+def temp_dir(cleanup):
+    """Временный каталог, который удалит переданная функция очистки."""
+    path = tempfile.mkdtemp()
+    cleanup(shutil.rmtree, path, ignore_errors=True)
+    return path
+
+
+class StoredFilesMixin:
+    """
+    Свой MEDIA_ROOT на класс тестов, удаляемый после класса, и общие
+    помощники: загрузка через API и чтение расшифрованного содержимого.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.enterClassContext(
+            override_settings(MEDIA_ROOT=temp_dir(cls.addClassCleanup)))
+        super().setUpClass()
+
+    def isolate_media(self):
+        """Пустой MEDIA_ROOT на один тест — для проверок всего хранилища."""
+        self.enterContext(
+            override_settings(MEDIA_ROOT=temp_dir(self.addCleanup)))
+
+    def upload(self, data, name='a.bin', client=None):
+        response = (client or self.client).post('/api/files/', {
+            'file': SimpleUploadedFile(name, data)}, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        return File.objects.select_related('blob').get(pk=response.json()['id'])
+
+    def read(self, file_obj, start=0, stop=None):
+        with default_storage.open(file_obj.file.name, 'rb') as stored:
+            reader = open_reader(file_obj, stored)
+            return b''.join(reader.iter_range(
+                start, reader.size if stop is None else stop))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'EXPLAIN checks need PostgreSQL')
+class QueryPlanTests(TestCase):
+    """
+    Горячие запросы должны идти по индексам. На маленьком наборе данных
+    планировщик и так выбрал бы Seq Scan, поэтому он отключается, и план
+    проверяется на нужный индекс.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = User.objects.bulk_create(
+            User(username=f'user{i}', email=f'user{i}@example.com')
+            for i in range(20))
+        files = File.objects.bulk_create(
+            File(name=f'file{i}', file=f'encrypted_files/{i}',
+                 owner=cls.users[i % 20], encryption_key='key')
+            for i in range(1000))
+        now = timezone.now()
+        FileShare.objects.bulk_create(
+            FileShare(file=files[i], shared_with=cls.users[(i + 1) % 20],
+                      access_token=f'token{i}',
+                      downloaded=i % 3 == 0,
+                      downloaded_at=now if i % 3 == 0 else None)
+            for i in range(1000))
+        cls.user = cls.users[0]
+        cls.week_ago = now - timedelta(days=7)
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+        self.assertNotIn('Seq Scan', plan)
+
+    def test_file_listing(self):
+        self.assertUsesIndex(
+            File.objects.filter(owner=self.user).order_by('-created_at')[:20],
+            'file_owner_created_idx')
+
+    def test_all_files_keyset_page(self):
+        first = File.objects.order_by('-created_at', '-id')[500]
+        self.assertUsesIndex(
+            File.objects.filter(
+                Q(created_at__lt=first.created_at)
+                | Q(created_at=first.created_at, id__lt=first.id),
+                created_at__lte=first.created_at,
+            ).order_by('-created_at', '-id')[:50],
+            'file_created_idx')
+
+    def test_recent_shares(self):
+        self.assertUsesIndex(
+            FileShare.objects.filter(
+                file__owner=self.user, created_at__gte=self.week_ago,
+            ).order_by('-created_at')[:5],
+            'share_file_created_idx')
+
+    def test_recent_downloads(self):
+        self.assertUsesIndex(
+            FileShare.objects.filter(
+                file__owner=self.user, downloaded=True,
+                downloaded_at__gte=self.week_ago,
+            ).order_by('-downloaded_at')[:5],
+            'share_file_downloaded_idx')
+
+    def test_shared_with_listing(self):
+        self.assertUsesIndex(
+            FileShare.objects.filter(
+                shared_with=self.user).order_by('-created_at')[:20],
+            'share_recipient_created_idx')
+
+    def test_access_token_lookup(self):
+        self.assertUsesIndex(
+            FileShare.objects.filter(access_token='token1'),
+            'share_access_token_uniq')
+
+
+@override_settings(RESPONSE_CACHE_TIMEOUT=0)
+class QueryBudgetTests(StoredFilesMixin, TestCase):
+    """
+    Число запросов на список не должно зависеть от числа строк: каждый
+    эндпоинт проверяется на двух объёмах данных и против бюджета.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='owner', email='owner@example.com', password='pass')
+        UserProfile.objects.create(user=self.user, role='user')
+        self.staff = User.objects.create_user(
+            username='staff', email='staff@example.com', password='pass',
+            is_staff=True)
+        self.client = APIClient()
+        self._seeded = 0
+
+    def stored(self, name):
+        return default_storage.save(
+            f'encrypted_files/{name}', ContentFile(b'data'))
+
+    def seed(self, count):
+        for _ in range(count):
+            i = self._seeded = self._seeded + 1
+            other = User.objects.create_user(
+                username=f'other{i}', email=f'other{i}@example.com')
+            UserProfile.objects.create(user=other, role='manager')
+            mine = File.objects.create(
+                name=f'mine{i}', file=self.stored(f'mine{i}'),
+                owner=self.user, encryption_key='key')
+            theirs = File.objects.create(
+                name=f'theirs{i}', file=self.stored(f'theirs{i}'),
+                owner=other, encryption_key='key')
+            FileShare.objects.create(file=theirs, shared_with=self.user)
+            FileShare.objects.create(file=mine, shared_with=other)
+
+    def assertQueryBudget(self, user, url, budget):
+        self.client.force_authenticate(user)
+        self.seed(3)
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.seed(10)
+        with CaptureQueriesContext(connection) as large:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(len(small), len(large), large.captured_queries)
+        self.assertLessEqual(len(large), budget, large.captured_queries)
+
+    def test_files(self):
+        self.assertQueryBudget(self.user, '/api/files/', 2)
+
+    def test_files_staff(self):
+        self.assertQueryBudget(self.staff, '/api/files/', 1)
+
+    def test_shares(self):
+        self.assertQueryBudget(self.user, '/api/shares/', 1)
+
+    def test_users(self):
+        self.assertQueryBudget(self.staff, '/api/users/', 1)
+
+
+class CursorPaginationTests(TestCase):
+    """Курсорные страницы: без OFFSET, без пропусков и повторов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='owner', email='owner@example.com', password='pass')
+        cls.other = User.objects.create_user(
+            username='other', email='other@example.com', password='pass')
+        # Одинаковое время создания проверяет стабильность порядка по id
+        created = timezone.now()
+        cls.files = File.objects.bulk_create(
+            File(name=f'report{i}' if i % 2 else f'photo{i}',
+                 file=f'encrypted_files/{i}', owner=cls.user,
+                 encryption_key='key', created_at=created,
+                 is_encrypted=i % 5 != 0)
+            for i in range(25))
+        File.objects.update(created_at=created)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def collect(self, url):
+        names, pages = [], 0
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(any('OFFSET' in q['sql'] for q in queries))
+            names += [f['name'] for f in response.json()['results']]
+            url = response.json()['next']
+            pages += 1
+        return names, pages
+
+    def test_pages_cover_every_row_once(self):
+        names, pages = self.collect('/api/files/?page_size=7')
+        self.assertEqual(pages, 4)
+        expected = [f.name for f in sorted(
+            self.files, key=lambda f: f.pk, reverse=True)]
+        self.assertEqual(names, expected)
+
+    def test_filters(self):
+        names, _ = self.collect('/api/files/?name=report&is_encrypted=true')
+        self.assertTrue(names)
+        self.assertTrue(all(name.startswith('report') for name in names))
+        self.assertEqual(len(names), File.objects.filter(
+            name__startswith='report', is_encrypted=True).count())
+
+        today = timezone.localdate().isoformat()
+        names, _ = self.collect(f'/api/files/?created_before={today}')
+        self.assertEqual(len(names), 25)
+        names, _ = self.collect(f'/api/files/?created_after={today}')
+        self.assertEqual(len(names), 25)
+
+    def test_invalid_filter(self):
+        self.assertEqual(
+            self.client.get('/api/files/?created_after=yesterday').status_code, 400)
+        for owner in ('me', '²', '١', str(2 ** 63)):
+            self.assertEqual(self.client.get(
+                f'/api/files/?owner={owner}').status_code, 400, owner)
+        cursor = base64.urlsafe_b64encode(json.dumps(
+            {'p': timezone.now().isoformat(), 'id': 2 ** 63}).encode()).decode()
+        self.assertEqual(self.client.get(
+            f'/api/files/?cursor={cursor}').status_code, 404)
+
+    def test_invalid_page_size_falls_back(self):
+        for size in ('²', '-1', '0', '9' * 5000):
+            response = self.client.get(f'/api/files/?page_size={size}')
+            self.assertEqual(response.status_code, 200, size)
+            self.assertEqual(len(response.json()['results']), 25)
+        response = self.client.get(f'/api/files/?page_size={2 ** 62}')
+        self.assertEqual(len(response.json()['results']), 25)
+
+    def test_previous_link(self):
+        first = self.client.get('/api/files/?page_size=10').json()
+        second = self.client.get(first['next']).json()
+        back = self.client.get(second['previous']).json()
+        self.assertEqual(back['results'], first['results'])
+        self.assertIsNone(back['previous'])
+
+
+@override_settings(RESPONSE_CACHE_TIMEOUT=0)
+class UserStatsTests(TestCase):
+    """Счётчики дашборда идут вместе с данными и сверяются с ними."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='owner', email='owner@example.com', password='pass')
+        self.other = User.objects.create_user(
+            username='other', email='other@example.com', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def make_file(self, name, size):
+        return File.objects.create(
+            name=name, file=f'encrypted_files/{name}', owner=self.user,
+            encryption_key='key', size=size)
+
+    def dashboard(self):
+        response = self.client.get('/api/dashboard/stats/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_counters_follow_changes(self):
+        self.assertEqual(self.dashboard()['total_files'], 0)
+        first = self.make_file('a', 100)
+        second = self.make_file('b', 50)
+        share = FileShare.objects.create(file=first, shared_with=self.other)
+        FileShare.objects.create(file=second, shared_with=self.other)
+        share.mark_as_downloaded()
+        share.mark_as_downloaded()
+
+        data = self.dashboard()
+        self.assertEqual(
+            (data['total_files'], data['total_size'],
+             data['total_shared'], data['total_downloads']),
+            (2, 150, 2, 1))
+
+        first.delete()
+        data = self.dashboard()
+        self.assertEqual(
+            (data['total_files'], data['total_size'],
+             data['total_shared'], data['total_downloads']),
+            (1, 50, 1, 0))
+
+    def test_counters_do_not_go_negative(self):
+        # Файл создан, пока строка счётчиков считалась, и в неё не попал
+        file_obj = self.make_file('a', 100)
+        UserStats.objects.filter(pk=self.user.pk).delete()
+        UserStats.objects.create(user=self.user)
+        FileShare.objects.create(file=file_obj, shared_with=self.other)
+        UserStats.objects.filter(pk=self.user.pk).update(share_count=0)
+
+        file_obj.delete()
+        stats = UserStats.objects.get(pk=self.user.pk)
+        self.assertEqual((stats.file_count, stats.total_bytes, stats.share_count),
+                         (0, 0, 0))
+
+    def test_dashboard_cost_does_not_grow(self):
+        self.dashboard()
+        with CaptureQueriesContext(connection) as small:
+            self.dashboard()
+        for i in range(20):
+            FileShare.objects.create(
+                file=self.make_file(f'f{i}', 1), shared_with=self.other)
+        with CaptureQueriesContext(connection) as large:
+            self.dashboard()
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(
+            sum('file_sharing_userstats' in q['sql'] for q in large), 1)
+
+    def test_reconcile_repairs_drift(self):
+        self.make_file('a', 10)
+        self.dashboard()
+        UserStats.objects.filter(pk=self.user.pk).update(
+            file_count=7, total_bytes=0)
+        self.assertEqual(reconcile_user_stats(), 2)
+        stats = UserStats.objects.get(pk=self.user.pk)
+        self.assertEqual((stats.file_count, stats.total_bytes), (1, 10))
+        self.assertEqual(reconcile_user_stats(), 0)
+
+
+@override_settings(RESPONSE_CACHE_TIMEOUT=0)
+class ActivityEventTests(TestCase):
+    """Лента пишется при действиях и читается одним запросом."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='owner', email='owner@example.com', password='pass')
+        self.other = User.objects.create_user(
+            username='other', email='other@example.com', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_events_written_at_action(self):
+        file = File.objects.create(
+            name='report.pdf', file='encrypted_files/report', owner=self.user,
+            encryption_key='key')
+        share = FileShare.objects.create(file=file, shared_with=self.other)
+        share.mark_as_downloaded()
+        file.delete()
+
+        activities = self.client.get(
+            '/api/dashboard/stats/').json()['recent_activities']
+        self.assertEqual([a['type'] for a in activities],
+                         ['download', 'share', 'upload'])
+        self.assertEqual(activities[0]['description'],
+                         'Файл report.pdf скачан пользователем other')
+
+        history = self.client.get('/api/activity/?page_size=2').json()
+        self.assertEqual(len(history['results']), 2)
+        rest = self.client.get(history['next']).json()
+        self.assertEqual([e['type'] for e in rest['results']], ['upload'])
+
+    def test_feed_is_one_query(self):
+        for i in range(15):
+            File.objects.create(
+                name=f'f{i}', file=f'encrypted_files/{i}', owner=self.user,
+                encryption_key='key')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/dashboard/stats/')
+        self.assertEqual(
+            sum('file_sharing_activityevent' in q['sql'] for q in queries), 1)
+
+    @override_settings(ACTIVITY_RETENTION_DAYS=30,
+                       ACTIVITY_MAX_EVENTS_PER_USER=3)
+    def test_prune(self):
+        now = timezone.now()
+        ActivityEvent.objects.bulk_create(
+            ActivityEvent(user=self.user, event_type='upload',
+                          file_name=f'f{i}', timestamp=now)
+            for i in range(5))
+        ActivityEvent.objects.create(
+            user=self.other, event_type='upload', file_name='old',
+            timestamp=now - timedelta(days=31))
+        self.assertEqual(prune_activity(), 3)
+        self.assertEqual(
+            list(ActivityEvent.objects.order_by('id')
+                 .values_list('file_name', flat=True)),
+            ['f2', 'f3', 'f4'])
+
+
+class ResponseCacheTests(TestCase):
+    """
+    Повторное чтение — попадание в кэш без запросов к базе, пока запись
+    не увеличит поколение. Поколения меняются после коммита, поэтому
+    записи выполняются внутри captureOnCommitCallbacks.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(
+            username='owner', email='owner@example.com', password='pass')
+        self.recipient = User.objects.create_user(
+            username='recipient', email='recipient@example.com',
+            password='pass')
+        self.bystander = User.objects.create_user(
+            username='bystander', email='bystander@example.com',
+            password='pass')
+        self.file = File.objects.create(
+            name='a', file='encrypted_files/a', owner=self.owner,
+            encryption_key='key')
+
+    def get(self, user, url):
+        client = APIClient()
+        client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response['X-Cache'], len(queries)
+
+    def test_hit_until_write(self):
+        self.assertEqual(self.get(self.owner, '/api/files/')[0], 'MISS')
+        self.assertEqual(self.get(self.owner, '/api/files/'), ('HIT', 0))
+        self.assertEqual(self.get(self.owner, '/api/dashboard/stats/')[0], 'MISS')
+        self.get(self.recipient, '/api/shares/')
+        self.get(self.bystander, '/api/dashboard/stats/')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            FileShare.objects.create(file=self.file, shared_with=self.recipient)
+
+        self.assertEqual(self.get(self.owner, '/api/dashboard/stats/')[0], 'MISS')
+        self.assertEqual(self.get(self.recipient, '/api/shares/')[0], 'MISS')
+        self.assertEqual(self.get(self.bystander, '/api/dashboard/stats/')[0], 'HIT')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.file.name = 'b'
+            self.file.save()
+        self.assertEqual(self.get(self.owner, '/api/files/')[0], 'MISS')
+        self.assertEqual(self.get(self.recipient, '/api/shares/')[0], 'MISS')
+
+    def test_query_params_are_part_of_key(self):
+        self.get(self.owner, '/api/files/')
+        self.assertEqual(self.get(self.owner, '/api/files/?name=a')[0], 'MISS')
+
+    def test_login_does_not_invalidate(self):
+        self.get(self.owner, '/api/files/')
+        with self.captureOnCommitCallbacks(execute=True):
+            update_last_login(None, self.owner)
+        self.assertEqual(self.get(self.owner, '/api/files/')[0], 'HIT')
+
+    def test_user_change_reaches_only_related_lists(self):
+        FileShare.objects.create(file=self.file, shared_with=self.recipient)
+        self.get(self.owner, '/api/files/')
+        self.get(self.recipient, '/api/shares/')
+        self.get(self.bystander, '/api/files/')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.create_user(
+                username='newcomer', email='newcomer@example.com',
+                password='pass')
+        self.assertEqual(self.get(self.owner, '/api/files/')[0], 'HIT')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.owner.first_name = 'Owner'
+            self.owner.save()
+        self.assertEqual(self.get(self.owner, '/api/files/')[0], 'MISS')
+        self.assertEqual(self.get(self.recipient, '/api/shares/')[0], 'MISS')
+        self.assertEqual(self.get(self.bystander, '/api/files/')[0], 'HIT')
+
+
+class JWTAuthenticationTests(TestCase):
+    """API работает по JWT без чтения пользователя из базы."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='owner', email='owner@example.com', password='pass')
+        UserProfile.objects.create(user=self.user, role='manager')
+        self.client = APIClient()
+
+    def login(self, password='pass'):
+        response = self.client.post(
+            '/api/auth/login/', {'username': 'owner', 'password': password})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def get(self, url, access):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        return self.client.get(url)
+
+    def test_request_does_not_load_user(self):
+        access = self.login()['access']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get('/api/files/', access)
+        self.assertEqual(response.status_code, 200)
+        # Только сам список файлов: ни Token, ни User, ни профиля отдельно
+        self.assertEqual(len(queries), 1, queries.captured_queries)
+
+    def test_claims(self):
+        access = self.login()['access']
+        me = self.get('/api/users/me/', access).json()
+        self.assertEqual((me['username'], me['role']), ('owner', 'manager'))
+
+    def test_password_change_revokes_tokens(self):
+        old = self.login()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {old['access']}")
+        response = self.client.post('/api/users/change-password/', {
+            'current_password': 'pass', 'new_password': 'new-pass',
+            'confirm_password': 'new-pass'})
+        self.assertEqual(response.status_code, 200)
+        new = response.json()
+
+        # Без поправки на секунды iat: старые токены отклоняются, новые работают
+        self.assertEqual(self.get('/api/files/', old['access']).status_code, 401)
+        self.assertEqual(self.get('/api/files/', new['access']).status_code, 200)
+        self.client.credentials()
+        self.assertEqual(self.client.post(
+            '/api/token/refresh/', {'refresh': old['refresh']}).status_code, 401)
+        response = self.client.post(
+            '/api/token/refresh/', {'refresh': new['refresh']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get(
+            '/api/files/', response.json()['access']).status_code, 200)
+
+    def test_privilege_change_revokes_tokens(self):
+        changes = [
+            lambda user: setattr(user, 'is_staff', True),
+            lambda user: setattr(user.userprofile, 'role', 'user'),
+            lambda user: setattr(user, 'is_active', False),
+        ]
+        for change in changes:
+            access = self.login()['access']
+            user = User.objects.select_related('userprofile').get(pk=self.user.pk)
+            # Вход и правка имени права не меняют
+            update_last_login(None, user)
+            user.first_name = 'Name'
+            user.save()
+            self.assertEqual(self.get('/api/files/', access).status_code, 200)
+
+            change(user)
+            user.save()
+            user.userprofile.save()
+            self.assertEqual(self.get('/api/files/', access).status_code, 401)
+            self.client.credentials()
+
+    def test_deleted_user_cannot_refresh(self):
+        tokens = self.login()
+        self.user.delete()
+        self.client.credentials()
+        self.assertEqual(self.client.post(
+            '/api/token/refresh/', {'refresh': tokens['refresh']}).status_code, 401)
+
+
+class PrincipalTests(TestCase):
+    """Роли читаются один раз на запрос и пачкой на весь ответ."""
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(10):
+            user = User.objects.create_user(
+                username=f'user{i}', email=f'user{i}@example.com')
+            if i % 3:
+                UserProfile.objects.create(
+                    user=user, role='manager' if i % 2 else 'user')
+
+    def test_bulk_roles(self):
+        with self.assertNumQueries(2):
+            data = UserSerializer(User.objects.order_by('pk'), many=True).data
+        self.assertEqual(
+            [u['role'] for u in data],
+            [None, 'manager', 'user', None, 'user', 'manager', None,
+             'manager', 'user', None])
+
+    def test_role_memoized_on_requester(self):
+        user = User.objects.get(username='user1')
+        with self.assertNumQueries(1):
+            self.assertTrue(is_manager(user))
+            self.assertTrue(sees_all_files(user))
+            self.assertEqual(get_role(user), 'manager')
+        without_profile = User.objects.get(username='user0')
+        with self.assertNumQueries(1):
+            self.assertIsNone(get_role(without_profile))
+            self.assertFalse(sees_all_files(without_profile))
+
+
+class AsyncAuthViewTests(TestCase):
+    """Вход и регистрация: хеширование в пуле, переполнение — 503."""
+
+    def setUp(self):
+        self.client = APIClient()
+        User.objects.create_user(
+            username='owner', email='owner@example.com', password='pass')
+
+    def test_login_and_register(self):
+        response = self.client.post(
+            '/api/auth/login/', {'username': 'owner', 'password': 'pass'},
+            format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('refresh', response.json())
+        self.assertEqual(self.client.post(
+            '/api/auth/login/', {'username': 'owner', 'password': 'wrong'},
+            format='json').status_code, 401)
+        self.assertEqual(self.client.post(
+            '/api/auth/login/', {'username': 'nobody', 'password': 'pass'},
+            format='json').status_code, 401)
+
+        response = self.client.post('/api/auth/register/', {
+            'username': 'new', 'email': 'New@Example.com',
+            'password': 'secret', 'password_confirm': 'secret'}, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        user = User.objects.get(username='new')
+        self.assertTrue(user.check_password('secret'))
+        self.assertEqual(user.email, 'New@example.com')
+        self.assertEqual(user.userprofile.role, 'user')
+
+        self.assertEqual(self.client.post('/api/auth/register/', {
+            'username': 'new', 'email': 'other@example.com',
+            'password': 'secret', 'password_confirm': 'secret'},
+            format='json').status_code, 400)
+
+    def test_login_hashes_in_pool(self):
+        pool = hashing.HashingPool(1, 8)
+        with mock.patch.object(hashing, '_pool', pool):
+            self.assertEqual(self.client.post(
+                '/api/auth/login/', {'username': 'owner', 'password': 'pass'},
+                format='json').status_code, 200)
+        self.assertEqual(pool.metrics()['completed'], 1)
+
+    def test_failed_login_signal_and_inactive_user(self):
+        failed = []
+        user_login_failed.connect(
+            lambda sender, credentials, **kwargs: failed.append(credentials),
+            weak=False, dispatch_uid='test-login-failed')
+        self.addCleanup(user_login_failed.disconnect,
+                        dispatch_uid='test-login-failed')
+        self.assertEqual(self.client.post(
+            '/api/auth/login/', {'username': 'owner', 'password': 'wrong'},
+            format='json').status_code, 401)
+        self.assertEqual([c['username'] for c in failed], ['owner'])
+
+        User.objects.filter(username='owner').update(is_active=False)
+        self.assertEqual(self.client.post(
+            '/api/auth/login/', {'username': 'owner', 'password': 'pass'},
+            format='json').status_code, 401)
+
+    def test_overloaded_pool_rejects(self):
+        with mock.patch.object(hashing, '_pool', hashing.HashingPool(1, 0)):
+            response = self.client.post(
+                '/api/auth/login/', {'username': 'owner', 'password': 'pass'},
+                format='json')
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '1')
+            self.assertEqual(hashing.get_pool().metrics()['rejected'], 1)
+
+    def test_metrics_for_staff_only(self):
+        staff = User.objects.create_user(
+            username='staff', email='staff@example.com', is_staff=True)
+        self.client.force_authenticate(User.objects.get(username='owner'))
+        self.assertEqual(
+            self.client.get('/api/metrics/hashing/').status_code, 403)
+        self.client.force_authenticate(staff)
+        metrics = self.client.get('/api/metrics/hashing/').json()
+        self.assertIn('queue_wait', metrics)
+
+
+@override_settings(FILE_ENCRYPTION_CHUNK_SIZE=64, RESPONSE_CACHE_TIMEOUT=0)
+class WSGIStreamingTests(StoredFilesMixin, TestCase):
+    """
+    Через WSGI-приложение, которое запускает сервер (WSGI_APPLICATION):
+    загрузка шифруется, пока тело ещё читается, а скачивание отдаётся
+    по одному сегменту.
+    """
+
+    def setUp(self):
+        self.owner = User.objects.create_user(
+            username='owner', email='owner@example.com')
+        self.auth = f"Bearer {tokens_for(self.owner)['access']}"
+        self.application = get_internal_wsgi_application()
+        # Как в тестовом клиенте: иначе конец запроса закрыл бы соединение
+        # посреди транзакции теста
+        for signal in (request_started, request_finished):
+            signal.disconnect(close_old_connections)
+            self.addCleanup(signal.connect, close_old_connections)
+
+    def call(self, method, path, body=None, content_type=''):
+        body = body or BytesIO()
+        environ = {}
+        setup_testing_defaults(environ)
+        environ.update({
+            'REQUEST_METHOD': method, 'PATH_INFO': path,
+            'HTTP_HOST': 'testserver', 'HTTP_AUTHORIZATION': self.auth,
+            'CONTENT_TYPE': content_type,
+            'CONTENT_LENGTH': str(len(body.getvalue())),
+            'wsgi.input': body})
+        status = []
+        response = self.application(
+            environ, lambda code, response_headers, exc_info=None:
+            status.append(int(code.split()[0])))
+        self.addCleanup(response.close)
+        return status[0], response
+
+    def test_upload_and_download_stream(self):
+        data = os.urandom(512 * 1024)
+        body = BytesIO(encode_multipart(
+            BOUNDARY, {'file': SimpleUploadedFile('a.bin', data)}))
+        size = len(body.getvalue())
+        positions = []
+        receive = EncryptingUploadHandler.receive_data_chunk
+
+        def record(handler, raw_data, start):
+            positions.append(body.tell())
+            return receive(handler, raw_data, start)
+
+        with mock.patch.object(
+                EncryptingUploadHandler, 'receive_data_chunk', record):
+            status, response = self.call(
+                'POST', '/api/files/', body, MULTIPART_CONTENT)
+        self.assertEqual(status, 201, response.content)
+        # Первый кусок зашифрован, когда тело прочитано не до конца
+        self.assertLess(positions[0], size / 2)
+
+        file_id = json.loads(response.content)['id']
+        status, response = self.call('GET', f'/api/files/{file_id}/download/')
+        self.assertEqual(status, 200)
+        self.assertTrue(response.streaming)
+        self.assertFalse(response.is_async)
+        chunks = list(response)
+        self.assertLessEqual(max(map(len, chunks)), 64)
+        self.assertEqual(b''.join(chunks), data)
+
+
+@override_settings(FILE_ENCRYPTION_CHUNK_SIZE=64, RESPONSE_CACHE_TIMEOUT=0)
+class ShareDownloadTests(StoredFilesMixin, TestCase):
+    """Скачивание по токену шары и учёт скачиваний без чтения строки."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user(
+            username='owner', email='owner@example.com')
+        self.other = User.objects.create_user(
+            username='other', email='other@example.com')
+        client = APIClient()
+        client.force_authenticate(self.owner)
+        self.data = os.urandom(500)
+        self.file = self.upload(self.data, client=client)
+        self.share = FileShare.objects.create(
+            file=self.file, shared_with=self.other)
+        # Строка счётчиков уже есть: скачивание её только увеличивает
+        get_user_stats(self.owner)
+
+    def test_download_by_token(self):
+        client = Client()
+        url = f'/api/shares/download/{self.share.access_token}/'
+        for _ in range(2):
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                b''.join(response.streaming_content),
+                self.data)
+
+        share = FileShare.objects.get(pk=self.share.pk)
+        self.assertTrue(share.downloaded)
+        stats = UserStats.objects.get(pk=self.owner.pk)
+        self.assertEqual(stats.download_count, 1)
+        self.assertEqual(ActivityEvent.objects.filter(
+            event_type='download').count(), 1)
+        self.assertEqual(
+            client.get('/api/shares/download/missing/').status_code, 404)
+
+    def test_repeated_downloads_do_not_write(self):
+        self.assertEqual(len(self.share.access_token), 32)
+        self.share.mark_as_downloaded()
+        first = FileShare.objects.get(pk=self.share.pk).downloaded_at
+
+        share = FileShare.objects.select_related('file').get(pk=self.share.pk)
+        with CaptureQueriesContext(connection) as queries:
+            share.mark_as_downloaded()
+        self.assertEqual(len(queries), 2)
+        self.assertTrue(all(q['sql'].startswith('UPDATE') for q in queries))
+        self.assertEqual(FileShare.objects.get(pk=share.pk).downloaded_at, first)
+
+        FileShare.objects.filter(pk=share.pk).update(
+            downloaded_at=first - timedelta(minutes=5))
+        share.mark_as_downloaded()
+        self.assertGreaterEqual(
+            FileShare.objects.get(pk=share.pk).downloaded_at, first)
+        self.assertEqual(UserStats.objects.get(pk=self.owner.pk).download_count, 1)
+
+
+@override_settings(RESPONSE_CACHE_TIMEOUT=0)
+class BulkShareTests(TestCase):
+    """Много файлов многим получателям одним запросом."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user(
+            username='owner', email='owner@example.com')
+        self.stranger = User.objects.create_user(
+            username='stranger', email='stranger@example.com')
+        self.recipients = [
+            User.objects.create_user(username=f'r{i}', email=f'r{i}@example.com')
+            for i in range(3)]
+        self.files = [
+            File.objects.create(name=f'f{i}', file=f'encrypted_files/f{i}',
+                                owner=self.owner, encryption_key='key', size=1)
+            for i in range(4)]
+        self.foreign = File.objects.create(
+            name='x', file='encrypted_files/x', owner=self.stranger,
+            encryption_key='key', size=1)
+        FileShare.objects.create(file=self.files[0], shared_with=self.recipients[0])
+        get_user_stats(self.owner)
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def bulk_share(self, files, usernames):
+        return self.client.post('/api/files/bulk-share/', {
+            'files': files, 'usernames': usernames}, format='json')
+
+    def test_results_per_pair(self):
+        file_ids = [f.pk for f in self.files] + [self.foreign.pk]
+        usernames = [u.username for u in self.recipients] + ['nobody']
+        response = self.bulk_share(file_ids, usernames)
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()
+        self.assertEqual(data['created'], 11)
+        statuses = {(r['file'], r['username']): r['status']
+                    for r in data['results']}
+        self.assertEqual(len(statuses), 20)
+        self.assertEqual(statuses[self.files[0].pk, 'r0'], 'exists')
+        self.assertEqual(statuses[self.files[1].pk, 'r0'], 'created')
+        self.assertEqual(statuses[self.files[1].pk, 'nobody'], 'user_not_found')
+        self.assertEqual(statuses[self.foreign.pk, 'r1'], 'file_not_found')
+
+        self.assertEqual(FileShare.objects.count(), 12)
+        self.assertEqual(get_user_stats(self.owner).share_count, 12)
+        self.assertEqual(ActivityEvent.objects.filter(
+            user=self.owner, event_type='share').count(), 12)
+
+        # Повтор ничего не создаёт
+        self.assertEqual(self.bulk_share(file_ids, usernames).json()['created'], 0)
+        self.assertEqual(get_user_stats(self.owner).share_count, 12)
+
+    def test_staff_cannot_share_foreign_files(self):
+        staff = User.objects.create_user(
+            username='staff', email='staff@example.com', is_staff=True)
+        UserProfile.objects.create(user=staff, role='admin')
+        self.client.force_authenticate(staff)
+        response = self.client.post(
+            f'/api/files/{self.foreign.pk}/share/', {'username': 'r0'},
+            format='json')
+        self.assertEqual(response.status_code, 403)
+        response = self.bulk_share([self.foreign.pk], ['r0'])
+        self.assertEqual(response.json()['results'][0]['status'], 'file_not_found')
+        self.assertFalse(FileShare.objects.filter(file=self.foreign).exists())
+
+    def test_query_count_does_not_grow(self):
+        self.bulk_share([self.files[0].pk], ['r0'])
+        with CaptureQueriesContext(connection) as small:
+            self.bulk_share([self.files[1].pk], ['r1'])
+        with CaptureQueriesContext(connection) as large:
+            self.bulk_share([f.pk for f in self.files[2:]], ['r0', 'r1', 'r2'])
+        self.assertEqual(len(small), len(large))
+
+    def test_limits(self):
+        self.assertEqual(self.bulk_share([], ['r0']).status_code, 400)
+        self.assertEqual(self.bulk_share(
+            list(range(1000)), [f'u{i}' for i in range(11)]).status_code, 400)
+
+
+@override_settings(FILE_ENCRYPTION_CHUNK_SIZE=4096, RESPONSE_CACHE_TIMEOUT=0)
+class BatchUploadTests(StoredFilesMixin, TestCase):
+    """Много файлов одним запросом: шифрование в пуле, File одним INSERT."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='owner', email='owner@example.com')
+        get_user_stats(self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def batch_upload(self, contents):
+        return self.client.post('/api/files/batch-upload/', {'files': [
+            SimpleUploadedFile(f'f{i}.bin', data)
+            for i, data in enumerate(contents)]}, format='multipart')
+
+    def get_list(self):
+        response = self.client.get('/api/files/')
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_batch_upload(self):
+        same = b'same content' * 100
+        contents = [os.urandom(300 * 1024), same, b'', same, b'text ' * 5000]
+        # Маленький бюджет: разбор должен ждать пул, а не копить данные
+        with mock.patch.object(batch_uploads, 'MAX_PENDING_BYTES', 128 * 1024):
+            response = self.batch_upload(contents)
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual([item['name'] for item in response.json()],
+                         [f'f{i}.bin' for i in range(5)])
+
+        files = File.objects.filter(owner=self.user).select_related('blob')
+        by_name = {f.name: f for f in files}
+        for i, data in enumerate(contents):
+            file_obj = by_name[f'f{i}.bin']
+            self.assertEqual(file_obj.size, len(data))
+            self.assertEqual(self.read(file_obj), data)
+        self.assertEqual(by_name['f1.bin'].blob_id, by_name['f3.bin'].blob_id)
+        self.assertEqual(by_name['f1.bin'].blob.ref_count, 2)
+        self.assertEqual(by_name['f4.bin'].compression, 'zlib')
+
+        stats = get_user_stats(self.user)
+        self.assertEqual((stats.file_count, stats.total_bytes),
+                         (5, sum(map(len, contents))))
+        self.assertEqual(ActivityEvent.objects.filter(
+            user=self.user, event_type='upload').count(), 5)
+
+    def test_query_count_does_not_grow(self):
+        self.batch_upload([b'warm up'])
+        with CaptureQueriesContext(connection) as small:
+            self.batch_upload([b'a'])
+        with CaptureQueriesContext(connection) as large:
+            self.batch_upload([os.urandom(100) for _ in range(20)])
+        self.assertEqual(len(small), len(large))
+
+    def test_no_files(self):
+        self.assertEqual(self.client.post(
+            '/api/files/batch-upload/', {'name': 'x'},
+            format='multipart').status_code, 400)
+
+    def test_same_side_effects_as_single_upload(self):
+        def effects(upload):
+            before = get_user_stats(self.user)
+            self.get_list()
+            with self.captureOnCommitCallbacks(execute=True):
+                response = upload()
+            self.assertEqual(response.status_code, 201, response.content)
+            after = get_user_stats(self.user)
+            event = ActivityEvent.objects.filter(user=self.user).latest('pk')
+            return (after.file_count - before.file_count,
+                    after.total_bytes - before.total_bytes,
+                    event.event_type, event.file_name,
+                    self.get_list()['X-Cache'])
+
+        single = effects(lambda: self.client.post(
+            '/api/files/', {'file': SimpleUploadedFile('f0.bin', b'data')},
+            format='multipart'))
+        self.assertEqual(single, (1, 4, 'upload', 'f0.bin', 'MISS'))
+        self.assertEqual(effects(lambda: self.batch_upload([b'data'])), single)
+
+
+@override_settings(RESPONSE_CACHE_TIMEOUT=0)
+class FileDeletionTests(StoredFilesMixin, TestCase):
+    """Удаление помечает строки сразу, а хранилище чистит фоновая очистка."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user(
+            username='owner', email='owner@example.com')
+        self.other = User.objects.create_user(
+            username='other', email='other@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def test_bulk_delete_and_purge(self):
+        unique = self.upload(b'unique' * 100)
+        first = self.upload(b'shared' * 100)
+        second = self.upload(b'shared' * 100)
+        FileShare.objects.create(file=unique, shared_with=self.other)
+        other_client = APIClient()
+        other_client.force_authenticate(self.other)
+        foreign = self.upload(b'foreign', client=other_client)
+        get_user_stats(self.owner)
+        get_user_stats(self.other)
+
+        response = self.client.post('/api/files/bulk-delete/', {
+            'files': [unique.pk, first.pk, foreign.pk, 999999]}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(
+            [r['status'] for r in response.json()['results']],
+            ['deleted', 'deleted', 'not_found', 'not_found'])
+
+        # Сразу пропадают из списков и счётчиков, но хранилище не тронуто
+        listed = self.client.get('/api/files/').json()['results']
+        self.assertEqual([f['id'] for f in listed], [second.pk])
+        self.assertEqual(other_client.get('/api/shares/').json()['results'], [])
+        stats = get_user_stats(self.owner)
+        self.assertEqual((stats.file_count, stats.share_count), (1, 0))
+        self.assertTrue(default_storage.exists(unique.blob.file.name))
+
+        self.assertEqual(deletion.purge_deleted_files(batch_size=1), 2)
+        self.assertFalse(File.all_objects.filter(
+            pk__in=[unique.pk, first.pk]).exists())
+        self.assertFalse(FileShare.objects.exists())
+        self.assertFalse(default_storage.exists(unique.blob.file.name))
+        # Содержимое, на которое ещё ссылается живой файл, остаётся
+        second.blob.refresh_from_db()
+        self.assertEqual(second.blob.ref_count, 1)
+        self.assertTrue(default_storage.exists(second.blob.file.name))
+        self.assertEqual(reconcile_user_stats(), 0)
+
+    def test_destroy_is_soft(self):
+        file_obj = self.upload(b'data')
+        self.assertEqual(
+            self.client.delete(f'/api/files/{file_obj.pk}/').status_code, 204)
+        self.assertIsNotNone(File.all_objects.get(pk=file_obj.pk).deleted_at)
+        self.assertEqual(
+            self.client.delete(f'/api/files/{file_obj.pk}/').status_code, 404)
+
+    def test_find_orphan_blobs(self):
+        kept = self.upload(b'kept')
+        orphan = default_storage.save('encrypted_files/ab/cd/orphan', ContentFile(b'x'))
+        fresh = default_storage.save('encrypted_files/fresh', ContentFile(b'x'))
+        old = timezone.now().timestamp() - 2 * 24 * 3600
+        for name in (orphan, kept.file.name):
+            os.utime(default_storage.path(name), (old, old))
+
+        out = StringIO()
+        call_command('find_orphan_blobs', stdout=out)
+        self.assertEqual(out.getvalue().splitlines()[0], orphan)
+        call_command('find_orphan_blobs', '--delete', stdout=StringIO())
+        self.assertFalse(default_storage.exists(orphan))
+        self.assertTrue(default_storage.exists(fresh))
+        self.assertTrue(default_storage.exists(kept.file.name))
+
+    def test_find_orphan_blobs_rechecks_before_delete(self):
+        kept = self.upload(b'kept')
+        old = timezone.now().timestamp() - 2 * 24 * 3600
+        os.utime(default_storage.path(kept.file.name), (old, old))
+        # Ссылка появилась уже после чтения имён из базы
+        with mock.patch(
+                'file_sharing.management.commands.find_orphan_blobs'
+                '.iter_referenced', return_value=iter([])):
+            call_command('find_orphan_blobs', '--delete', stdout=StringIO())
+        self.assertTrue(default_storage.exists(kept.file.name))
+
+
+@override_settings(RESPONSE_CACHE_TIMEOUT=0)
+class StorageQuotaTests(StoredFilesMixin, TestCase):
+    """Квота: проверка до приёма тела и учёт storage_used одним UPDATE."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='owner', email='owner@example.com')
+        self.profile = UserProfile.objects.create(
+            user=self.user, storage_limit=10000)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def used(self):
+        self.profile.refresh_from_db()
+        return self.profile.storage_used
+
+    def post_file(self, data):
+        return self.client.post('/api/files/', {
+            'file': SimpleUploadedFile('a.bin', data)}, format='multipart')
+
+    def test_usage_follows_uploads_and_deletes(self):
+        response = self.post_file(b'x' * 3000)
+        self.assertEqual(response.status_code, 201, response.content)
+        file_id = response.json()['id']
+        response = self.client.post('/api/files/batch-upload/', {'files': [
+            SimpleUploadedFile('b.bin', b'y' * 1000),
+            SimpleUploadedFile('c.bin', b'z' * 500)]}, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(self.used(), 4500)
+
+        self.client.delete(f'/api/files/{file_id}/')
+        self.assertEqual(self.used(), 1500)
+        deletion.purge_deleted_files()
+        File.objects.get(name='b.bin').delete()
+        self.assertEqual(self.used(), 500)
+        self.assertEqual(quota.reconcile_storage_usage(), 0)
+
+    def test_rejected_before_encryption(self):
+        self.profile.storage_used = 9000
+        self.profile.save()
+        with mock.patch('file_sharing.upload_handlers.create_blob') as create:
+            response = self.post_file(os.urandom(200 * 1024))
+        self.assertEqual(response.status_code, 413, response.content)
+        self.assertEqual(response.json()['storage_used'], 9000)
+        create.assert_not_called()
+        self.assertFalse(File.objects.exists())
+
+    def test_charge_cannot_exceed_limit(self):
+        # Заявленный размер помещается, фактический — нет
+        self.profile.storage_used = 9500
+        self.profile.save()
+        response = self.post_file(b'x' * 1000)
+        self.assertEqual(response.status_code, 413, response.content)
+        self.assertEqual(self.used(), 9500)
+        self.assertFalse(File.objects.exists())
+        self.assertEqual([files for _, _, files in os.walk(os.path.join(
+            default_storage.location, 'encrypted_files')) if files], [])
+
+        with self.assertRaises(quota.QuotaExceeded):
+            quota.charge(self.user.pk, 501)
+        quota.charge(self.user.pk, 500)
+        self.assertEqual(self.used(), 10000)
+
+    def test_upload_session_checks_size(self):
+        response = self.client.post(
+            '/api/upload-sessions/', {'name': 'big.bin', 'size': 20000}, format='json')
+        self.assertEqual(response.status_code, 413, response.content)
+
+    def test_reconcile_fixes_drift(self):
+        self.post_file(b'x' * 100)
+        UserProfile.objects.filter(pk=self.profile.pk).update(storage_used=7)
+        self.assertEqual(quota.reconcile_storage_usage(batch_size=1), 1)
+        self.assertEqual(self.used(), 100)
+
+
+class EncryptionContainerTests(TestCase):
+    """Сегментированный контейнер AES-GCM и чтение старых Fernet-файлов."""
+    CHUNK = 64
+
+    def setUp(self):
+        self.key = encryption.generate_key()
+
+    def encrypt(self, data, pieces=7):
+        # Кусками, не совпадающими с сегментами
+        chunks = [data[i:i + pieces] for i in range(0, len(data), pieces)]
+        return b''.join(encryption.encrypt_stream(self.key, chunks, self.CHUNK))
+
+    def segments(self, container):
+        body = container[encryption.HEADER_SIZE:]
+        size = self.CHUNK + encryption.TAG_SIZE
+        return container[:encryption.HEADER_SIZE], [
+            body[i:i + size] for i in range(0, len(body), size)]
+
+    def test_round_trip_at_segment_boundaries(self):
+        for length in (0, 1, self.CHUNK - 1, self.CHUNK, self.CHUNK + 1,
+                       3 * self.CHUNK, 3 * self.CHUNK + 5):
+            data = os.urandom(length)
+            container = self.encrypt(data)
+            self.assertEqual(
+                len(container), encryption.encrypted_size(length, self.CHUNK))
+            self.assertEqual(encryption.plaintext_size(
+                len(container), self.CHUNK), length)
+            self.assertEqual(encryption.decrypt(container, self.key), data)
+
+            reader = encryption.ContainerReader(
+                ContentFile(container), self.key, len(container))
+            for start, stop in ((0, length), (self.CHUNK - 1, self.CHUNK + 1),
+                                (self.CHUNK, 2 * self.CHUNK), (length - 1, length)):
+                start, stop = max(start, 0), min(stop, length)
+                self.assertEqual(
+                    b''.join(reader.iter_range(start, stop)), data[start:stop])
+
+    def test_truncation_is_detected(self):
+        header, segments = self.segments(self.encrypt(os.urandom(3 * self.CHUNK)))
+        with self.assertRaises(InvalidToken):
+            encryption.decrypt(header + b''.join(segments[:-1]), self.key)
+        with self.assertRaises(InvalidToken):
+            encryption.decrypt(header + segments[0][:-1], self.key)
+
+    def test_reordering_is_detected(self):
+        header, segments = self.segments(self.encrypt(os.urandom(3 * self.CHUNK)))
+        segments[0], segments[1] = segments[1], segments[0]
+        with self.assertRaises(InvalidToken):
+            encryption.decrypt(header + b''.join(segments), self.key)
+
+    def test_final_flag_is_authenticated(self):
+        encryptor = encryption.StreamEncryptor(self.key, self.CHUNK)
+        data = os.urandom(self.CHUNK)
+        # Последний сегмент без флага: так выглядит обрезанный файл
+        container = encryptor.header + encryptor.encrypt_segment(
+            0, data, final=False)
+        with self.assertRaises(InvalidToken):
+            encryption.decrypt(container, self.key)
+        container = encryptor.header + encryptor.encrypt_segment(
+            0, data, final=True)
+        self.assertEqual(encryption.decrypt(container, self.key), data)
+
+    def test_header_is_authenticated(self):
+        container = bytearray(self.encrypt(b'data'))
+        container[encryption.HEADER_SIZE - 1] ^= 1
+        with self.assertRaises(InvalidToken):
+            encryption.decrypt(bytes(container), self.key)
+
+    def test_legacy_fernet(self):
+        token = Fernet(self.key.encode()).encrypt(b'legacy content')
+        self.assertFalse(encryption.is_container(token))
+        self.assertEqual(encryption.decrypt(token, self.key), b'legacy content')
+
+
+@override_settings(FILE_ENCRYPTION_CHUNK_SIZE=64)
+class FileDownloadTests(StoredFilesMixin, TestCase):
+    """Скачивание расшифровывается потоком и отдаёт заголовки кэширования."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='owner', email='owner@example.com')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+        self.client = Client()
+        self.auth = {'Authorization': f"Bearer {tokens_for(self.user)['access']}"}
+
+    def get(self, file_obj, **headers):
+        return self.client.get(
+            f'/api/files/{file_obj.pk}/download/',
+            headers={**self.auth, **headers})
+
+    def body(self, response):
+        self.assertTrue(response.streaming)
+        self.assertFalse(response.is_async)
+        return b''.join(response.streaming_content)
+
+    def test_streamed_content_and_headers(self):
+        data = os.urandom(1000)
+        file_obj = self.upload(data, client=self.api)
+        response = self.get(file_obj)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), data)
+        self.assertEqual(int(response['Content-Length']), len(data))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['ETag'], downloads._etag(file_obj))
+        self.assertEqual(
+            response['Last-Modified'],
+            http_date(file_obj.updated_at.timestamp()))
+        self.assertEqual(
+            response['Content-Disposition'], 'attachment; filename="a.bin"')
+
+    def test_empty_file(self):
+        file_obj = self.upload(b'', client=self.api)
+        response = self.get(file_obj)
+        self.assertEqual(int(response['Content-Length']), 0)
+        self.assertEqual(self.body(response), b'')
+
+    def test_legacy_fernet_file(self):
+        file_obj = self.upload(b'x', client=self.api)
+        token = Fernet(file_obj.encryption_key.encode()).encrypt(b'legacy')
+        default_storage.delete(file_obj.file.name)
+        default_storage.save(
+            file_obj.file.name, ContentFile(token))
+        response = self.get(file_obj)
+        self.assertEqual(int(response['Content-Length']), 6)
+        self.assertEqual(self.body(response), b'legacy')
+
+    def test_parse_range_header(self):
+        parse = downloads.parse_range_header
+        self.assertEqual(parse('bytes=0-9', 100), [(0, 10)])
+        self.assertEqual(parse('bytes=90-', 100), [(90, 100)])
+        self.assertEqual(parse('bytes=-10', 100), [(90, 100)])
+        self.assertEqual(parse('bytes=-500', 100), [(0, 100)])
+        self.assertEqual(parse('bytes=0-0, 50-999', 100), [(0, 1), (50, 100)])
+        self.assertEqual(parse('bytes=100-', 100), [])
+        for header in ('bytes=²-', 'bytes=-²', 'bytes=١-٢', 'bytes=5-1',
+                       'bytes=a-b', 'bytes=-', 'items=0-1'):
+            self.assertIsNone(parse(header, 100), header)
+
+    def test_ranges(self):
+        data = os.urandom(1000)
+        file_obj = self.upload(data, client=self.api)
+
+        # Через границу сегментов
+        response = self.get(file_obj, Range='bytes=60-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 60-199/1000')
+        self.assertEqual(int(response['Content-Length']), 140)
+        self.assertEqual(self.body(response), data[60:200])
+
+        response = self.get(file_obj, Range='bytes=-100')
+        self.assertEqual(response['Content-Range'], 'bytes 900-999/1000')
+        self.assertEqual(self.body(response), data[900:])
+
+        response = self.get(file_obj, Range='bytes=0-9,500-509')
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(
+            response['Content-Type'].startswith('multipart/byteranges'))
+        body = self.body(response)
+        self.assertEqual(int(response['Content-Length']), len(body))
+        self.assertIn(b'Content-Range: bytes 0-9/1000\r\n\r\n' + data[:10], body)
+        self.assertIn(
+            b'Content-Range: bytes 500-509/1000\r\n\r\n' + data[500:510], body)
+
+        response = self.get(file_obj, Range='bytes=1000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1000')
+
+        # Непонятный заголовок игнорируется, а не роняет запрос
+        response = self.get(file_obj, Range='bytes=²-')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), data)
+
+    def test_if_range(self):
+        data = os.urandom(300)
+        file_obj = self.upload(data, client=self.api)
+        etag = downloads._etag(file_obj)
+
+        response = self.get(file_obj, Range='bytes=100-', **{'If-Range': etag})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.body(response), data[100:])
+
+        # Файл изменился: вместо диапазона отдаётся весь файл
+        for stale in ('"0-0"', f'W/{etag}',
+                      http_date(file_obj.updated_at.timestamp() - 60)):
+            response = self.get(
+                file_obj, Range='bytes=100-', **{'If-Range': stale})
+            self.assertEqual(response.status_code, 200, stale)
+            self.assertEqual(self.body(response), data)
+
+
+@override_settings(FILE_ENCRYPTION_CHUNK_SIZE=64, RESPONSE_CACHE_TIMEOUT=0)
+class UploadSessionTests(StoredFilesMixin, TestCase):
+    """Возобновляемая загрузка: части, повторная отправка, завершение."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='owner', email='owner@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.data = os.urandom(150)
+
+    def create_session(self, size=None):
+        response = self.client.post('/api/upload-sessions/', {
+            'name': 'a.bin', 'size': len(self.data) if size is None else size,
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()['chunk_count'], 3)
+        return UploadSession.objects.get(pk=response.json()['id'])
+
+    def put(self, session, index, data=None):
+        if data is None:
+            data = self.data[index * 64:(index + 1) * 64]
+        return self.client.put(
+            f'/api/upload-sessions/{session.pk}/chunks/{index}/', data,
+            content_type='application/octet-stream')
+
+    def finalize(self, session):
+        return self.client.post(f'/api/upload-sessions/{session.pk}/finalize/')
+
+    def test_chunks_in_any_order(self):
+        session = self.create_session()
+        for index in (2, 0):
+            self.assertEqual(self.put(session, index).status_code, 200)
+        response = self.finalize(session)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['missing_chunks'], [1])
+        self.assertEqual(self.client.get(
+            f'/api/upload-sessions/{session.pk}/').json()['received_chunks'],
+            [0, 2])
+
+        self.assertEqual(self.put(session, 1).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.finalize(session)
+        self.assertEqual(response.status_code, 201, response.content)
+        file_obj = File.objects.select_related('blob').get(
+            pk=response.json()['id'])
+        self.assertEqual(self.read(file_obj), self.data)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(default_storage.listdir(
+            os.path.join(uploads.STAGING_DIR, str(session.pk))), ([], []))
+
+    def test_concurrent_finalize(self):
+        session = self.create_session()
+        for index in range(3):
+            self.put(session, index)
+
+        class Raced(uploads._AssembledContent):
+            def chunks(self, chunk_size=None):
+                # Другой запрос завершил сессию, пока эта склеивала части
+                for path in session.chunks.values_list('path', flat=True):
+                    default_storage.delete(path)
+                UploadSession.objects.filter(pk=session.pk).delete()
+                yield from super().chunks(chunk_size)
+
+        def blobs():
+            return {name for _, _, names in os.walk(default_storage.path(''))
+                    for name in names}
+
+        before = blobs()
+        with mock.patch.object(uploads, '_AssembledContent', Raced):
+            response = self.finalize(session)
+        self.assertEqual(response.status_code, 409, response.content)
+        self.assertFalse(File.objects.exists())
+        # Недописанный файл удалён
+        self.assertEqual(blobs(), before - {'0', '1', '2'})
+
+    def test_invalid_chunks(self):
+        session = self.create_session()
+        self.assertEqual(self.put(session, 3, b'x').status_code, 400)
+        self.assertEqual(self.put(session, 0, b'short').status_code, 400)
+        # Последняя часть короче остальных
+        self.assertEqual(self.put(session, 2, b'x' * 64).status_code, 400)
+        self.assertFalse(UploadChunk.objects.exists())
+
+    def test_resend(self):
+        session = self.create_session()
+        self.assertEqual(self.put(session, 0).status_code, 200)
+        path = UploadChunk.objects.get().path
+        with default_storage.open(path, 'rb') as stored:
+            stored_segment = stored.read()
+
+        # Та же часть ещё раз — не ошибка
+        self.assertEqual(self.put(session, 0).status_code, 200)
+        # Другие данные под тем же nonce не принимаются
+        self.assertEqual(self.put(session, 0, os.urandom(64)).status_code, 409)
+        self.assertEqual(UploadChunk.objects.get().path, path)
+        with default_storage.open(path, 'rb') as stored:
+            self.assertEqual(stored.read(), stored_segment)
+        self.assertEqual(len(default_storage.listdir(
+            os.path.join(uploads.STAGING_DIR, str(session.pk)))[1]), 1)
+
+    def test_concurrent_resend(self):
+        session = self.create_session()
+        self.put(session, 0)
+        # Параллельный запрос не увидел первую часть и упёрся в уникальность
+        with mock.patch.object(uploads, '_find_chunk', side_effect=[
+                None, UploadChunk.objects.get()]):
+            chunk = uploads.store_chunk(session, 0, self.data[:64])
+        self.assertEqual(chunk, UploadChunk.objects.get())
+        self.assertEqual(len(default_storage.listdir(
+            os.path.join(uploads.STAGING_DIR, str(session.pk)))[1]), 1)
+        with mock.patch.object(uploads, '_find_chunk', side_effect=[
+                None, UploadChunk.objects.get()]):
+            with self.assertRaises(uploads.ChunkConflict):
+                uploads.store_chunk(session, 0, os.urandom(64))
+
+    def test_expire_sessions(self):
+        fresh, old = self.create_session(), self.create_session()
+        self.put(fresh, 0)
+        self.put(old, 0)
+        UploadSession.objects.filter(pk=old.pk).update(
+            updated_at=timezone.now() - timedelta(days=2))
+        stray = os.path.join(uploads.STAGING_DIR, str(uuid.uuid4()), '0')
+        default_storage.save(stray, ContentFile(b'x'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(uploads.expire_sessions(timedelta(days=1)), 1)
+        self.assertEqual(
+            list(UploadSession.objects.values_list('pk', flat=True)), [fresh.pk])
+        self.assertEqual(default_storage.listdir(uploads.STAGING_DIR)[0],
+                         [str(fresh.pk)])
+
+
+@override_settings(FILE_ENCRYPTION_CHUNK_SIZE=64, FILE_COMPRESSION=None)
+class EncryptingUploadHandlerTests(StoredFilesMixin, TestCase):
+    """Шифрование при разборе multipart: без временных файлов и мусора."""
+    BOUNDARY = 'BoUnDaRy'
+
+    def body(self, *parts):
+        lines = []
+        for field, name, data in parts:
+            lines.append(
+                f'--{self.BOUNDARY}\r\nContent-Disposition: form-data; '
+                f'name="{field}"; filename="{name}"\r\n'
+                f'Content-Type: application/octet-stream\r\n\r\n'.encode()
+                + data + b'\r\n')
+        lines.append(f'--{self.BOUNDARY}--\r\n'.encode())
+        return b''.join(lines)
+
+    def parse(self, body, stream=None):
+        handler = EncryptingUploadHandler()
+        parser = MultiPartParser({
+            'CONTENT_TYPE': f'multipart/form-data; boundary={self.BOUNDARY}',
+            'CONTENT_LENGTH': str(len(body)),
+        }, stream or ContentFile(body), [handler])
+        return handler, parser
+
+    def stored(self):
+        root = os.path.join(default_storage.location, 'encrypted_files')
+        return [name for _, _, files in os.walk(root) for name in files]
+
+    def test_round_trip_without_temp_files(self):
+        data = os.urandom(1000)
+        # Обычный обработчик уже записал бы такой файл во временный
+        with override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=1), \
+                mock.patch('tempfile.NamedTemporaryFile') as temporary:
+            _, files = self.parse(self.body(('file', 'a.bin', data)))[1].parse()
+        temporary.assert_not_called()
+
+        uploaded = files['file']
+        self.assertEqual((uploaded.name, uploaded.size), ('a.bin', 1000))
+        self.assertEqual(uploaded.checksum, hashlib.sha256(data).hexdigest())
+        with default_storage.open(uploaded.storage_name, 'rb') as stored:
+            container = stored.read()
+        self.assertEqual(len(container), uploaded.stored_size)
+        self.assertEqual(
+            encryption.decrypt(container, uploaded.encryption_key), data)
+
+    def test_disconnect_is_cleaned_up(self):
+        body = self.body(('file', 'a.bin', os.urandom(100 * 1024)))
+
+        class Disconnecting(ContentFile):
+            def read(self, size=-1):
+                if self.tell() > 50 * 1024:
+                    raise OSError('client disconnected')
+                return super().read(size)
+
+        handler, parser = self.parse(body, Disconnecting(body))
+        with self.assertRaises(OSError):
+            parser.parse()
+        self.assertEqual(len(self.stored()), 1)
+        handler.discard()
+        self.assertEqual(self.stored(), [])
+
+    def test_extra_file_parts_are_rejected(self):
+        user = User.objects.create_user(
+            username='owner', email='owner@example.com')
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.post(
+            '/api/files/',
+            self.body(('file', 'a.bin', b'first'), ('file', 'b.bin', b'second')),
+            content_type=f'multipart/form-data; boundary={self.BOUNDARY}')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Only one file', response.json()['error'])
+        self.assertEqual(self.stored(), [])
+        self.assertFalse(File.objects.exists())
+
+
+@override_settings(RESPONSE_CACHE_TIMEOUT=0)
+class BlobDeduplicationTests(StoredFilesMixin, TestCase):
+    """Одинаковое содержимое хранится один раз, пока на него есть ссылки."""
+
+    def setUp(self):
+        self.isolate_media()
+        self.owner = User.objects.create_user(
+            username='owner', email='owner@example.com')
+        self.other = User.objects.create_user(
+            username='other', email='other@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def stored(self):
+        return [os.path.join(path, name)
+                for path, _, files in os.walk(default_storage.location)
+                for name in files]
+
+    def precheck(self, data, client=None):
+        return (client or self.client).post('/api/files/precheck/', {
+            'name': 'copy.bin', 'sha256': hashlib.sha256(data).hexdigest(),
+        }, format='json')
+
+    def test_reference_counting(self):
+        data = os.urandom(500)
+        with self.captureOnCommitCallbacks(execute=True):
+            first, second = self.upload(data), self.upload(data)
+        blob = Blob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual((first.blob_id, second.blob_id), (blob.pk, blob.pk))
+        # Вторая копия шифртекста удалена после коммита
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertEqual(self.stored(), [default_storage.path(blob.file.name)])
+
+        first.delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 1)
+        self.assertTrue(default_storage.exists(blob.file.name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(Blob.objects.exists())
+        self.assertEqual(self.stored(), [])
+
+    def test_precheck(self):
+        data = os.urandom(500)
+        self.assertEqual(self.precheck(data).json(), {'exists': False})
+
+        original = self.upload(data)
+        response = self.precheck(data)
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertTrue(response.json()['exists'])
+        copy = File.objects.get(pk=response.json()['file']['id'])
+        self.assertEqual((copy.name, copy.blob_id), ('copy.bin', original.blob_id))
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+
+        # Чужое содержимое по одному хешу не выдаётся
+        other_client = APIClient()
+        other_client.force_authenticate(self.other)
+        self.assertEqual(self.precheck(data, other_client).json(), {'exists': False})
+        FileShare.objects.create(file=original, shared_with=self.other)
+        self.assertEqual(
+            self.precheck(data, other_client).status_code, 201)
+        self.assertEqual(Blob.objects.get().ref_count, 3)
+
+        self.assertEqual(self.client.post('/api/files/precheck/', {
+            'name': 'x', 'sha256': 'not a hash'}, format='json').status_code, 400)
+
+
+@override_settings(FILE_ENCRYPTION_CHUNK_SIZE=1024, RESPONSE_CACHE_TIMEOUT=0)
+class CompressionTests(StoredFilesMixin, TestCase):
+    """Сжатие окнами: диапазон распаковывается со своего окна."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='owner', email='owner@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        words = [b'alpha', b'beta', b'gamma', b'delta', b'epsilon']
+        rng = random.Random(1)
+        self.text = b' '.join(rng.choice(words) for _ in range(4000))
+
+    def test_round_trip(self):
+        for codec in ('zlib', 'lzma'):
+            with override_settings(FILE_COMPRESSION=codec):
+                file_obj = self.upload(self.text)
+            self.assertEqual(file_obj.compression, codec)
+            self.assertLess(file_obj.stored_size, len(self.text) // 2)
+            window, lengths = compression.unpack_index(
+                file_obj.blob.compression_index)
+            self.assertEqual(window, 1024)
+            self.assertEqual(len(lengths), -(-len(self.text) // 1024))
+            self.assertEqual(self.read(file_obj), self.text)
+            File.objects.all().delete()
+
+    def test_incompressible_data_is_stored_raw(self):
+        for data in (os.urandom(5000), b'\x89PNG' + b'\0' * 5000):
+            file_obj = self.upload(data)
+            self.assertEqual(file_obj.compression, '')
+            self.assertIsNone(file_obj.blob.compression_index)
+            self.assertEqual(self.read(file_obj), data)
+
+    def test_ranges_read_only_their_windows(self):
+        file_obj = self.upload(self.text)
+        size = len(self.text)
+        read = []
+        original = encryption.ContainerReader.iter_range
+
+        def spy(reader, start, stop):
+            read.append((start, stop))
+            return original(reader, start, stop)
+
+        with mock.patch.object(encryption.ContainerReader, 'iter_range', spy):
+            for start, stop in ((0, 10), (1000, 1100), (3000, 5000),
+                                (size - 10, size), (0, size)):
+                self.assertEqual(
+                    self.read(file_obj, start, stop), self.text[start:stop])
+        _, lengths = compression.unpack_index(file_obj.blob.compression_index)
+        # Суффикс читается с начала последнего окна, а не с начала файла
+        self.assertEqual(read[3], (sum(lengths[:-1]), sum(lengths)))
+        self.assertEqual(read[1], (0, sum(lengths[:2])))
+        self.assertEqual(read[2], (sum(lengths[:2]), sum(lengths[:5])))
+
+    def test_file_without_index(self):
+        # Сжатые одним потоком файлы читаются с начала, как раньше
+        file_obj = self.upload(self.text)
+        Blob.objects.update(compression_index=None)
+        file_obj = File.objects.select_related('blob').get(pk=file_obj.pk)
+        self.assertEqual(self.read(file_obj, 5000, 6000), self.text[5000:6000])
+
+
+@override_settings(RESPONSE_CACHE_TIMEOUT=0, INGEST_STALE_MINUTES=30, INGEST_MAX_ATTEMPTS=3, INGEST_MAX_AGE_HOURS=24)
+class IngestTests(StoredFilesMixin, TestCase):
+    """Фоновая загрузка: открытый текст вне MEDIA_ROOT, зависшие задачи."""
+
+    def setUp(self):
+        self.enterContext(
+            override_settings(FILE_STAGING_ROOT=temp_dir(self.addCleanup)))
+        self.user = User.objects.create_user(
+            username='owner', email='owner@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.delay = self.enterContext(
+            mock.patch('file_sharing.tasks.ingest_file.delay'))
+
+    def queue(self, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/ingest/', {
+                'file': SimpleUploadedFile('a.bin', data)}, format='multipart')
+        self.assertEqual(response.status_code, 202, response.content)
+        return IngestJob.objects.get(pk=response.json()['id'])
+
+    def staged(self):
+        return sorted(os.listdir(settings.FILE_STAGING_ROOT))
+
+    def age(self, job, minutes):
+        IngestJob.objects.filter(pk=job.pk).update(
+            updated_at=timezone.now() - timedelta(minutes=minutes))
+
+    def test_ingest(self):
+        data = os.urandom(1000)
+        job = self.queue(data)
+        self.delay.assert_called_once_with(str(job.pk))
+        # Имя во временном хранилище не выдаёт id задачи
+        self.assertEqual(self.staged(), [job.staging_path])
+        self.assertNotIn(job.pk.hex, job.staging_path)
+        self.assertFalse(os.path.exists(
+            os.path.join(settings.MEDIA_ROOT, 'upload_staging')))
+
+        ingest_file(str(job.pk))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.processed),
+                         ('done', 1, 1000))
+        with default_storage.open(job.file.file.name, 'rb') as stored:
+            reader = open_reader(job.file, stored)
+            self.assertEqual(b''.join(reader.iter_range(0, reader.size)), data)
+        self.assertEqual(self.staged(), [])
+        # Повторная доставка сообщения ничего не делает
+        ingest_file(str(job.pk))
+        self.assertEqual(File.objects.count(), 1)
+
+    def test_failure(self):
+        job = self.queue(b'data')
+        os.remove(os.path.join(settings.FILE_STAGING_ROOT, job.staging_path))
+        ingest_file(str(job.pk))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertFalse(File.objects.exists())
+
+    def test_taken_over_attempt_is_dropped(self):
+        job = self.queue(b'data')
+        original = ingest.staging_storage
+
+        def reset_while_running():
+            # Пока воркер шифрует, восстановление перезапустило задачу
+            IngestJob.objects.filter(pk=job.pk).update(status='pending')
+            return original()
+
+        with mock.patch.object(ingest, 'staging_storage', reset_while_running):
+            ingest_file(str(job.pk))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'pending')
+        self.assertFalse(File.objects.exists())
+        self.assertEqual(self.staged(), [job.staging_path])
+
+    def test_recover_jobs(self):
+        lost, crashed, exhausted, fresh = (
+            self.queue(b'x' * i) for i in range(1, 5))
+        IngestJob.objects.filter(pk__in=[crashed.pk, exhausted.pk]).update(
+            status='processing')
+        IngestJob.objects.filter(pk=exhausted.pk).update(attempts=3)
+        for job in (lost, crashed, exhausted):
+            self.age(job, 60)
+        orphan = ingest.staging_storage().save('orphan', ContentFile(b'x'))
+        old = timezone.now().timestamp() - 3600
+        os.utime(os.path.join(settings.FILE_STAGING_ROOT, orphan), (old, old))
+        self.delay.reset_mock()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(ingest.recover_jobs(), (2, 1))
+        statuses = dict(IngestJob.objects.values_list('pk', 'status'))
+        self.assertEqual(
+            [statuses[job.pk] for job in (lost, crashed, exhausted, fresh)],
+            ['pending', 'pending', 'failed', 'pending'])
+        self.assertEqual(
+            sorted(call.args[0] for call in self.delay.call_args_list),
+            sorted([str(lost.pk), str(crashed.pk)]))
+        self.assertEqual(self.staged(), sorted(
+            job.staging_path for job in (lost, crashed, fresh)))
+
+        # Слишком старая задача тоже помечается ошибкой
+        IngestJob.objects.filter(pk=fresh.pk).update(
+            created_at=timezone.now() - timedelta(days=2))
+        self.age(fresh, 60)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(ingest.recover_jobs(), (0, 1))
+        self.assertNotIn(fresh.staging_path, self.staged())
+
+
+@override_settings(RESPONSE_CACHE_TIMEOUT=0)
+class ShardBlobsTests(StoredFilesMixin, TestCase):
+    """Перенос старых имён в раскладку encrypted_files/ab/cd/<uuid>."""
+
+    def setUp(self):
+        self.isolate_media()
+        self.user = User.objects.create_user(
+            username='owner', email='owner@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def legacy_upload(self, data, legacy_name):
+        file_obj = self.upload(data)
+        os.rename(default_storage.path(file_obj.file.name),
+                  default_storage.path(legacy_name))
+        File.objects.filter(file=file_obj.file.name).update(file=legacy_name)
+        Blob.objects.filter(file=file_obj.file.name).update(file=legacy_name)
+        old = timezone.now().timestamp() - 2 * 24 * 3600
+        os.utime(default_storage.path(legacy_name), (old, old))
+        return file_obj
+
+    def shard(self, *args):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('shard_blobs', '--sleep', '0', *args,
+                         stdout=StringIO(), stderr=StringIO())
+
+    def test_shard_blobs(self):
+        sharded = self.upload(b'already sharded')
+        name = sharded.file.name
+        contents = [os.urandom(100) for _ in range(5)]
+        legacy = [self.legacy_upload(data, f'encrypted_files/legacy{i}.bin')
+                  for i, data in enumerate(contents)]
+        # Копия того же содержимого ссылается на то же старое имя
+        copy = self.upload(contents[0])
+
+        self.shard('--batch-size', '2', '--limit', '2')
+        names = File.objects.filter(pk__in=[f.pk for f in legacy]) \
+            .values_list('file', flat=True)
+        self.assertEqual(sum(not n.startswith('encrypted_files/legacy')
+                             for n in names), 2)
+
+        self.shard('--batch-size', '2')
+        for file_obj, data in zip(legacy + [copy], contents + contents[:1]):
+            file_obj.refresh_from_db()
+            self.assertRegex(file_obj.file.name, SHARDED_BLOB_RE)
+            self.assertEqual(file_obj.file.name, file_obj.blob.file.name)
+            self.assertEqual(self.read(file_obj), data)
+            # Новое имя не выглядит брошенным для find_orphan_blobs
+            self.assertGreater(
+                default_storage.get_modified_time(file_obj.file.name),
+                timezone.now() - timedelta(hours=1))
+        self.assertEqual(File.objects.get(pk=sharded.pk).file.name, name)
+        self.assertEqual(
+            [n for n in os.listdir(default_storage.path('encrypted_files'))
+             if n.startswith('legacy')], [])
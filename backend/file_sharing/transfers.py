@@ -0,0 +1,38 @@
+"""
+Пул потоков для передачи файлов.
+
+Сервис работает под WSGI: тело загрузки читается потоково и шифруется
+по мере приёма (EncryptingUploadHandler), а скачивание отдаётся
+синхронным итератором, по одному сегменту (downloads.file_response).
+Под ASGI Django читает всё тело запроса во временный файл до вызова
+представления и целиком собирает синхронный итератор ответа, поэтому
+ASGI-сервер здесь не используется.
+
+Пакетная загрузка (batch_uploads) шифрует части параллельно в этом
+ограниченном пуле, пока поток запроса разбирает multipart-тело.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+
+def get_workers():
+    return (getattr(settings, 'FILE_TRANSFER_WORKERS', None)
+            or min(32, (os.cpu_count() or 1) + 4))
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=get_workers(),
+                    thread_name_prefix='file-transfer')
+    return _executor
@@ -0,0 +1,113 @@
+import hashlib
+
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+from django.http.multipartparser import MultiPartParserError
+
+from . import encryption
+from .compression import AdaptiveCompressor
+from .storage import create_blob
+
+
+class EncryptedUploadedFile(UploadedFile):
+    """
+    Загруженный файл, который уже зашифрован и лежит в хранилище под
+    ``storage_name``. Открытого текста у него нет.
+    """
+
+    def __init__(self, name, content_type, size, charset,
+                 storage_name, encryption_key, stored_size, checksum,
+                 compression, compression_index=None):
+        super().__init__(None, name, content_type, size, charset)
+        self.storage_name = storage_name
+        self.encryption_key = encryption_key
+        self.stored_size = stored_size
+        self.checksum = checksum
+        self.compression = compression
+        self.compression_index = compression_index
+
+    def close(self):
+        # Закрывать нечего; Django вызывает close() при ошибке разбора
+        pass
+
+
+class EncryptingUploadHandler(FileUploadHandler):
+    """
+    Шифрует поле ``file`` прямо при приёме multipart-запроса и пишет
+    шифртекст сразу в итоговый файл хранилища: без временного файла и без
+    буфера на весь файл в памяти. Перед шифрованием данные при
+    необходимости сжимаются.
+
+    Если разбор прервался исключением (клиент отключился, тело
+    некорректно), Django обработчику об этом не сообщает: записанное
+    удаляет ``discard()``, который вызывает представление.
+    """
+    field_name_to_encrypt = 'file'
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.active = False
+        self.uploaded = None
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.active = field_name == self.field_name_to_encrypt
+        if not self.active:
+            return
+        if self.uploaded is not None:
+            # Иначе первый файл остался бы в хранилище без записи File
+            self.active = False
+            raise MultiPartParserError('Only one file may be uploaded per request')
+        self.encryption_key = encryption.generate_key()
+        self.encryptor = encryption.StreamEncryptor(self.encryption_key)
+        self.compressor = AdaptiveCompressor()
+        self.storage_name, self.destination = create_blob()
+        self.stored_size = 0
+        self.sha256 = hashlib.sha256()
+        raise StopFutureHandlers()
+
+    def _write(self, data):
+        self.destination.write(data)
+        self.stored_size += len(data)
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+        self.sha256.update(raw_data)
+        self._write(self.encryptor.update(self.compressor.compress(raw_data)))
+        return None
+
+    def file_complete(self, file_size):
+        if not self.active:
+            return None
+        self._write(self.encryptor.update(self.compressor.flush()))
+        self._write(self.encryptor.finalize())
+        self.destination.close()
+        self.active = False
+        self.uploaded = EncryptedUploadedFile(
+            name=self.file_name,
+            content_type=self.content_type,
+            size=file_size,
+            charset=self.charset,
+            storage_name=self.storage_name,
+            encryption_key=self.encryption_key,
+            stored_size=self.stored_size,
+            checksum=self.sha256.hexdigest(),
+            compression=self.compressor.codec,
+            compression_index=self.compressor.index,
+        )
+        return self.uploaded
+
+    def upload_interrupted(self):
+        if self.active:
+            self.active = False
+            self.destination.close()
+            default_storage.delete(self.storage_name)
+
+    def discard(self):
+        """Удаляет всё, что успело записаться в хранилище."""
+        self.upload_interrupted()
+        if self.uploaded is not None:
+            default_storage.delete(self.uploaded.storage_name)
+            self.uploaded = None
@@ -0,0 +1,213 @@
+"""
+Возобновляемая загрузка по частям.
+
+Клиент создаёт сессию с именем и размером файла, затем присылает части
+(в любом порядке и параллельно) и завершает сессию. Размер части равен
+размеру сегмента контейнера, поэтому каждая часть сразу шифруется в свой
+сегмент и кладётся во временную папку, а при завершении сегменты только
+склеиваются в итоговый файл без повторного шифрования.
+
+Nonce сегмента зависит только от номера части, поэтому повторно
+принимается только та же самая часть (тот же шифртекст): другие данные
+под тем же nonce раскрыли бы XOR открытых текстов и позволили подделать
+тег. Брошенные сессии удаляет expire_sessions.
+"""
+import hashlib
+import os
+import uuid
+from datetime import timedelta
+
+from django.core.files.base import ContentFile, File as DjangoFile
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import encryption
+from .models import UploadChunk, UploadSession
+from .storage import blob_name, create_file, register_blob
+
+
+STAGING_DIR = 'upload_sessions'
+
+
+class UploadError(Exception):
+    pass
+
+
+class ChunkConflict(UploadError):
+    """Часть с этим номером уже принята с другим содержимым."""
+
+
+class SessionFinalized(UploadError):
+    """Сессию уже завершил (или удалил) другой запрос."""
+
+    def __init__(self):
+        super().__init__('Upload session has already been finalized')
+
+
+def _staging_path(session, index):
+    return os.path.join(STAGING_DIR, str(session.pk), str(index))
+
+
+def create_session(owner, name, size):
+    key = encryption.generate_key()
+    encryptor = encryption.StreamEncryptor(key)
+    return UploadSession.objects.create(
+        owner=owner,
+        name=name,
+        size=size,
+        chunk_size=encryptor.chunk_size,
+        header=encryptor.header,
+        encryption_key=key,
+    )
+
+
+def store_chunk(session, index, data):
+    if index >= session.chunk_count:
+        raise UploadError('Chunk index out of range')
+    if len(data) != session.expected_chunk_length(index):
+        raise UploadError(
+            f'Chunk {index} must be {session.expected_chunk_length(index)} bytes')
+
+    encryptor = encryption.StreamEncryptor(
+        session.encryption_key, header=bytes(session.header))
+    segment = encryptor.encrypt_segment(
+        index, data, final=index == session.chunk_count - 1)
+
+    previous = _find_chunk(session, index)
+    if previous is None:
+        path = default_storage.save(
+            _staging_path(session, index), ContentFile(segment))
+        try:
+            with transaction.atomic():
+                chunk = UploadChunk.objects.create(
+                    session=session, index=index, path=path)
+                UploadSession.objects.filter(pk=session.pk).update(
+                    updated_at=timezone.now())
+            return chunk
+        except IntegrityError:
+            # Ту же часть параллельно принял другой запрос
+            default_storage.delete(path)
+            previous = _find_chunk(session, index)
+            if previous is None:
+                # Сессию удалили, пока часть записывалась
+                raise UploadError('Upload session no longer exists')
+
+    # Шифрование детерминировано: те же данные дают тот же шифртекст
+    with default_storage.open(previous.path, 'rb') as stored:
+        if stored.read() != segment:
+            raise ChunkConflict(
+                f'Chunk {index} has already been uploaded with different content')
+    return previous
+
+
+def _find_chunk(session, index):
+    return UploadChunk.objects.filter(session=session, index=index).first()
+
+
+def missing_chunks(session):
+    received = set(session.chunks.values_list('index', flat=True))
+    return [i for i in range(session.chunk_count) if i not in received]
+
+
+class _AssembledContent(DjangoFile):
+    """
+    Заголовок и зашифрованные части подряд, по одной части в памяти.
+    Части попутно расшифровываются, чтобы посчитать SHA-256 открытого
+    текста для дедупликации: части приходят в любом порядке, и посчитать
+    хеш при приёме нельзя.
+    """
+
+    def __init__(self, session, paths):
+        super().__init__(None)
+        self.session = session
+        self.paths = paths
+        self.sha256 = hashlib.sha256()
+
+    def chunks(self, chunk_size=None):
+        header = bytes(self.session.header)
+        decryptor = encryption.StreamDecryptor(
+            self.session.encryption_key, header)
+        yield header
+        for index, path in enumerate(self.paths):
+            try:
+                with default_storage.open(path, 'rb') as stored:
+                    segment = stored.read()
+            except FileNotFoundError:
+                # Параллельное завершение уже удалило части
+                raise SessionFinalized from None
+            self.sha256.update(decryptor.decrypt_segment(
+                index, segment, final=index == len(self.paths) - 1))
+            yield segment
+
+
+def finalize_session(session):
+    paths = list(session.chunks.order_by('index').values_list('index', 'path'))
+    if [index for index, _ in paths] != list(range(session.chunk_count)):
+        raise UploadError('Not all chunks have been uploaded')
+
+    # Склейка и расшифровка для SHA-256 — до блокировки сессии: принятые
+    # части больше не меняются
+    content = _AssembledContent(session, [path for _, path in paths])
+    path = blob_name()
+    try:
+        path = default_storage.save(path, content)
+        with transaction.atomic():
+            locked = (UploadSession.objects.select_for_update()
+                      .filter(pk=session.pk).first())
+            if locked is None:
+                raise SessionFinalized
+            checksum = content.sha256.hexdigest()
+            blob = register_blob(
+                path, session.encryption_key, session.size, checksum,
+                stored_size=encryption.encrypted_size(
+                    session.size, session.chunk_size))
+            file_obj = create_file(session.owner, session.name, blob, checksum)
+            discard_session(locked)
+    except Exception:
+        # И недописанный файл, если склейка оборвалась
+        default_storage.delete(path)
+        raise
+    return file_obj
+
+
+def discard_session(session):
+    paths = list(session.chunks.values_list('path', flat=True))
+    session.delete()
+
+    def remove_staged():
+        for path in paths:
+            default_storage.delete(path)
+    transaction.on_commit(remove_staged)
+
+
+def expire_sessions(max_age):
+    """
+    Удаляет сессии, в которые ничего не присылали дольше ``max_age``, и
+    папки частей без сессии (остаются, если процесс упал между записью
+    части и строкой в базе). Возвращает число удалённых сессий.
+    """
+    expired = 0
+    for session in UploadSession.objects.filter(
+            updated_at__lt=timezone.now() - max_age).iterator():
+        with transaction.atomic():
+            discard_session(session)
+        expired += 1
+
+    if not default_storage.exists(STAGING_DIR):
+        return expired
+    dirs, _ = default_storage.listdir(STAGING_DIR)
+    ids = set()
+    for name in dirs:
+        try:
+            ids.add(uuid.UUID(name))
+        except ValueError:
+            continue
+    live = set(UploadSession.objects.filter(
+        pk__in=ids).values_list('pk', flat=True))
+    for session_id in ids - live:
+        directory = os.path.join(STAGING_DIR, str(session_id))
+        for name in default_storage.listdir(directory)[1]:
+            default_storage.delete(os.path.join(directory, name))
+        default_storage.delete(directory)
+    return expired
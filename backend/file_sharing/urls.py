@@ -5,9 +5,14 @@ from .views import (
     UserViewSet,
     EncryptedFileViewSet,
     FileShareViewSet,
+    UploadSessionViewSet,
+    IngestJobViewSet,
+    ActivityEventViewSet,
     dashboard_stats,
-    LoginView,
-    RegisterView,
+    login_view,
+    register_view,
+    share_download_view,
+    hashing_metrics,
     ResetPasswordView,
     VerifyResetTokenView,
     SetNewPasswordView,
@@ -17,13 +22,21 @@ router = DefaultRouter()
 router.register(r'users', UserViewSet)
 router.register(r'files', EncryptedFileViewSet, basename='file')
 router.register(r'shares', FileShareViewSet, basename='share')
+router.register(r'upload-sessions', UploadSessionViewSet,
+                basename='upload-session')
+router.register(r'ingest', IngestJobViewSet, basename='ingest')
+router.register(r'activity', ActivityEventViewSet, basename='activity')
 
 urlpatterns = [
+    # Стоит раньше маршрутов роутера
+    path('shares/download/<str:token>/', share_download_view,
+         name='share-download'),
     path('', include(router.urls)),
     path('dashboard/stats/', dashboard_stats),
 
-    path('auth/login/', LoginView.as_view(), name='login'),
-    path('auth/register/', RegisterView.as_view(), name='register'),
+    path('auth/login/', login_view, name='login'),
+    path('auth/register/', register_view, name='register'),
+    path('metrics/hashing/', hashing_metrics, name='hashing-metrics'),
     path('auth/reset-password/', ResetPasswordView.as_view(), name='reset-password'),
     path('auth/verify-reset-token/',
          VerifyResetTokenView.as_view(), name='verify-reset-token'),
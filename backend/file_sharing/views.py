@@ -1,27 +1,43 @@
-from rest_framework import viewsets, status
+from rest_framework import mixins, viewsets, status
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny
-from rest_framework.authtoken.models import Token
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 from rest_framework.request import Request
 from rest_framework.views import APIView
 
-from django.contrib.auth import authenticate
+from asgiref.sync import sync_to_async
+from django.contrib.auth.hashers import make_password, verify_password
+from django.contrib.auth.signals import user_login_failed
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
 from django.utils import timezone
-from django.http import HttpResponse
 from django.conf import settings
-from django.utils.crypto import get_random_string
-from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
+from django.db import transaction
 
 
-import os
+import json
 import logging
+import functools
 from datetime import timedelta
-from cryptography.fernet import Fernet
 
 
+from . import (
+    deletion, encryption, ingest, quota, sharing, uploads)
+from .authentication import revoke_tokens, tokens_for
+from .downloads import file_response
+from .filters import FileFilter, FileShareFilter, UserFilter
+from .hashing import HashingOverloaded, get_pool, run_hashing
+from .pagination import (
+    DateJoinedKeysetPagination, KeysetPagination, TimestampKeysetPagination)
+from .principals import sees_all_files
+from .response_cache import cached_response
+from .stats import get_user_stats
+from .storage import (
+    acquire_blob, create_file, find_blob, save_upload, save_uploads)
 from .tasks import *
+from .batch_uploads import BatchEncryptingUploadHandler
+from .upload_handlers import EncryptingUploadHandler
 from .serializers import *
 from .models import *
 from .permissions import *
@@ -29,11 +45,22 @@ from .permissions import *
 logger = logging.getLogger(__name__)
 
 
+def _quota_exceeded(e):
+    """Тело ответа 413 на QuotaExceeded."""
+    return {
+        'error': 'Недостаточно места в хранилище',
+        'storage_used': e.used,
+        'storage_limit': e.limit,
+    }
+
+
 
 class UserViewSet(viewsets.ModelViewSet[User]):
-    queryset = User.objects.all()
+    queryset = User.objects.select_related('userprofile')
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = DateJoinedKeysetPagination
+    filter_backends = [UserFilter]
 
     def get_permissions(self):
         if self.action == "destroy":
@@ -43,13 +70,15 @@ class UserViewSet(viewsets.ModelViewSet[User]):
 
     @action(detail=False, methods=['get'])
     def me(self, request: Request):
-        serializer = self.get_serializer(request.user)
+        # request.user собран из JWT, профиль читаем из базы
+        user = User.objects.select_related('userprofile').get(pk=request.user.pk)
+        serializer = self.get_serializer(user)
         return Response(serializer.data)
     
 
     @action(detail=False, methods=['post'],url_path='change-password')
     def change_password(self, request):
-        user: User = request.user
+        user: User = User.objects.get(pk=request.user.pk)
         old_password = request.data.get('current_password')
         confirm_password = request.data.get('confirm_password')
         new_password = request.data.get('new_password')
@@ -74,7 +103,12 @@ class UserViewSet(viewsets.ModelViewSet[User]):
 
         user.set_password(new_password)
         user.save()
-        return Response({'detail': 'Пароль успешно изменён'})
+        # Старые токены (в том числе на других устройствах) больше не действуют
+        revoke_tokens(user)
+        return Response({
+            'detail': 'Пароль успешно изменён',
+            **tokens_for(user),
+        })
 
 
 class UserProfileViewSet(viewsets.ModelViewSet):
@@ -83,80 +117,99 @@ class UserProfileViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return UserProfile.objects.filter(user=self.request.user)
+        return UserProfile.objects.filter(
+            user=self.request.user).select_related('user')
 
 
 class EncryptedFileViewSet(viewsets.ModelViewSet):
     queryset = File.objects.all()
     serializer_class = EncryptedFileSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    filter_backends = [FileFilter]
+
+    def sees_all_files(self):
+        # Админ или персонал видят все файлы
+        return sees_all_files(self.request.user)
 
     def get_queryset(self):
         user = self.request.user
-        # Админ или персонал видят все файлы
-        try:
-            if user.is_staff or (hasattr(user, "userprofile") and user.userprofile.role == "manager"):
-                return File.objects.all()
-        except Exception:
-            pass
         # Обычный пользователь — только свои файлы
-        return File.objects.filter(owner=user)
+        queryset = File.objects.filter(owner=user)
+        if self.sees_all_files():
+            queryset = File.objects.all()
+
+        if self.action == 'download':
+            return queryset.select_related('blob')
+        # Сериализатор и CanDeleteFile читают владельца и его роль
+        return queryset.select_related('owner__userprofile')
 
     def get_permissions(self):
         if self.action == 'destroy':
             return [IsAuthenticated(), CanDeleteFile()]
         return [IsAuthenticated()]
 
+    def list(self, request, *args, **kwargs):
+        return cached_response(
+            request, 'files',
+            functools.partial(super().list, request, *args, **kwargs),
+            all_files=self.sees_all_files(), all_users=self.sees_all_files())
+
+    def initialize_request(self, request, *args, **kwargs):
+        request = super().initialize_request(request, *args, **kwargs)
+        if self.action == 'create':
+            # MultiPartParser берёт обработчики загрузки из запроса
+            request.upload_handlers = [EncryptingUploadHandler(request._request)]
+        elif self.action == 'batch_upload':
+            request.upload_handlers = [
+                BatchEncryptingUploadHandler(request._request)]
+        return request
+
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
+    def perform_destroy(self, instance):
+        # Строку и содержимое в хранилище удалит фоновая очистка
+        deletion.soft_delete_files([instance.pk])
+
     def create(self, request, *args, **kwargs):
         try:
             logger.info(
                 f"Received file upload request from user {request.user.username}")
-
-            if 'file' not in request.FILES:
+            # До request.FILES: тело, которое не поместится, не шифруется
+            quota.check_request(request, request.user.pk)
+
+            handler = request.upload_handlers[0]
+            try:
+                files = request.FILES
+            except Exception:
+                # Разбор прерван: удалить то, что уже зашифровано в хранилище
+                handler.discard()
+                raise
+            if 'file' not in files:
                 logger.error("No file provided in request")
                 return Response(
                     {'error': 'No file provided'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            file = request.FILES['file']
+            # The upload handler has already encrypted the file into storage
+            file = files['file']
             logger.info(f"Processing file: {file.name}, size: {file.size}")
+            logger.info(f"Saved encrypted file to: {file.storage_name}")
 
-            # Generate encryption key
-            key = Fernet.generate_key()
-            f = Fernet(key)
-
-            # Read and encrypt file content
-            file_content = file.read()
-            encrypted_data = f.encrypt(file_content)
-
-            # Create unique filename
-            timestamp = timezone.now().strftime('%Y%m%d_%H%M%S')
-            safe_filename = f"{timestamp}_{file.name}"
-            encrypted_file_path = os.path.join(
-                'encrypted_files', safe_filename)
-
-            # Save encrypted file using Django's storage
-            path = default_storage.save(
-                encrypted_file_path, ContentFile(encrypted_data))
-            logger.info(f"Saved encrypted file to: {path}")
-
-            # Create file record
-            file_obj = File.objects.create(
-                name=file.name,
-                file=path,
-                owner=request.user,
-                is_encrypted=True,
-                encryption_key=key.decode()
-            )
+            # Create file record (identical content is stored only once)
+            file_obj = save_upload(request.user, file)
             logger.info(f"Created file record with ID: {file_obj.id}")
 
             serializer = self.get_serializer(file_obj)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+        except quota.QuotaExceeded as e:
+            logger.info(f"Upload rejected for user {request.user.username}: {e}")
+            return Response(
+                _quota_exceeded(e),
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
         except Exception as e:
             logger.error(f"Error uploading file: {str(e)}", exc_info=True)
             return Response(
@@ -164,28 +217,92 @@ class EncryptedFileViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+    @action(detail=False, methods=['post'], url_path='batch-upload')
+    def batch_upload(self, request):
+        """
+        Много файлов (части ``files``) в одном multipart-запросе. Файлы
+        шифруются параллельно, пока принимается тело запроса, а записи
+        File создаются одним bulk_create.
+        """
+        try:
+            quota.check_request(request, request.user.pk)
+        except quota.QuotaExceeded as e:
+            return Response(
+                _quota_exceeded(e),
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        handler = request.upload_handlers[0]
+        try:
+            # Разбор тела; шифрование идёт в пуле по ходу разбора
+            request.FILES
+            uploads = handler.results()
+        except Exception as e:
+            handler.discard()
+            logger.error(f"Error uploading files: {str(e)}", exc_info=True)
+            return Response(
+                {'error': f'File upload failed: {str(e)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not uploads:
+            return Response(
+                {'error': 'No files provided'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            files = save_uploads(request.user, uploads)
+        except quota.QuotaExceeded as e:
+            return Response(
+                _quota_exceeded(e),
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        logger.info(
+            f"User {request.user.username} uploaded {len(files)} files in a batch")
+        serializer = self.get_serializer(files, many=True)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'], url_path='bulk-delete')
+    def bulk_delete(self, request):
+        """
+        Удаляет файлы ``files`` за один запрос. Права проверяются для
+        каждого файла так же, как при обычном удалении; в ответе — статус
+        каждого id.
+        """
+        serializer = BulkDeleteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        file_ids = serializer.validated_data['files']
+
+        # get_queryset подтягивает владельцев с ролями для CanDeleteFile
+        files = list(self.get_queryset().filter(pk__in=file_ids))
+        permission = CanDeleteFile()
+        allowed = {f.pk for f in files
+                   if permission.has_object_permission(request, self, f)}
+        deleted = set(deletion.soft_delete_files(allowed))
+        found = {f.pk for f in files}
+
+        results = []
+        for file_id in file_ids:
+            if file_id in deleted:
+                result = 'deleted'
+            elif file_id in found and file_id not in allowed:
+                result = 'forbidden'
+            else:
+                result = 'not_found'
+            results.append({'id': file_id, 'status': result})
+        return Response({'deleted': len(deleted), 'results': results})
+
     @action(detail=True, methods=['get'])
     def download(self, request, pk=None):
         try:
             file_obj = self.get_object()
 
             # Check if user has permission to download
-            if file_obj.owner != request.user:
+            if file_obj.owner_id != request.user.id:
                 return Response(
                     {'error': 'Permission denied'},
                     status=status.HTTP_403_FORBIDDEN
                 )
 
-            # Decrypt file
-            f = Fernet(file_obj.encryption_key.encode())
-            encrypted_data = default_storage.open(file_obj.file.path).read()
-            decrypted_data = f.decrypt(encrypted_data)
-
-            # Create response
-            response = HttpResponse(
-                decrypted_data, content_type='application/octet-stream')
-            response['Content-Disposition'] = f'attachment; filename="{file_obj.name}"'
-            return response
+            # Decrypt file while streaming it to the client
+            return file_response(request, file_obj)
         except Exception as e:
             logger.error(f"Error downloading file: {str(e)}", exc_info=True)
             return Response(
@@ -193,17 +310,67 @@ class EncryptedFileViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @action(detail=False, methods=['post'])
+    def precheck(self, request):
+        """
+        Проверка перед загрузкой: клиент присылает SHA-256 файла, и если это
+        содержимое уже есть у пользователя (в своих или расшаренных ему
+        файлах), файл создаётся без передачи данных.
+        """
+        checksum = str(request.data.get('sha256', '')).lower()
+        name = request.data.get('name')
+        if not name or len(checksum) != 64 \
+                or any(c not in '0123456789abcdef' for c in checksum):
+            return Response(
+                {'error': 'name and sha256 are required'},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            file_obj = self._create_from_blob(request.user, name, checksum)
+        except quota.QuotaExceeded as e:
+            return Response(
+                _quota_exceeded(e),
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        if file_obj is None:
+            return Response({'exists': False})
+        return Response({
+            'exists': True,
+            'file': self.get_serializer(file_obj).data,
+        }, status=status.HTTP_201_CREATED)
+
+    def _create_from_blob(self, user, name, checksum):
+        """File на уже загруженное содержимое, доступное ``user``, или None."""
+        with transaction.atomic():
+            blob = find_blob(checksum)
+            accessible = blob is not None and (
+                File.objects.filter(blob=blob, owner=user).exists()
+                or FileShare.objects.filter(
+                    file__blob=blob, file__deleted_at__isnull=True,
+                    shared_with=user).exists())
+            if not accessible:
+                return None
+            blob = Blob.objects.select_for_update().get(pk=blob.pk)
+            acquire_blob(blob)
+            return create_file(user, name, blob, checksum)
+
     @action(detail=True, methods=['post'])
     def share(self, request, pk=None):
         file = self.get_object()
+        # Персонал видит чужие файлы, но раздавать их не может: по токену
+        # шары файл скачивается без проверки владельца
+        if file.owner_id != request.user.id:
+            return Response(
+                {'error': 'Permission denied'},
+                status=status.HTTP_403_FORBIDDEN
+            )
         shared_with_username = request.data.get('username')
 
         try:
             shared_with = User.objects.get(username=shared_with_username)
-            share = FileShare.objects.create(
+            # Повторная шара того же файла тому же человеку возвращает прежнюю
+            share, _ = FileShare.objects.get_or_create(
                 file=file,
                 shared_with=shared_with,
-                access_token=get_random_string(32)
             )
             return Response(FileShareSerializer(share).data)
         except User.DoesNotExist:
@@ -212,14 +379,203 @@ class EncryptedFileViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
 
+    @action(detail=False, methods=['post'], url_path='bulk-share')
+    def bulk_share(self, request):
+        """
+        Шарит каждый из ``files`` каждому из ``usernames`` за один запрос:
+        получатели ищутся одним IN, шары пишутся пачками. В ответе —
+        статус каждой пары.
+        """
+        serializer = BulkShareSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        file_ids = serializer.validated_data['files']
+        usernames = serializer.validated_data['usernames']
+
+        # Только свои файлы, как и в share: чужие получают file_not_found
+        files = list(File.objects.filter(owner=request.user, pk__in=file_ids)
+                     .only('id', 'name', 'owner'))
+        recipients = list(User.objects.filter(username__in=usernames)
+                          .only('id', 'username'))
+        created = sharing.share_files(files, recipients)
+        return Response({
+            'created': len(created),
+            'results': sharing.share_results(
+                file_ids, usernames, files, recipients, created),
+        })
+
+
+class UploadSessionViewSet(mixins.CreateModelMixin,
+                           mixins.RetrieveModelMixin,
+                           mixins.DestroyModelMixin,
+                           viewsets.GenericViewSet):
+    """
+    Возобновляемая загрузка: POST создаёт сессию, PUT chunks/<n>/ принимает
+    часть (тело запроса — байты части), GET показывает полученные части,
+    POST finalize/ создаёт файл.
+    """
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(
+            owner=self.request.user).prefetch_related('chunks')
+
+    def create(self, request, *args, **kwargs):
+        try:
+            return super().create(request, *args, **kwargs)
+        except quota.QuotaExceeded as e:
+            return Response(
+                _quota_exceeded(e),
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    def perform_create(self, serializer):
+        data = serializer.validated_data
+        # Размер сессии известен заранее: проверяем до приёма частей
+        quota.check_quota(self.request.user.pk, data['size'])
+        serializer.instance = uploads.create_session(
+            self.request.user, data['name'], data['size'])
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            uploads.discard_session(instance)
+
+    @action(detail=True, methods=['put'], url_path=r'chunks/(?P<index>\d+)')
+    def chunk(self, request, pk=None, index=None):
+        session = self.get_object()
+        try:
+            uploads.store_chunk(session, int(index), request.body)
+        except uploads.ChunkConflict as e:
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+        except uploads.UploadError as e:
+            return Response(
+                {'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'index': int(index)})
+
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, pk=None):
+        session = self.get_object()
+        try:
+            file_obj = uploads.finalize_session(session)
+        except uploads.SessionFinalized as e:
+            return Response(
+                {'error': str(e)}, status=status.HTTP_409_CONFLICT)
+        except uploads.UploadError as e:
+            return Response({
+                'error': str(e),
+                'missing_chunks': uploads.missing_chunks(session),
+            }, status=status.HTTP_400_BAD_REQUEST)
+        except quota.QuotaExceeded as e:
+            # Сессия остаётся: после освобождения места её можно завершить
+            return Response(
+                _quota_exceeded(e),
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        logger.info(f"Finalized upload session {session.pk} as file {file_obj.id}")
+        return Response(
+            EncryptedFileSerializer(file_obj).data,
+            status=status.HTTP_201_CREATED)
+
+
+class IngestJobViewSet(mixins.CreateModelMixin,
+                       mixins.RetrieveModelMixin,
+                       mixins.ListModelMixin,
+                       viewsets.GenericViewSet):
+    """
+    Асинхронная загрузка: POST сохраняет файл как есть во временное
+    хранилище и сразу отвечает 202, шифрование выполняет Celery. GET
+    показывает статус и прогресс.
+    """
+    serializer_class = IngestJobSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return IngestJob.objects.filter(
+            owner=self.request.user).order_by('-created_at')
+
+    def create(self, request, *args, **kwargs):
+        # Окончательно квота списывается в ingest_file
+        try:
+            quota.check_request(request, request.user.pk)
+        except quota.QuotaExceeded as e:
+            return Response(
+                _quota_exceeded(e),
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        if 'file' not in request.FILES:
+            return Response(
+                {'error': 'No file provided'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        file = request.FILES['file']
+
+        staging_path = ingest.stage(file)
+        try:
+            job = IngestJob.objects.create(
+                owner=request.user,
+                name=file.name,
+                size=file.size,
+                staging_path=staging_path,
+            )
+        except Exception:
+            ingest.discard(staging_path)
+            raise
+        transaction.on_commit(lambda: ingest_file.delay(str(job.pk)))
+        logger.info(f"Queued upload {job.pk} ({file.name}, {file.size} bytes)")
+
+        return Response(
+            self.get_serializer(job).data, status=status.HTTP_202_ACCEPTED)
+
 
 class FileShareViewSet(viewsets.ModelViewSet):
     queryset = FileShare.objects.all()
     serializer_class = FileShareSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    filter_backends = [FileShareFilter]
 
     def get_queryset(self):
-        return FileShare.objects.filter(shared_with=self.request.user)
+        return FileShare.objects.filter(
+            shared_with=self.request.user, file__deleted_at__isnull=True,
+        ).select_related('file__owner__userprofile', 'shared_with__userprofile')
+
+    def list(self, request, *args, **kwargs):
+        return cached_response(
+            request, 'shares',
+            functools.partial(super().list, request, *args, **kwargs))
+
+
+class ActivityEventViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    """Полная история активности пользователя, новые события первыми."""
+    serializer_class = ActivityEventSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = TimestampKeysetPagination
+
+    def get_queryset(self):
+        return ActivityEvent.objects.filter(user=self.request.user)
+
+
+def _dashboard_data(user):
+    # Counters are maintained incrementally, one primary-key lookup
+    user_stats = get_user_stats(user)
+
+    # Recent activities (last 10 within a week), one index range scan
+    recent_activities = [
+        {
+            'type': event.event_type,
+            'description': event.description,
+            'timestamp': event.timestamp.isoformat()
+        }
+        for event in ActivityEvent.objects.filter(
+            user=user,
+            timestamp__gte=timezone.now() - timedelta(days=7)
+        ).order_by('-timestamp', '-id')[:10]
+    ]
+
+    return {
+        'total_files': user_stats.file_count,
+        'total_size': user_stats.total_bytes,
+        'total_shared': user_stats.share_count,
+        'total_downloads': user_stats.download_count,
+        'recent_activities': recent_activities
+    }
 
 
 @api_view(['GET'])
@@ -228,122 +584,151 @@ def dashboard_stats(request):
     """
     Get dashboard statistics for the authenticated user
     """
-    user = request.user
-
     try:
-        # Get total files count
-        total_files = File.objects.filter(owner=user).count()
-
-        # Get total shared files count
-        total_shared = FileShare.objects.filter(file__owner=user).count()
-
-        # Get total downloads count
-        total_downloads = FileShare.objects.filter(
-            file__owner=user,
-            downloaded=True
-        ).count()
-
-        # Get recent activities (last 10)
-        recent_activities = []
-
-        # Get recent uploads
-        recent_uploads = File.objects.filter(
-            owner=user,
-            created_at__gte=timezone.now() - timedelta(days=7)
-        ).order_by('-created_at')[:5]
-
-        for file in recent_uploads:
-            recent_activities.append({
-                'type': 'upload',
-                'description': f'Загружен файл: {file.name}',
-                'timestamp': file.created_at.isoformat()
-            })
-
-        # Get recent shares
-        recent_shares = FileShare.objects.filter(
-            file__owner=user,
-            created_at__gte=timezone.now() - timedelta(days=7)
-        ).order_by('-created_at')[:5]
-
-        for share in recent_shares:
-            recent_activities.append({
-                'type': 'share',
-                'description': f'Файл {share.file.name} предоставлен пользователю {share.shared_with.username}',
-                'timestamp': share.created_at.isoformat()
-            })
-
-        # Get recent downloads
-        recent_downloads = FileShare.objects.filter(
-            file__owner=user,
-            downloaded=True,
-            downloaded_at__gte=timezone.now() - timedelta(days=7)
-        ).order_by('-downloaded_at')[:5]
-
-        for download in recent_downloads:
-            recent_activities.append({
-                'type': 'download',
-                'description': f'Файл {download.file.name} скачан пользователем {download.shared_with.username}',
-                'timestamp': download.downloaded_at.isoformat()
-            })
-
-        # Sort activities by timestamp
-        recent_activities.sort(key=lambda x: x['timestamp'], reverse=True)
-        # Get only the 10 most recent activities
-        recent_activities = recent_activities[:10]
-
-        return Response({
-            'total_files': total_files,
-            'total_shared': total_shared,
-            'total_downloads': total_downloads,
-            'recent_activities': recent_activities
-        })
+        return cached_response(
+            request, 'dashboard', lambda: Response(_dashboard_data(request.user)))
     except Exception as e:
         logger.error(f"Error getting dashboard stats: {str(e)}", exc_info=True)
         return Response({
             'total_files': 0,
+            'total_size': 0,
             'total_shared': 0,
             'total_downloads': 0,
             'recent_activities': []
         })
 
 
-class LoginView(APIView):
-    permission_classes = [AllowAny]
+def _request_data(request):
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+    return request.POST
 
-    def post(self, request: Request):
-        username = request.data.get('username')
-        password = request.data.get('password')
 
-        if not username or not password:
-            return Response({'error': 'Введите логин и пароль'}, status=400)
+def _json(data, status=200):
+    return JsonResponse(
+        data, status=status, json_dumps_params={'ensure_ascii': False})
 
-        user = authenticate(username=username, password=password)
-        if user:
-            token, _ = Token.objects.get_or_create(user=user)
-            return Response({
-                'token': token.key,
-                'user': {
-                    'id': user.pk,
-                    'username': user.username,
-                    'email': user.email,
-                }
-            })
-        return Response({'error': 'Неверные данные'}, status=401)
 
+def _hashing_overloaded():
+    response = _json(
+        {'error': 'Сервер перегружен, повторите попытку'}, status=503)
+    response['Retry-After'] = '1'
+    return response
 
-class RegisterView(APIView):
-    permission_classes = [AllowAny]
 
-    def post(self, request: Request):
-        serializer = UserRegistrationSerializer(data=request.data)
-        if serializer.is_valid():
-            user: User = serializer.save()
-            token, _ = Token.objects.get_or_create(user=user)
-            return Response({
-                'token': token.key,
-                'user': serializer.data
-            }, status=201)
-        return Response(serializer.errors, status=400)
+# Вход и регистрация — асинхронные представления Django (DRF их не
+# поддерживает): PBKDF2 считается в пуле hashing, а не в цикле событий
+
+@csrf_exempt
+@require_POST
+async def login_view(request):
+    data = _request_data(request)
+    if data is None:
+        return _json({'error': 'Некорректный JSON'}, status=400)
+    username = data.get('username')
+    password = data.get('password')
+
+    if not username or not password:
+        return _json({'error': 'Введите логин и пароль'}, status=400)
+
+    # То же, что ModelBackend.authenticate(), но PBKDF2 считается в пуле,
+    # а пользователь читается и сохраняется в потоке запроса
+    user = await User.objects.filter(**{
+        User.USERNAME_FIELD: username}).afirst()
+    try:
+        if user is None:
+            # Хешируем впустую, чтобы время ответа не выдавало, есть ли логин
+            await run_hashing(make_password, password)
+            is_correct = must_update = False
+        else:
+            is_correct, must_update = await run_hashing(
+                verify_password, password, user.password)
+    except HashingOverloaded:
+        return _hashing_overloaded()
+
+    if not is_correct or not user.is_active:
+        await user_login_failed.asend(
+            sender=__name__, credentials={'username': username},
+            request=request)
+        return _json({'error': 'Неверные данные'}, status=401)
+    if must_update:
+        # Пароль с устаревшими параметрами хешера пересчитываем
+        try:
+            user.password = await run_hashing(make_password, password)
+            await user.asave(update_fields=['password'])
+        except HashingOverloaded:
+            pass
+
+    tokens = await sync_to_async(tokens_for)(user)
+    return _json({
+        # token — access-токен, под этим именем его ждёт фронтенд
+        'token': tokens['access'],
+        **tokens,
+        'user': {
+            'id': user.pk,
+            'username': user.username,
+            'email': user.email,
+        }
+    })
+
+
+@csrf_exempt
+@require_POST
+async def register_view(request):
+    data = _request_data(request)
+    if data is None:
+        return _json({'error': 'Некорректный JSON'}, status=400)
+
+    serializer = UserRegistrationSerializer(data=data)
+    if not await sync_to_async(serializer.is_valid)():
+        return _json(serializer.errors, status=400)
+    try:
+        password_hash = await run_hashing(
+            make_password, serializer.validated_data['password'])
+    except HashingOverloaded:
+        return _hashing_overloaded()
+
+    user: User = await sync_to_async(serializer.save)(password_hash=password_hash)
+    tokens = await sync_to_async(tokens_for)(user)
+    return _json({
+        'token': tokens['access'],
+        **tokens,
+        'user': serializer.data
+    }, status=201)
+
+
+@require_GET
+def share_download_view(request, token):
+    """
+    Скачивание по токену шары: токен сам даёт доступ, вход не нужен.
+    Шара, файл и Blob читаются одним запросом по уникальному индексу.
+    """
+    share = (FileShare.objects
+             .select_related('file__blob', 'shared_with')
+             .filter(access_token=token, file__deleted_at__isnull=True)
+             .first())
+    if share is None:
+        return _json({'detail': 'No FileShare matches the given query.'},
+                     status=404)
+    try:
+        response = file_response(request, share.file)
+    except Exception as e:
+        logger.error(f"Error downloading shared file: {str(e)}", exc_info=True)
+        return _json({'error': f'Download failed: {str(e)}'}, status=500)
+    if response.status_code in (200, 206):
+        share.mark_as_downloaded()
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def hashing_metrics(request):
+    """Очередь и время хеширования паролей в этом процессе."""
+    return Response(get_pool().metrics())
 
 
 class ResetPasswordView(APIView):
@@ -394,6 +779,7 @@ class SetNewPasswordView(APIView):
             user = reset_token.user
             user.set_password(new_password)
             user.save()
+            revoke_tokens(user)
             reset_token.delete()
             return Response({'message': 'Пароль успешно обновлён'})
         except PasswordResetToken.DoesNotExist:
@@ -7,7 +7,29 @@ export const api = axios.create({
 api.interceptors.request.use((config) => {
   const token = localStorage.getItem('token');
   if (token && config.headers) {
-    config.headers.Authorization = `Token ${token}`;
+    config.headers.Authorization = `Bearer ${token}`;
   }
   return config;
 });
+
+// Access-токен живёт недолго: при 401 один раз обновляем его по refresh-токену
+api.interceptors.response.use(
+  (response) => response,
+  async (error) => {
+    const original = error.config;
+    const refresh = localStorage.getItem('refresh');
+    if (error.response?.status !== 401 || !refresh || !original || original._retried) {
+      return Promise.reject(error);
+    }
+    original._retried = true;
+    try {
+      const { data } = await axios.post(`${api.defaults.baseURL}/api/token/refresh/`, { refresh });
+      localStorage.setItem('token', data.access);
+      return api(original);
+    } catch {
+      localStorage.removeItem('token');
+      localStorage.removeItem('refresh');
+      return Promise.reject(error);
+    }
+  }
+);
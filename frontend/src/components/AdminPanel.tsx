@@ -85,7 +85,7 @@ const AdminPanel = () => {
 	const fetchUsers = async () => {
 		try {
 			const res = await api.get("/api/users/");
-			setUsers(res.data);
+			setUsers(res.data.results);
 		} catch {
 			setError("Ошибка при загрузке пользователей.");
 		}
@@ -94,7 +94,7 @@ const AdminPanel = () => {
 	const fetchFiles = async () => {
 		try {
 			const res = await api.get("/api/files/");
-			setFiles(res.data);
+			setFiles(res.data.results);
 		} catch {
 			setError("Ошибка при загрузке файлов.");
 		}
@@ -55,7 +55,7 @@ const FileManager = () => {
   const fetchFiles = async () => {
     try {
       const response = await api.get("/api/files/");
-      setFiles(response.data);
+      setFiles(response.data.results);
     } catch {
       setError("Не удалось загрузить файлы.");
     }
@@ -35,8 +35,8 @@ const Login = () => {
 
     try {
       const response = await api.post('/api/auth/login/', formData);
-      const { token } = response.data;
-      await login(token); // авторизация через context
+      const { token, refresh } = response.data;
+      await login(token, refresh); // авторизация через context
     } catch (error: any) {
       if (error.response?.status === 401) {
         setError('Неверное имя пользователя или пароль');
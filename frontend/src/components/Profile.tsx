@@ -67,7 +67,10 @@ const Profile = () => {
 
     try {
       setSaving(true);
-      await api.post('/api/users/change-password/', formData);
+      const { data } = await api.post('/api/users/change-password/', formData);
+      // Старые токены отозваны, сервер выдал новые
+      localStorage.setItem('token', data.access);
+      localStorage.setItem('refresh', data.refresh);
       setSuccess('Пароль успешно изменён.');
       setFormData({ current_password: '', new_password: '', confirm_password: '' });
     } catch {
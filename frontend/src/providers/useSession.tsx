@@ -7,7 +7,7 @@ interface SessionContextType {
   user: UserI | null;
   isAuthenticated: boolean;
   isLoading: boolean;
-  login: (token: string) => Promise<void>;
+  login: (token: string, refresh?: string) => Promise<void>;
   logout: () => void;
 }
 
@@ -39,8 +39,9 @@ export const SessionProvider: React.FC<{ children: React.ReactNode }> = ({ child
     }
   };
 
-  const login = async (token: string) => {
+  const login = async (token: string, refresh?: string) => {
     localStorage.setItem("token", token);
+    if (refresh) localStorage.setItem("refresh", refresh);
     try {
       const response = await api.get("/api/users/me/");
       setUser(response.data);
@@ -52,6 +53,7 @@ export const SessionProvider: React.FC<{ children: React.ReactNode }> = ({ child
 
   const logout = (redirect: boolean = true) => {
     localStorage.removeItem("token");
+    localStorage.removeItem("refresh");
     setUser(null);
     if (redirect) navigate("/login");
   };